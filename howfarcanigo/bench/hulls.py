@@ -0,0 +1,308 @@
+import argparse
+import datetime as dt
+import json
+import math
+import os
+import platform
+import sys
+import time
+import numpy as np
+from shapely.geometry import Polygon
+from geomath import hulls
+
+"""
+This module benchmarks geomath.hulls.ConcaveHull in isolation.
+
+Reproducible point clouds shaped like the data the pipeline hulls are generated
+    for each size, the hull calculated, and the time, number of attempts (one
+    per value of k tried) and whether the hull is a simple polygon covering
+    every point are recorded. Results can be saved as a baseline and later
+    runs compared against it, so a change to the hull engine is judged on
+    speed and correctness together.
+
+Run from the howfarcanigo directory:
+    python -m bench.hulls --output data/bench/hulls_baseline.json
+    python -m bench.hulls --compare data/bench/hulls_baseline.json
+"""
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+# centre and half extent in degrees of the area the clouds are placed in
+CENTRE = (-0.127758, 51.507351)
+HALF_EXTENT = (0.375, 0.25)
+COVER_TOLERANCE = 1e-7
+
+
+def _lattice(n, inside):
+    """
+    Lattice points in [-1, 1]^2 kept by a mask function, about n of them
+
+    Args:
+        n (int): approximate number of points wanted
+        inside (function): takes x and y arrays, returns a boolean mask
+
+    Returns:
+        (numpy array): (M, 2) points
+    """
+    # estimate the fraction of the square kept, then choose the lattice spacing
+    axis = np.linspace(-1, 1, 201)
+    x, y = np.meshgrid(axis, axis)
+    fraction = max(inside(x, y).mean(), 1e-3)
+    side = max(int(math.ceil(math.sqrt(n/fraction))), 3)
+    axis = np.linspace(-1, 1, side)
+    x, y = np.meshgrid(axis, axis)
+    mask = inside(x, y)
+    return np.column_stack([x[mask], y[mask]])
+
+
+def _to_degrees(points):
+    """Place points in [-1, 1]^2 onto (longitude, latitude) around CENTRE"""
+    return np.asarray(CENTRE) + points*np.asarray(HALF_EXTENT)
+
+
+def lattice_blob(n, rng):
+    """A single lattice island with a wavy boundary, as reached within one cutoff"""
+    phases = rng.uniform(0, 2*np.pi, 3)
+    def _inside(x, y):
+        angle = np.arctan2(y, x)
+        radius = 0.75 + 0.12*np.sin(3*angle + phases[0]) + 0.06*np.sin(7*angle + phases[1]) \
+            + 0.04*np.sin(11*angle + phases[2])
+        return np.hypot(x, y) < radius
+    return _to_degrees(_lattice(n, _inside))
+
+
+def multi_island(n, rng, gap=0.5):
+    """
+    Four lattice blobs whose edges come within a couple of lattice spacings,
+        so a single hull has to bridge the gaps between them
+    """
+    # the discs fill pi*radius**2 of the square, which sets the lattice spacing,
+    # and the spacing sets the radius, so refine the two together
+    side = 3
+    for _ in range(3):
+        spacing = 2/(max(side, 3) - 1)
+        radius = 0.5 - gap*spacing/2
+        side = max(int(math.ceil(math.sqrt(n/(np.pi*radius**2)))), 3)
+    spacing = 2/(side - 1)
+    radii = 0.5 - gap*spacing/2 - rng.uniform(0, spacing, 4)
+    centres = [(-0.5, -0.5), (-0.5, 0.5), (0.5, -0.5), (0.5, 0.5)]
+    axis = np.linspace(-1, 1, side)
+    x, y = np.meshgrid(axis, axis)
+    mask = np.zeros(x.shape, dtype=bool)
+    for (cx, cy), radius in zip(centres, radii):
+        mask |= np.hypot(x - cx, y - cy) < radius
+    return _to_degrees(np.column_stack([x[mask], y[mask]]))
+
+
+def ring_with_hole(n, rng):
+    """A lattice annulus, as when the area around a station is reached before its surroundings"""
+    inner = rng.uniform(0.3, 0.45)
+    def _inside(x, y):
+        radius = np.hypot(x, y)
+        return (radius < 0.9) & (radius > inner)
+    return _to_degrees(_lattice(n, _inside))
+
+
+def transit_scatter(n, rng, lines=5, stations=12):
+    """
+    Irregular points clustered around stations along straight lines out of
+        the centre, with uniform noise, as reached by public transport
+    """
+    angles = rng.uniform(0, 2*np.pi, lines)
+    distances = np.linspace(0.05, 0.9, stations)
+    station_points = np.concatenate([np.column_stack([distances*np.cos(angle), distances*np.sin(angle)])
+                                     for angle in angles])
+    num_noise = n//5
+    choice = rng.integers(0, len(station_points), n - num_noise)
+    clustered = station_points[choice] + rng.normal(0, 0.04, (n - num_noise, 2))
+    noise = rng.uniform(-0.5, 0.5, (num_noise, 2))
+    return _to_degrees(np.clip(np.concatenate([clustered, noise]), -1, 1))
+
+
+CLOUDS = {'lattice_blob': lattice_blob,
+          'multi_island': multi_island,
+          'ring_with_hole': ring_with_hole,
+          'transit_scatter': transit_scatter}
+
+
+def make_cloud(name, n, seed=0):
+    """
+    Generate a reproducible point cloud
+
+    Args:
+        name (str): one of CLOUDS
+        n (int): approximate number of points
+        seed (int): random seed
+
+    Returns:
+        (numpy array): (M, 2) (longitude, latitude) points
+    """
+    if name not in CLOUDS:
+        raise ValueError('Unknown point cloud {}, choose from {}'.format(name, ', '.join(CLOUDS)))
+    return CLOUDS[name](n, np.random.default_rng(seed))
+
+
+def check_hull(hull, points, tolerance=COVER_TOLERANCE):
+    """
+    Check a hull independently of the hull engine's own checks
+
+    Args:
+        hull (numpy array): (M, 2) hull vertices, or None if no hull was found
+        points (numpy array): (N, 2) points the hull must cover
+        tolerance (double): distance in degrees a point may lie outside the hull
+
+    Returns:
+        (bool): whether the hull is a simple polygon
+        (int): number of points not covered by the hull
+    """
+    if hull is None or len(hull) < 4:
+        return False, len(points)
+    polygon = Polygon(hull)
+    covering = polygon.buffer(tolerance)
+    try:
+        from shapely import contains_xy # shapely 2
+        covered = contains_xy(covering, points[:, 0], points[:, 1])
+    except ImportError:
+        from shapely.vectorized import contains
+        covered = contains(covering, points[:, 0], points[:, 1])
+    return bool(polygon.is_valid), int((~covered).sum())
+
+
+def run_case(name, n, seed=0, search='linear', repeat=3):
+    """
+    Time the concave hull of one point cloud
+
+    Args:
+        name (str): one of CLOUDS
+        n (int): approximate number of points
+        seed (int): random seed
+        search (str): ConcaveHull search, 'linear' or 'gallop'
+        repeat (int): number of times to calculate the hull, the fastest is kept
+
+    Returns:
+        (dict): cloud, size, time, attempts, k and correctness of the hull
+    """
+    points = make_cloud(name, n, seed)
+    best = None
+    for _ in range(repeat):
+        # the hull is built from scratch each time, so no neighbours are reused
+        start = time.perf_counter()
+        concave_hull = hulls.ConcaveHull(points, search=search)
+        hull = concave_hull.calculate()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    simple, uncovered = check_hull(hull, np.unique(points, axis=0))
+    return {'cloud': name,
+            'size': n,
+            'points': len(points),
+            'seconds': round(best, 6),
+            'attempts': concave_hull.attempts,
+            'k': None if concave_hull.k is None else int(concave_hull.k),
+            'vertices': 0 if hull is None else len(hull),
+            'found': hull is not None,
+            'simple': simple,
+            'uncovered': uncovered}
+
+
+def run_benchmark(clouds=tuple(CLOUDS), sizes=DEFAULT_SIZES, seed=0, search='linear', repeat=3):
+    """
+    Run every point cloud at every size
+
+    Returns:
+        (dict): environment, settings and one result per cloud and size
+    """
+    results = {'created': dt.datetime.utcnow().isoformat(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.machine(),
+               'settings': {'seed': seed, 'search': search, 'repeat': repeat},
+               'cases': []}
+    for name in clouds:
+        for n in sizes:
+            case = run_case(name, n, seed, search, repeat)
+            results['cases'].append(case)
+            print(describe_case(case))
+    return results
+
+
+def describe_case(case):
+    """One line summary of a benchmark case"""
+    status = 'ok' if case['found'] and case['simple'] and not case['uncovered'] else \
+        'FAILED (found={found}, simple={simple}, uncovered={uncovered})'.format(**case)
+    return '{:<16} {:>7} points {:>9.3f}s attempts {:>2} k {!s:>4} {}'.format(
+        case['cloud'], case['points'], case['seconds'], case['attempts'], case['k'], status)
+
+
+def compare(baseline, results, tolerance=0.2, min_seconds=0.01):
+    """
+    Compare results against a baseline, case by case
+
+    A case regresses if it is more than `tolerance` and `min_seconds` slower,
+    needs more attempts, or its hull is no longer found, simple or covering
+    where the baseline's was.
+
+    Args:
+        baseline (dict): results loaded from a baseline file
+        results (dict): results of this run
+        tolerance (double): fractional slow down allowed before reporting a regression
+        min_seconds (double): slow down in seconds below which timing noise is ignored
+
+    Returns:
+        (list): descriptions of the regressions found
+    """
+    if baseline['settings'] != results['settings']:
+        print('Warning: baseline settings {} differ from {}'.format(baseline['settings'], results['settings']))
+    baseline_cases = {(case['cloud'], case['size']): case for case in baseline['cases']}
+    regressions = []
+    print('\n{:<16} {:>7} {:>10} {:>10} {:>7}'.format('cloud', 'size', 'baseline', 'now', 'ratio'))
+    for case in results['cases']:
+        old = baseline_cases.get((case['cloud'], case['size']))
+        if old is None:
+            continue
+        ratio = case['seconds']/old['seconds'] if old['seconds'] else float('inf')
+        print('{:<16} {:>7} {:>9.3f}s {:>9.3f}s {:>6.2f}x'.format(
+            case['cloud'], case['size'], old['seconds'], case['seconds'], ratio))
+        label = '{} at {}'.format(case['cloud'], case['size'])
+        if ratio > 1 + tolerance and case['seconds'] - old['seconds'] > min_seconds:
+            regressions.append('{} is {:.2f}x slower'.format(label, ratio))
+        if case['attempts'] > old['attempts']:
+            regressions.append('{} needs {} attempts, was {}'.format(label, case['attempts'], old['attempts']))
+        for check in ('found', 'simple'):
+            if old[check] and not case[check]:
+                regressions.append('{} is no longer {}'.format(label, check))
+        if case['uncovered'] > old['uncovered']:
+            regressions.append('{} leaves {} points uncovered, was {}'.format(label, case['uncovered'], old['uncovered']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ConcaveHull on synthetic point clouds')
+    parser.add_argument('--clouds', nargs='+', default=list(CLOUDS), choices=list(CLOUDS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='approximate points per cloud')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--search', default='linear', choices=['linear', 'gallop'])
+    parser.add_argument('--repeat', type=int, default=3, help='hulls calculated per case, the fastest is kept')
+    parser.add_argument('--output', help='JSON file to write results to, e.g. a new baseline')
+    parser.add_argument('--compare', help='baseline JSON file to compare results against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='fractional slow down allowed when comparing')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.clouds, args.sizes, args.seed, args.search, args.repeat)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print('Results written to {}'.format(args.output))
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import resource
+import time
+import tracemalloc
+import numpy as np
+from mapping import generate, transform, draw
+from bench.standin import StandInServer
+
+"""
+This module benchmarks the full pipeline against the local distancematrix stand-in.
+
+For each lattice size N the stages run by main.py are timed separately:
+    generate_points -> retrieve_travel_times -> group_coords
+    -> generate_hull_arrays -> draw_folium_map (rendered to html)
+and the time and peak traced memory of each stage are written as JSON, so
+    results from different commits can be compared.
+
+Run from the howfarcanigo directory:
+    python -m bench.pipeline --sizes 10 50 100 --output data/bench/pipeline.json
+"""
+
+STAGES = ('generate_points', 'retrieve_travel_times', 'group_coords',
+          'generate_hull_arrays', 'draw_folium_map')
+DEFAULT_SIZES = (10, 50, 100, 200, 500)
+DEFAULT_ORIGIN = {'origin_lat': 51.507351, 'origin_lng': -0.127758}
+DEFAULT_CUTOFFS = [0, 10, 20, 30, 60]
+
+
+class StageTimer(object):
+    """
+    Records the wall time and peak traced memory of named stages
+
+    Args:
+        trace_memory (bool): trace allocations with tracemalloc, which slows
+            pure Python code down but not numpy
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.stages[name] = {'seconds': round(seconds, 6), 'peak_bytes': peak}
+
+
+def run_pipeline(N, server, map_type='local', origin_coords=DEFAULT_ORIGIN,
+                 global_coords=None, cutoff_mins=DEFAULT_CUTOFFS, travel_mode='transit',
+                 hull_search='linear', processes=1, trace_memory=True, quiet=True):
+    """
+    Run every stage of the pipeline once for an N x N lattice
+
+    Args:
+        N (int): N**2 is the number of destination coordinates
+        server (StandInServer): running stand-in the travel times are requested from
+        map_type (string): 'local' or 'global'
+        origin_coords (dict): origin coordinates
+        global_coords (dict): maximum and minimum coordinates if generating a global map
+        cutoff_mins (list): cutoff times in minutes
+        travel_mode (string): 'transit' or 'walking'
+        hull_search (string): passed to transform.generate_hull_arrays
+        processes (int): passed to transform.generate_hull_arrays
+        trace_memory (bool): record the peak traced memory of each stage
+        quiet (bool): hide the progress printed by each stage
+
+    Returns:
+        (dict): lattice size, point counts and the time and peak memory of each stage
+    """
+    timer = StageTimer(trace_memory)
+    requests_before = server.requests
+    output = io.StringIO() if quiet else None
+    with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        with timer.stage('generate_points'):
+            dest_lats, dest_lngs = generate.generate_points(map_type, N, origin_coords, global_coords)
+        with timer.stage('retrieve_travel_times'):
+            lats, lngs, travel_times = generate.retrieve_travel_times(
+                dest_lats, dest_lngs, 'benchmark', travel_mode, departure_time='0',
+                api_url=server.url, requests_per_second=None, elements_per_second=None,
+                **origin_coords)
+        with timer.stage('group_coords'):
+            grouped_coords = transform.group_coords(lats, lngs, travel_times, cutoff_mins)
+        with timer.stage('generate_hull_arrays'):
+            cutoff_hull_arrays = transform.generate_hull_arrays(grouped_coords, num_bins=4,
+                                                                hull_search=hull_search,
+                                                                processes=processes)
+        with timer.stage('draw_folium_map'):
+            map_object = draw.draw_folium_map(cutoff_hull_arrays, cutoff_mins, draw.default_cmap(), **origin_coords)
+            html = map_object.get_root().render()
+
+    return {'N': N,
+            'points': len(dest_lats),
+            'reachable': len(lats),
+            'requests': server.requests - requests_before,
+            'islands': [len(islands) for islands in cutoff_hull_arrays],
+            'html_bytes': len(html),
+            'stages': timer.stages,
+            'total_seconds': round(sum(stage['seconds'] for stage in timer.stages.values()), 6)}
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, latency=0.0, jitter=0.0, error_rate=0.0,
+                  unreachable_rate=0.02, seed=0, **pipeline_kwargs):
+    """
+    Run the pipeline for each lattice size against a fresh stand-in server
+
+    A size that fails (e.g. because error_rate makes a request fail) is recorded
+    with its error rather than stopping the benchmark.
+
+    Args:
+        sizes (list): lattice sizes N to run
+        latency, jitter, error_rate, unreachable_rate, seed: passed to StandInServer
+        pipeline_kwargs: passed to run_pipeline
+
+    Returns:
+        (dict): environment, settings and one result per size
+    """
+    settings = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+                'unreachable_rate': unreachable_rate, 'seed': seed}
+    settings.update({key: value for key, value in pipeline_kwargs.items() if key != 'quiet'})
+    results = {'created': dt.datetime.utcnow().isoformat(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.machine(),
+               'cpus': os.cpu_count(),
+               'settings': settings,
+               'runs': []}
+    for N in sizes:
+        with StandInServer(latency=latency, jitter=jitter, error_rate=error_rate,
+                           unreachable_rate=unreachable_rate, seed=seed) as server:
+            try:
+                run = run_pipeline(N, server, **pipeline_kwargs)
+            except Exception as error:
+                run = {'N': N, 'error': repr(error)}
+        results['runs'].append(run)
+        print(describe_run(run))
+    # peak resident memory of the whole process, kilobytes on Linux
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def describe_run(run):
+    """One line summary of a benchmark run"""
+    if 'error' in run:
+        return 'N={:<4} failed: {}'.format(run['N'], run['error'])
+    stages = ', '.join('{} {:.2f}s'.format(name, stage['seconds']) for name, stage in run['stages'].items())
+    return 'N={:<4} {:>7} points, total {:.2f}s ({})'.format(run['N'], run['points'], run['total_seconds'], stages)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline against a local distancematrix stand-in')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='lattice sizes N')
+    parser.add_argument('--output', default='data/bench/pipeline.json', help='JSON file to write results to')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--unreachable-rate', type=float, default=0.02, help='fraction of unreachable destinations')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hull-search', default='linear', choices=['linear', 'gallop'])
+    parser.add_argument('--processes', type=int, default=1, help='processes used to calculate hulls')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace memory, for lower overhead')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.sizes, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, unreachable_rate=args.unreachable_rate,
+                            seed=args.seed, hull_search=args.hull_search,
+                            processes=args.processes, trace_memory=not args.no_memory)
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
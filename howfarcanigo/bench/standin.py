@@ -0,0 +1,202 @@
+import json
+import random
+import threading
+import time
+import numpy as np
+import polyline
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+"""
+This module contains a local stand-in for the Google distancematrix api.
+
+Travel times are synthesised from the great circle distance between origin and
+    destination and a speed field, so the pipeline can be run and timed without
+    an API key. Latency and failures can be added to mimic the live service.
+
+    server = StandInServer(latency=0.05, error_rate=0.01).start()
+    generate.retrieve_travel_times(..., api_url=server.url)
+    server.stop()
+"""
+
+EARTH_RADIUS = 6371000 # metres
+
+
+def haversine_distance(lat1, lng1, lat2, lng2):
+    """
+    Great circle distance between coordinates, vectorised over arrays
+
+    Args:
+        lat1, lng1 (double or numpy array): first coordinates in degrees
+        lat2, lng2 (double or numpy array): second coordinates in degrees
+
+    Returns:
+        (numpy array): distances in metres
+    """
+    lat1, lng1, lat2, lng2 = [np.radians(np.asarray(x, dtype=float)) for x in (lat1, lng1, lat2, lng2)]
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lng2 - lng1)/2)**2
+    return 2*EARTH_RADIUS*np.arcsin(np.sqrt(a))
+
+
+def uniform_speed(speed=1.4):
+    """
+    Speed field with the same speed everywhere, 1.4 m/s is a walking pace
+
+    Returns:
+        (function): speed field taking destination and origin coordinates
+    """
+    def _speed(lats, lngs, origin_lat, origin_lng):
+        return np.full(np.shape(lats), float(speed))
+    return _speed
+
+
+def radial_speed(centre_speed=12.0, edge_speed=3.0, scale=5000.0):
+    """
+    Speed field that is fastest near the origin and slows with distance,
+        roughly how public transport thins out away from a city centre
+
+    Args:
+        centre_speed (double): average speed close to the origin in m/s
+        edge_speed (double): average speed far from the origin in m/s
+        scale (double): distance in metres over which the speed decays
+
+    Returns:
+        (function): speed field taking destination and origin coordinates
+    """
+    def _speed(lats, lngs, origin_lat, origin_lng):
+        distance = haversine_distance(origin_lat, origin_lng, lats, lngs)
+        return edge_speed + (centre_speed - edge_speed)*np.exp(-distance/scale)
+    return _speed
+
+
+class StandInServer(object):
+    """
+    Local HTTP server answering distancematrix requests with synthetic travel times
+
+    Args:
+        speed_field (function): takes destination latitudes, longitudes and an origin
+            latitude and longitude, returns average speeds in m/s. Defaults to radial_speed()
+        latency (double): seconds to wait before answering each request
+        jitter (double): extra latency drawn uniformly from [0, jitter] seconds
+        error_rate (double): fraction of requests answered with a top-level
+            UNKNOWN_ERROR status and no rows
+        unreachable_rate (double): fraction of destinations answered with ZERO_RESULTS.
+            Chosen per coordinate, so repeated requests agree
+        max_travel_time (double): destinations further than this in seconds are
+            ZERO_RESULTS, None for no limit
+        seed (int): seed for latency and errors, so runs are reproducible
+    """
+
+    def __init__(self, speed_field=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 unreachable_rate=0.0, max_travel_time=None, seed=0):
+        self.speed_field = speed_field if speed_field is not None else radial_speed()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.unreachable_rate = unreachable_rate
+        self.max_travel_time = max_travel_time
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.elements = 0
+        self.httpd = None
+
+    @property
+    def url(self):
+        """Base url to pass to generate.retrieve_travel_times as api_url"""
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/maps/api/distancematrix/json?'.format(host, port)
+
+    def start(self, host='127.0.0.1', port=0):
+        """
+        Serve requests from a background thread
+
+        Args:
+            host (str): address to bind to
+            port (int): port to bind to, 0 picks a free one
+
+        Returns:
+            (StandInServer): self, to allow chaining
+        """
+        server = self
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, as the real api
+            def do_GET(self):
+                status, body = server.respond(parse_qs(urlparse(self.path).query))
+                body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _unreachable(self, lats, lngs):
+        """Deterministic pseudo-random choice of unreachable destinations"""
+        if not self.unreachable_rate:
+            return np.zeros(len(lats), dtype=bool)
+        # hash the coordinates at the precision they were encoded to
+        keys = (np.round(lats*1e5).astype(np.int64)*73856093) ^ (np.round(lngs*1e5).astype(np.int64)*19349663)
+        return (keys % 10007)/10007 < self.unreachable_rate
+
+    def respond(self, query):
+        """
+        Build the response to a distancematrix query
+
+        Args:
+            query (dict): parsed query string, as from urllib.parse.parse_qs
+
+        Returns:
+            (int): HTTP status code
+            (dict): JSON body
+        """
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        try:
+            origins = [[float(x) for x in origin.split(',')] for origin in query['origins'][0].split('|')]
+            destinations = query['destinations'][0]
+            if destinations.startswith('enc:'):
+                destinations = np.array(polyline.decode(destinations[4:].rstrip(':'), 5), dtype=float)
+            else:
+                destinations = np.array([[float(x) for x in destination.split(',')]
+                                         for destination in destinations.split('|')])
+        except (KeyError, ValueError):
+            return 200, {'status': 'INVALID_REQUEST', 'rows': []}
+        if failed:
+            return 200, {'status': 'UNKNOWN_ERROR', 'rows': []}
+
+        lats, lngs = destinations[:, 0], destinations[:, 1]
+        unreachable = self._unreachable(lats, lngs)
+        rows = []
+        for origin_lat, origin_lng in origins:
+            distance = haversine_distance(origin_lat, origin_lng, lats, lngs)
+            durations = np.round(distance/self.speed_field(lats, lngs, origin_lat, origin_lng))
+            too_far = unreachable if self.max_travel_time is None else unreachable | (durations > self.max_travel_time)
+            rows.append({'elements': [{'status': 'ZERO_RESULTS'} if far else
+                                      {'status': 'OK',
+                                       'distance': {'value': int(metres)},
+                                       'duration': {'value': int(seconds)}}
+                                      for far, metres, seconds in zip(too_far, distance, durations)]})
+        with self.lock:
+            self.elements += len(origins)*len(lats)
+        return 200, {'status': 'OK', 'rows': rows}
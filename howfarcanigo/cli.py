@@ -0,0 +1,460 @@
+import argparse
+import datetime as dt
+import importlib
+import os
+import sys
+import time
+from functools import partial
+
+"""
+This module contains the command line interface.
+
+    howfarcanigo fetch     retrieve travel times for the configured origins
+    howfarcanigo hulls     calculate concave hulls from the saved travel times
+    howfarcanigo render    draw the saved hulls as an html map and GeoJSON
+    howfarcanigo run       all three in turn, as main.py does, optionally
+                           refreshing the map while travel times arrive
+    howfarcanigo sweep     fetch and calculate hulls for a range of departure times
+
+Modules are imported when a subcommand first needs them, so a fetch does not
+    pay for the plotting and geometry libraries, and the time spent importing
+    is reported at the end of each command.
+Paths are relative to the working directory, which should contain data/.
+"""
+
+# the package modules import each other as top-level `mapping`, `geomath` and `utils`
+_HERE = os.path.dirname(os.path.abspath(__file__))
+if _HERE not in sys.path:
+    sys.path.insert(0, _HERE)
+
+_import_seconds = {}
+
+
+def lazy_import(name):
+    """
+    Import a module, recording how long it took if it was not already loaded
+
+    Args:
+        name (str): module name, e.g. 'mapping.transform'
+
+    Returns:
+        (module): the module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_seconds[name] = time.perf_counter() - start
+    return module
+
+
+def hull_path(data_name):
+    return 'data/hulls/{}.hulls.npz'.format(data_name)
+
+
+def map_path(data_name):
+    return 'data/{}.html'.format(data_name)
+
+
+def geojson_path(data_name):
+    return 'data/{}.geojson'.format(data_name)
+
+
+def sweep_path(data_name):
+    return 'data/hulls/{}.sweep'.format(data_name)
+
+
+def read_settings():
+    """
+    Read the configuration and name the data of each origin
+
+    Returns:
+        (dict): configuration values, the origins and their data names
+    """
+    configure = lazy_import('mapping.configure')
+    API_key, origin_string, origin_coords, \
+        travel_mode, map_type, global_coords, \
+        N, cutoff_mins = configure.read_config()
+    origins = configure.read_origins(origin_string, origin_coords)
+    # Define what we will call the data, one set per origin
+    data_name = '{}_{}map_N{}'.format(travel_mode, map_type, N)
+    data_names = [data_name] if len(origins) == 1 else \
+        ['{}_{}'.format(data_name, name.replace(' ', '_')) for name, _ in origins]
+    return {'API_key': API_key, 'origins': origins, 'data_names': data_names,
+            'travel_mode': travel_mode, 'map_type': map_type,
+            'global_coords': global_coords, 'N': N, 'cutoff_mins': cutoff_mins}
+
+
+def offline_provider(settings, args, departure_time):
+    """
+    Load the GTFS feed or street network given in place of the API
+
+    Returns:
+        (function): takes destination latitudes and longitudes and origin coordinates,
+            and returns the reachable latitudes, longitudes and travel times
+    """
+    if args.gtfs:
+        if settings['travel_mode'] != 'transit':
+            raise SystemExit('A GTFS feed can only be used for transit')
+        transit = lazy_import('mapping.transit')
+        service_day, _ = transit.service_time(departure_time)
+        return partial(transit.retrieve_travel_times, timetable=transit.load_gtfs(args.gtfs, service_day),
+                       departure_time=departure_time)
+    if settings['travel_mode'] != 'walking':
+        raise SystemExit('A street network can only be used for walking')
+    walking = lazy_import('mapping.walking')
+    # no destination beyond the largest cutoff is drawn, so the search stops there
+    return partial(walking.retrieve_travel_times, graph=walking.load_streets(args.streets),
+                   max_seconds=max(settings['cutoff_mins'])*60)
+
+
+def fetch(settings, args):
+    """
+    Retrieve and save travel times for every origin without saved data
+
+    Returns:
+        (list): (lats, lngs, travel_times) of each origin
+    """
+    configure = lazy_import('mapping.configure')
+    telemetry = lazy_import('utils.telemetry')
+    origins, data_names = settings['origins'], settings['data_names']
+
+    # Import data if available for specifications
+    with telemetry.timer('stage', stage='import_data'):
+        imported = [configure.import_data(name) for name in data_names]
+    missing = [index for index, (_, _, travel_times) in enumerate(imported) if not len(travel_times)]
+    if not missing:
+        print('Travel times already saved for every origin')
+        return imported
+
+    generate = lazy_import('mapping.generate')
+    cache = lazy_import('mapping.cache')
+    dataset = lazy_import('mapping.dataset')
+    journal = lazy_import('mapping.journal')
+    map_type, N, global_coords = settings['map_type'], settings['N'], settings['global_coords']
+    # Reuse travel times to any points already queried from these origins
+    travel_time_cache = cache.TravelTimeCache('data/coords/travel_times.sqlite')
+    departure_time = generate.next_best_date()
+    # e.g. the local stand-in from bench.standin
+    api_url = {'api_url': args.api_url} if args.api_url else {}
+    stream_every = getattr(args, 'stream', 0)
+    departures = {index: departure_time for index in missing}
+    with telemetry.timer('stage', stage='retrieve_travel_times'):
+        if args.adaptive:
+            if stream_every:
+                print('Travel times are refined round by round, so previews are not streamed')
+            adaptive = lazy_import('mapping.adaptive')
+            offline = offline_provider(settings, args, departure_time) if args.gtfs or args.streets else None
+            results, destinations = [], []
+            for index in missing:
+                # each round depends on the travel times before it, so rounds are not journaled
+                retrieve = partial(offline, **origins[index][1]) if offline is not None else \
+                    partial(generate.retrieve_travel_times, API_key=settings['API_key'],
+                            travel_mode_=settings['travel_mode'], departure_time=departure_time,
+                            cache=travel_time_cache, **api_url, **origins[index][1])
+                lats, lngs, travel_times = adaptive.sample_travel_times(
+                    retrieve, map_type, N, origins[index][1], global_coords, settings['cutoff_mins'],
+                    coarse_N=args.adaptive)
+                results.append((lats, lngs, travel_times))
+                # unreachable points are dropped while sampling, so none are saved as failed
+                destinations.append((lats, lngs))
+        elif args.gtfs or args.streets:
+            if stream_every:
+                print('Travel times are found offline all at once, so previews are not streamed')
+            # local timetables or streets replace the API, so there is nothing to cache or journal
+            retrieve = offline_provider(settings, args, departure_time)
+            results, destinations = [], []
+            for index in missing:
+                dest_lats, dest_lngs = generate.generate_points(map_type, N, origins[index][1], global_coords)
+                results.append(retrieve(dest_lats, dest_lngs, **origins[index][1]))
+                destinations.append((dest_lats, dest_lngs))
+        elif map_type == 'global' and len(missing) > 1:
+            if stream_every:
+                print('Origins are packed into shared requests, so previews are not streamed')
+            # Every origin shares the global lattice, so pack several origins into each request
+            dest_lats, dest_lngs = generate.generate_points(map_type, N, origins[0][1], global_coords)
+            results = generate.retrieve_travel_times_multi(
+                dest_lats, dest_lngs, settings['API_key'], settings['travel_mode'],
+                [origins[index][1] for index in missing],
+                departure_time=departure_time, cache=travel_time_cache, **api_url)
+            destinations = [(dest_lats, dest_lngs)]*len(missing)
+        else:
+            # If data does not exist, generate points to travel to
+            results, destinations = [], []
+            for index in missing:
+                dest_lats, dest_lngs = generate.generate_points(map_type, N, origins[index][1], global_coords)
+                retrieve_args = (dest_lats, dest_lngs, settings['API_key'], settings['travel_mode'])
+                # every response is journaled, so an interrupted fetch resumes where it stopped
+                sweep = journal.read_sweep(configure.journal_path(data_names[index]))
+                if sweep is not None and sweep['departure_time'] != departure_time:
+                    print('Resuming the journaled fetch departing at {}'.format(sweep['departure_time']))
+                    departures[index] = sweep['departure_time']
+                retrieve_kwargs = dict(departure_time=departures[index], cache=travel_time_cache,
+                                       journal=journal.ChunkJournal(configure.journal_path(data_names[index])),
+                                       **api_url, **origins[index][1])
+                if stream_every:
+                    # refresh the map and GeoJSON every few chunks while the rest arrive
+                    stream = lazy_import('mapping.stream')
+                    preview = partial(stream.write_preview, data_name=data_names[index],
+                                      origin_coords=origins[index][1], num_bins=args.num_bins,
+                                      hull_search=args.hull_search, processes=args.processes,
+                                      incremental=args.incremental)
+                    streamed = stream.TravelTimeStream(dest_lats, dest_lngs, settings['cutoff_mins'])
+                    # render draws the map and GeoJSON of the complete travel times, not a last preview
+                    stream.consume(generate.iter_travel_times(*retrieve_args, **retrieve_kwargs),
+                                   streamed, stream_every, preview, final_refresh=False)
+                    results.append(streamed.arrays())
+                else:
+                    results.append(generate.retrieve_travel_times(*retrieve_args, **retrieve_kwargs))
+                destinations.append((dest_lats, dest_lngs))
+    travel_time_cache.close()
+
+    # Save data to save future API calls
+    for index, (lats, lngs, travel_times), (dest_lats, dest_lngs) in zip(missing, results, destinations):
+        with telemetry.timer('stage', stage='save_data', data=data_names[index]):
+            data = dataset.TravelTimeDataset.create(
+                configure.dataset_path(data_names[index]),
+                origin_string=origins[index][0], travel_mode=settings['travel_mode'],
+                map_type=map_type, N=N, departure_time=departures[index],
+                source=os.path.basename(args.gtfs or args.streets or 'distancematrix'),
+                adaptive=args.adaptive,
+                **origins[index][1])
+            data.append_round(lats, lngs, travel_times,
+                              *dataset.failed_points(dest_lats, dest_lngs, lats, lngs))
+        # the responses are saved in the dataset now
+        journal.ChunkJournal(configure.journal_path(data_names[index])).remove()
+        imported[index] = (lats, lngs, travel_times)
+    return imported
+
+
+def hulls(settings, args, travel_times_=None):
+    """
+    Calculate and save the hull arrays of every origin
+
+    Args:
+        travel_times_ (list): (lats, lngs, travel_times) of each origin, read from
+            the saved data if not given
+
+    Returns:
+        (list): hull arrays of each origin
+    """
+    configure = lazy_import('mapping.configure')
+    dataset = lazy_import('mapping.dataset')
+    telemetry = lazy_import('utils.telemetry')
+    if travel_times_ is None:
+        with telemetry.timer('stage', stage='import_data'):
+            travel_times_ = [configure.import_data(name) for name in settings['data_names']]
+    transform = lazy_import('mapping.transform')
+
+    all_hull_arrays = []
+    for data_name, (lats, lngs, travel_times) in zip(settings['data_names'], travel_times_):
+        if not len(travel_times):
+            raise SystemExit('No travel times saved for {}, run fetch first'.format(data_name))
+        # adaptive samples are sparse away from the cutoff boundaries, until densified onto a lattice
+        metadata = dataset.TravelTimeDataset(configure.dataset_path(data_name)).metadata
+        local_spacing = bool(metadata.get('adaptive')) and not args.densify
+        if args.densify:
+            interpolate = lazy_import('mapping.interpolate')
+            report = interpolate.cross_validate(lats, lngs, travel_times, settings['cutoff_mins'],
+                                                method=args.interpolation)
+            interpolate.describe_cross_validation(report)
+            telemetry.event('interpolation', data=data_name, method=args.interpolation, **report)
+            with telemetry.timer('stage', stage='densify', data=data_name):
+                lats, lngs, travel_times = interpolate.densify(lats, lngs, travel_times, args.densify,
+                                                               method=args.interpolation)
+        with telemetry.timer('stage', stage='group_coords', data=data_name):
+            grouped_coords = transform.group_coords(lats, lngs, travel_times, settings['cutoff_mins'])
+        if args.contour:
+            contour = lazy_import('mapping.contour')
+            with telemetry.timer('stage', stage='generate_contour_arrays', data=data_name):
+                try:
+                    cutoff_hull_arrays = contour.generate_contour_arrays(lats, lngs, travel_times,
+                                                                         settings['cutoff_mins'],
+                                                                         num_bins=args.num_bins)
+                except ValueError as error:
+                    raise SystemExit('Cannot contour {}: {}'.format(data_name, error))
+        else:
+            with telemetry.timer('stage', stage='generate_hull_arrays', data=data_name):
+                cutoff_hull_arrays = transform.generate_hull_arrays(grouped_coords, num_bins=args.num_bins,
+                                                                    hull_search=args.hull_search,
+                                                                    processes=args.processes,
+                                                                    incremental=args.incremental,
+                                                                    local_spacing=local_spacing)
+        if args.buffer:
+            with telemetry.timer('stage', stage='buffer_hulls', data=data_name):
+                cutoff_hull_arrays = transform.buffer_hull_arrays(cutoff_hull_arrays, args.buffer)
+        transform.describe_cutoffs(settings['cutoff_mins'], grouped_coords)
+        dataset.save_hull_arrays(hull_path(data_name), cutoff_hull_arrays)
+        all_hull_arrays.append(cutoff_hull_arrays)
+    return all_hull_arrays
+
+
+def render(settings, args, hull_arrays_=None):
+    """
+    Draw the hull arrays of every origin as an html map, and save them as GeoJSON
+
+    Args:
+        hull_arrays_ (list): hull arrays of each origin, read from the saved
+            hulls if not given
+    """
+    dataset = lazy_import('mapping.dataset')
+    telemetry = lazy_import('utils.telemetry')
+    if hull_arrays_ is None:
+        hull_arrays_ = []
+        for data_name in settings['data_names']:
+            if not os.path.exists(hull_path(data_name)):
+                raise SystemExit('No hulls saved for {}, run hulls first'.format(data_name))
+            hull_arrays_.append(dataset.load_hull_arrays(hull_path(data_name)))
+    draw = lazy_import('mapping.draw')
+
+    for data_name, cutoff_hull_arrays, (_, origin_coords) in zip(settings['data_names'], hull_arrays_,
+                                                                   settings['origins']):
+        with telemetry.timer('stage', stage='draw_map', data=data_name):
+            # Could also use `draw.pick_random_cmap(len(cutoff_mins))`
+            if args.compact:
+                draw.save_compact_map(map_path(data_name), cutoff_hull_arrays, settings['cutoff_mins'],
+                                      draw.default_cmap(), tolerance=args.tolerance,
+                                      decimals=args.decimals, external=not args.embed, **origin_coords)
+            else:
+                map_object = draw.draw_folium_map(cutoff_hull_arrays, settings['cutoff_mins'],
+                                                  draw.default_cmap(), **origin_coords)
+                map_object.save(map_path(data_name))
+            # replaces any preview streamed while fetching
+            draw.save_geojson(geojson_path(data_name), cutoff_hull_arrays, settings['cutoff_mins'])
+        print('Map saved to {} and hulls to {}'.format(map_path(data_name), geojson_path(data_name)))
+        if args.compact and not args.embed:
+            print('Its layers are loaded separately, so serve data/ over HTTP to view it, '
+                  'e.g. `python -m http.server --directory data`')
+
+
+def sweep(settings, args):
+    """
+    Fetch travel times and calculate hulls for a range of departure times, for every origin
+
+    Hulls are saved per departure time, and drawn as a map with a time slider if asked.
+    """
+    generate = lazy_import('mapping.generate')
+    transform = lazy_import('mapping.transform')
+    sweep_module = lazy_import('mapping.sweep')
+    telemetry = lazy_import('utils.telemetry')
+    start, end = [dt.datetime.strptime(time_, '%H:%M').time() for time_ in (args.start, args.end)]
+    departure_times = sweep_module.departure_times(start, end, args.every)
+    print('Sweeping {} departures from {} to {}'.format(len(departure_times), args.start, args.end))
+    api_url = {'api_url': args.api_url} if args.api_url else {}
+
+    travel_time_cache = sweep_module.sweep_cache('data/coords/travel_times.sqlite', args.every)
+    for data_name, (_, origin_coords) in zip(settings['data_names'], settings['origins']):
+        dest_lats, dest_lngs = generate.generate_points(settings['map_type'], settings['N'],
+                                                        origin_coords, settings['global_coords'])
+        sweep_hulls = sweep_module.SweepHulls(num_bins=args.num_bins, hull_search=args.hull_search,
+                                              processes=args.processes, incremental=args.incremental)
+        sweep_hull_arrays = []
+        for departure_time, (lats, lngs, travel_times) in sweep_module.iter_sweep(
+                dest_lats, dest_lngs, settings['API_key'], settings['travel_mode'],
+                departure_times_=departure_times, cache=travel_time_cache, **api_url, **origin_coords):
+            if args.densify:
+                interpolate = lazy_import('mapping.interpolate')
+                lats, lngs, travel_times = interpolate.densify(lats, lngs, travel_times, args.densify,
+                                                               method=args.interpolation)
+            with telemetry.timer('stage', stage='sweep_hulls', data=data_name):
+                grouped_coords = transform.group_coords(lats, lngs, travel_times, settings['cutoff_mins'])
+                cutoff_hull_arrays = sweep_hulls.update(grouped_coords)
+                if args.buffer:
+                    cutoff_hull_arrays = transform.buffer_hull_arrays(cutoff_hull_arrays, args.buffer)
+                sweep_hull_arrays.append(cutoff_hull_arrays)
+        print('Calculated hulls for {} bins, reused {} unchanged'.format(sweep_hulls.calculated, sweep_hulls.reused))
+        sweep_module.save_sweep(sweep_path(data_name), departure_times, sweep_hull_arrays, settings['cutoff_mins'])
+        print('Sweep saved to {}'.format(sweep_path(data_name)))
+
+        if args.animate:
+            draw = lazy_import('mapping.draw')
+            with telemetry.timer('stage', stage='draw_map', data=data_name):
+                map_object = draw.draw_animated_map(sweep_hull_arrays, departure_times, settings['cutoff_mins'],
+                                                    draw.default_cmap(), every_mins=args.every, **origin_coords)
+                map_object.save(map_path(data_name + '_sweep'))
+            print('Map saved to {}'.format(map_path(data_name + '_sweep')))
+    travel_time_cache.close()
+
+
+def run(settings, args):
+    """Fetch, calculate hulls and render in turn, without reading back saved results"""
+    render(settings, args, hulls(settings, args, fetch(settings, args)))
+
+
+COMMANDS = {'fetch': fetch, 'hulls': hulls, 'render': render, 'run': run, 'sweep': sweep}
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='howfarcanigo', description='A personalised isochrone generator')
+    parser.add_argument('--telemetry', default=os.environ.get('HOWFARCANIGO_TELEMETRY'),
+                        help='file to write telemetry to, .prom for Prometheus, otherwise JSON lines')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fetch_parser = subparsers.add_parser('fetch', help='retrieve travel times for the configured origins')
+    run_parser = subparsers.add_parser('run', help='fetch, calculate hulls and render in turn')
+    sweep_parser = subparsers.add_parser('sweep', help='calculate hulls for a range of departure times')
+    sweep_parser.add_argument('--start', default='07:00', help='first departure, HH:MM')
+    sweep_parser.add_argument('--end', default='10:00', help='last departure, HH:MM')
+    sweep_parser.add_argument('--every', type=int, default=15, help='minutes between departures')
+    sweep_parser.add_argument('--animate', action='store_true', help='draw the sweep as a map with a time slider')
+    sweep_parser.add_argument('--api-url', help='base url of the distancematrix api, if not Google')
+    for subparser in (fetch_parser, run_parser):
+        subparser.add_argument('--api-url', help='base url of the distancematrix api, if not Google')
+        subparser.add_argument('--gtfs', metavar='FEED',
+                               help='GTFS zip to find transit travel times from offline, instead of the api')
+        subparser.add_argument('--streets', metavar='NETWORK',
+                               help='.osm, .osm.pbf or edge list .csv to find walking times from offline, '
+                                    'instead of the api')
+    for subparser in (fetch_parser, run_parser):
+        subparser.add_argument('--adaptive', type=int, default=0, metavar='COARSE_N',
+                               help='retrieve a COARSE_N x COARSE_N lattice first and refine it only '
+                                    'near cutoff boundaries, instead of every point')
+    run_parser.add_argument('--stream', type=int, default=0, metavar='M',
+                            help='refresh the map and GeoJSON every M chunks of travel times while fetching')
+    hulls_parser = subparsers.add_parser('hulls', help='calculate concave hulls from the saved travel times')
+    for subparser in (hulls_parser, run_parser, sweep_parser):
+        subparser.add_argument('--num-bins', type=int, default=4, help='number of cutoff bins to hull, -1 for all')
+        subparser.add_argument('--hull-search', default='linear', choices=['linear', 'gallop'])
+        subparser.add_argument('--processes', type=int, default=1, help='processes calculating hulls')
+        subparser.add_argument('--incremental', action='store_true', help='only recalculate islands that change between bins')
+        subparser.add_argument('--densify', type=int, default=0, metavar='N',
+                               help='interpolate travel times onto an N x N lattice before calculating hulls')
+        subparser.add_argument('--interpolation', default='linear', choices=['linear', 'idw'])
+        subparser.add_argument('--buffer', type=float, default=0, metavar='METRES',
+                               help='widen each cutoff time\'s islands by this distance, merging those that meet')
+    for subparser in (hulls_parser, run_parser):
+        subparser.add_argument('--contour', action='store_true',
+                               help='trace each cutoff time around the lattice by marching squares, '
+                                    'instead of calculating concave hulls of its islands')
+    render_parser = subparsers.add_parser('render', help='draw the saved hulls as an html map')
+    for subparser in (render_parser, run_parser):
+        subparser.add_argument('--compact', action='store_true',
+                               help='draw simplified, non-overlapping bands between cutoff times')
+        subparser.add_argument('--tolerance', type=float, default=1e-4,
+                               help='simplification tolerance of compact maps in degrees')
+        subparser.add_argument('--decimals', type=int, default=5,
+                               help='decimal places kept in the coordinates of compact maps')
+        subparser.add_argument('--embed', action='store_true',
+                               help='embed the layers of compact maps rather than writing GeoJSON files')
+    return parser
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    args = make_parser().parse_args(argv)
+    telemetry = lazy_import('utils.telemetry')
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    try:
+        COMMANDS[args.command](read_settings(), args)
+    finally:
+        telemetry.close()
+        total = time.perf_counter() - start
+        imported = sum(_import_seconds.values())
+        slowest = sorted(_import_seconds.items(), key=lambda item: -item[1])[:3]
+        print('{} took {:.2f}s, {:.2f}s of it importing ({})'.format(
+            args.command, total, imported,
+            ', '.join('{} {:.2f}s'.format(name, seconds) for name, seconds in slowest)))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,4 +18,8 @@ min_lng = 3.852315
 max_lng = 0.852315 
 
 N = 10
-cutoff_mins = [0, 10, 20, 30, 60]
\ No newline at end of file
+cutoff_mins = [0, 10, 20, 30, 60]
+
+# further origins to map in the same run, as (name, latitude, longitude)
+# e.g. [("Gare du Nord", 48.880932, 2.355323)]
+origins = []
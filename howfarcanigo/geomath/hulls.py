@@ -1,24 +1,258 @@
 ## all credit to joaofig on Github (https://github.com/joaofig/uk-accidents)
 import numpy as np
 import math
-from shapely.geometry import asPoint
-from shapely.geometry import asLineString
-from shapely.geometry import asPolygon
-from shapely.ops import transform
-from functools import partial
-import pyproj
+from fractions import Fraction
+from functools import lru_cache
+from scipy.spatial import cKDTree
 
 
 def write_line_string(hull):
+    from shapely.geometry import asLineString
     with open("data/line_{0}.csv".format(hull.shape[0]), "w") as file:
         file.write('\"line\"\n')
         text = asLineString(hull).wkt
         file.write('\"' + text + '\"\n')
 
 
+@lru_cache(maxsize=64)
+def _metric_transformers(lng_0, lat_0):
+    # shapely and pyproj are only imported here, as hulls are calculated without them
+    import pyproj
+    crs = pyproj.CRS.from_proj4('+proj=aeqd +lat_0={} +lon_0={} +datum=WGS84 +units=m'.format(lat_0, lng_0))
+    return pyproj.Transformer.from_crs('EPSG:4326', crs, always_xy=True), \
+        pyproj.Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+
+
+def metric_transformers(lng, lat):
+    """
+    Transformers between longitude, latitude and metres on a plane centred near a point.
+    The centre is rounded to 0.1 degrees, so the transformers are created once and
+    shared by every hull of a map, and distances within tens of kilometres of it are
+    true to within a fraction of a percent.
+    :param lng: Longitude of a point the plane is used around
+    :param lat: Latitude of a point the plane is used around
+    :return: Transformer from (longitude, latitude) to metres, and one back again
+    """
+    return _metric_transformers(round(float(lng), 1), round(float(lat), 1))
+
+
+def _transform_polygons(polygons, transformer):
+    """
+    Transforms the rings of every polygon in a single call.
+    :param polygons: Shapely polygons
+    :param transformer: pyproj Transformer
+    :return: List of transformed shapely polygons
+    """
+    from shapely.geometry import Polygon
+    rings = [[np.asarray(polygon.exterior.coords)] + [np.asarray(interior.coords) for interior in polygon.interiors]
+             for polygon in polygons]
+    flat = [ring for polygon_rings in rings for ring in polygon_rings]
+    if not flat:
+        return []
+    coords = np.concatenate(flat)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    flat = iter(np.split(np.column_stack([x, y]), np.cumsum([len(ring) for ring in flat])[:-1]))
+    transformed = []
+    for polygon_rings in rings:
+        shell = next(flat)
+        transformed.append(Polygon(shell, [next(flat) for _ in polygon_rings[1:]]))
+    return transformed
+
+
+def buffer_hulls(hulls, meters):
+    """
+    Buffers a set of hulls by a distance in metres and merges them, as a batch.
+    Every vertex is projected in one call, the hulls are merged and the merged
+    shape buffered once, then projected back in one call.
+    :param hulls: List of (N, 2) arrays of (longitude, latitude) vertices, None for a missing hull
+    :param meters: Distance to buffer by
+    :return: Shapely MultiPolygon in (longitude, latitude), empty if there are no hulls
+    """
+    from shapely.geometry import MultiPolygon, Polygon
+    from shapely.ops import unary_union
+    hulls = [np.asarray(hull, dtype=float) for hull in hulls if hull is not None and len(hull) >= 3]
+    if not hulls:
+        return MultiPolygon()
+    points = np.concatenate(hulls)
+    to_meters, to_lnglat = metric_transformers(*points.mean(axis=0))
+    x, y = to_meters.transform(points[:, 0], points[:, 1])
+    rings = np.split(np.column_stack([x, y]), np.cumsum([len(hull) for hull in hulls])[:-1])
+    # the buffer of a union is the union of the buffers, so only one buffer is needed.
+    # buffer(0) repairs hulls that touch themselves before they are merged
+    merged = unary_union([Polygon(ring).buffer(0) for ring in rings]).buffer(meters)
+    polygons = [polygon for polygon in getattr(merged, 'geoms', [merged]) if not polygon.is_empty]
+    return MultiPolygon(_transform_polygons(polygons, to_lnglat))
+
+
+def orientation(a, b, c):
+    """
+    Calculates the orientation of the turn a -> b -> c in the plane.
+    Falls back to exact rational arithmetic when the floating point
+    determinant is too close to zero for its sign to be trusted.
+    :param a: First point (x, y)
+    :param b: Second point (x, y)
+    :param c: Third point (x, y)
+    :return: 1 if counterclockwise, -1 if clockwise, 0 if collinear
+    """
+    det_left = (b[0] - a[0]) * (c[1] - a[1])
+    det_right = (b[1] - a[1]) * (c[0] - a[0])
+    det = det_left - det_right
+    if abs(det) > 1e-15 * (abs(det_left) + abs(det_right)):
+        return 1 if det > 0 else -1
+
+    ax, ay, bx, by, cx, cy = map(Fraction, (a[0], a[1], b[0], b[1], c[0], c[1]))
+    det = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (det > 0) - (det < 0)
+
+
+def on_segment(a, b, c):
+    """
+    Checks whether c, known to be collinear with a and b, lies on the segment a-b
+    """
+    return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and \
+        min(a[1], b[1]) <= c[1] <= max(a[1], b[1])
+
+
+def segments_intersect(a, b, c, d):
+    """
+    Checks whether the closed segments a-b and c-d share any point
+    """
+    o1 = orientation(a, b, c)
+    o2 = orientation(a, b, d)
+    o3 = orientation(c, d, a)
+    o4 = orientation(c, d, b)
+    if o1 != o2 and o3 != o4 and o1 != 0 and o2 != 0 and o3 != 0 and o4 != 0:
+        return True
+    return (o1 == 0 and on_segment(a, b, c)) or (o2 == 0 and on_segment(a, b, d)) or \
+        (o3 == 0 and on_segment(c, d, a)) or (o4 == 0 and on_segment(c, d, b))
+
+
+def find_uncovered(ring, points, tolerance=1e-5, stop_early=True, band_size=4096):
+    """
+    Finds the points neither inside the polygon nor within tolerance of its boundary.
+    Points are sorted by latitude and processed in bands. Each band is tested
+    with a vectorized even-odd ray casting against only the edges spanning its
+    latitudes, and points outside are checked for distance to nearby edges.
+    :param ring: Array of polygon vertices (M, 2), closed or not
+    :param points: Array of points (N, 2) to test
+    :param tolerance: Distance from the boundary within which a point counts as covered
+    :param stop_early: Stop at the first band with uncovered points
+    :param band_size: Number of points tested at once
+    :return: Array of indices into points of the uncovered points found
+    """
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+
+    # Anything outside the bounding box of the polygon is trivially uncovered
+    outside_box = (points[:, 0] < x1.min() - tolerance) | (points[:, 0] > x1.max() + tolerance) | \
+                  (points[:, 1] < y1.min() - tolerance) | (points[:, 1] > y1.max() + tolerance)
+    if stop_early and outside_box.any():
+        return np.flatnonzero(outside_box)
+
+    order = np.argsort(points[:, 1], kind='mergesort')
+    edge_min_y, edge_max_y = np.minimum(y1, y2), np.maximum(y1, y2)
+    edge_min_x, edge_max_x = np.minimum(x1, x2), np.maximum(x1, x2)
+    uncovered = []
+    for start in range(0, len(order), band_size):
+        band = order[start:start + band_size]
+        px, py = points[band, 0], points[band, 1]
+        inside = np.zeros(len(band), dtype=bool)
+        near = np.zeros(len(band), dtype=bool)
+
+        edges = np.flatnonzero((edge_max_y >= py[0] - tolerance) & (edge_min_y <= py[-1] + tolerance))
+        for e in edges:
+            # Points in the band are sorted by latitude, so each edge spans a slice of them
+            lo, hi = np.searchsorted(py, (edge_min_y[e], edge_max_y[e]))
+            if hi > lo:
+                x_cross = x1[e] + (py[lo:hi] - y1[e]) * (x2[e] - x1[e]) / (y2[e] - y1[e])
+                inside[lo:hi] ^= px[lo:hi] < x_cross
+
+            lo, hi = np.searchsorted(py, (edge_min_y[e] - tolerance, edge_max_y[e] + tolerance), side='right')
+            close = lo + np.flatnonzero((px[lo:hi] >= edge_min_x[e] - tolerance) &
+                                        (px[lo:hi] <= edge_max_x[e] + tolerance))
+            if len(close):
+                dx, dy = x2[e] - x1[e], y2[e] - y1[e]
+                length = dx * dx + dy * dy
+                t = 0.0 if length == 0 else \
+                    np.clip(((px[close] - x1[e]) * dx + (py[close] - y1[e]) * dy) / length, 0.0, 1.0)
+                distance = np.hypot(px[close] - (x1[e] + t * dx), py[close] - (y1[e] + t * dy))
+                near[close[distance < tolerance]] = True
+
+        missed = band[~(inside | near)]
+        if len(missed):
+            uncovered.append(missed)
+            if stop_early:
+                break
+    return np.sort(np.concatenate(uncovered)) if uncovered else np.array([], dtype=int)
+
+
+class SegmentIndex(object):
+    """
+    Uniform grid over the edges of a hull being traced, so that a new edge
+    is only tested against the existing edges close to it.
+    """
+
+    def __init__(self, points):
+        """
+        :param points: Array of points (N, 2) the hull is traced over, used to size the grid
+        """
+        mins = points.min(axis=0)
+        extent = (points.max(axis=0) - mins).max()
+        self.origin = mins.tolist()
+        self.cell_size = max(extent / math.sqrt(points.shape[0]), 1e-12)
+        self.cells = {}
+        self.segments = []
+
+    def get_cells(self, p, q):
+        """
+        Lists the grid cells overlapped by the bounding box of the segment p-q
+        """
+        x0 = int(math.floor((min(p[0], q[0]) - self.origin[0]) / self.cell_size))
+        x1 = int(math.floor((max(p[0], q[0]) - self.origin[0]) / self.cell_size))
+        y0 = int(math.floor((min(p[1], q[1]) - self.origin[1]) / self.cell_size))
+        y1 = int(math.floor((max(p[1], q[1]) - self.origin[1]) / self.cell_size))
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def add(self, p, q):
+        """
+        Adds the edge p-q, which must start at the end of the previous edge
+        """
+        ix = len(self.segments)
+        self.segments.append((p, q))
+        for cell in self.get_cells(p, q):
+            self.cells.setdefault(cell, []).append(ix)
+
+    def creates_intersection(self, p, q, closing=False):
+        """
+        Checks whether appending the edge p-q to the edges added so far would
+        make the line self-intersecting, as LineString.is_simple would.
+        :param p: Start of the new edge, the end of the last edge
+        :param q: End of the new edge
+        :param closing: True if q is the start of the first edge, closing the ring
+        :return: True if the new edge intersects the line
+        """
+        last = len(self.segments) - 1
+        nearby = set()
+        for cell in self.get_cells(p, q):
+            nearby.update(self.cells.get(cell, ()))
+
+        for ix in nearby:
+            a, b = self.segments[ix]
+            if ix == last or (ix == 0 and closing):
+                # Edges sharing an end point only intersect elsewhere if they overlap
+                shared, other, end = (b, a, q) if ix == last else (a, b, p)
+                if orientation(other, shared, end) == 0 and \
+                        (other[0] - shared[0]) * (end[0] - shared[0]) + \
+                        (other[1] - shared[1]) * (end[1] - shared[1]) > 0:
+                    return True
+            elif segments_intersect(a, b, p, q):
+                return True
+        return False
+
+
 class ConcaveHull(object):
 
-    def __init__(self, points, prime_ix=0):
+    def __init__(self, points, prime_ix=0, search='linear'):
         if isinstance(points, np.core.ndarray):
             self.data_set = points
         elif isinstance(points, list):
@@ -32,22 +266,38 @@ class ConcaveHull(object):
         # Create the initial index
         self.indices = np.ones(self.data_set.shape[0], dtype=bool)
 
+        # Spatial index over the data set, built on the first nearest neighbour query,
+        # and the sorted neighbours found for each point, both reused across values of k
+        self.tree = None
+        self.neighbours = {}
+
         self.prime_k = np.array([3, 5, 7, 11, 13, 17, 21, 23, 29, 31, 37, 41, 43,
                                  47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97])
         self.prime_ix = prime_ix
 
+        # How the next k is chosen after a failed attempt: 'linear' tries every
+        # value in prime_k in turn, 'gallop' doubles the step through prime_k
+        # and then bisects back to the smallest k found to work
+        if search not in ('linear', 'gallop'):
+            raise ValueError('Search must be either "linear" or "gallop"')
+        self.search = search
+        self.attempts = 0
+        self.k = None
+        # Indices of the points the last attempt left uncovered, None if it self-intersected,
+        # and (k, uncovered) of every attempt
+        self.uncovered = None
+        self.trials = []
+
     @staticmethod
     def buffer_in_meters(hull, meters):
-        proj_meters = pyproj.Proj(init='epsg:3857')
-        proj_latlng = pyproj.Proj(init='epsg:4326')
-
-        project_to_meters = partial(pyproj.transform, proj_latlng, proj_meters)
-        project_to_latlng = partial(pyproj.transform, proj_meters, proj_latlng)
-
-        hull_meters = transform(project_to_meters, hull)
+        # shapely and pyproj are only imported here, as hulls are calculated without them
+        from shapely.ops import transform
+        to_meters, to_lnglat = metric_transformers(*hull.centroid.coords[0])
+        # transformers take whole arrays of coordinates, so each ring is projected in one call
+        hull_meters = transform(to_meters.transform, hull)
 
         buffer_meters = hull_meters.buffer(meters)
-        buffer_latlng = transform(project_to_latlng, buffer_meters)
+        buffer_latlng = transform(to_lnglat.transform, buffer_meters)
         return buffer_latlng
 
     def get_next_k(self):
@@ -76,22 +326,65 @@ class ConcaveHull(object):
         indices = np.argsort(points[:, 1])
         return indices[0]
 
+    @staticmethod
+    def unit_vectors(points):
+        """
+        Converts (longitude, latitude) points to vectors on the unit sphere.
+        Straight line distances between the vectors increase monotonically with
+        the great circle distance between the points.
+        :param points: Array of points (N, 2) in degrees
+        :return: Array of unit vectors (N, 3)
+        """
+        lon, lat = np.radians(points[:, 0]), np.radians(points[:, 1])
+        cos_lat = np.cos(lat)
+        return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+    def build_tree(self):
+        """
+        Builds the KD-tree used for nearest neighbor queries over the whole data set
+        :return: The KD-tree
+        """
+        if self.tree is None:
+            self.vectors = self.unit_vectors(self.data_set)
+            self.tree = cKDTree(self.vectors)
+        return self.tree
+
     def get_k_nearest(self, ix, k):
         """
-        Calculates the k nearest point indices to the point indexed by ix
+        Calculates the k nearest point indices to the point indexed by ix.
+        The KD-tree holds every point, so the query is widened until it
+        returns k points that are still active in self.indices.
         :param ix: Index of the starting point
         :param k: Number of neighbors to consider
         :return: Array of indices into the data set array
         """
-        ixs = self.indices
-
-        base_indices = np.arange(len(ixs))[ixs]
-        distances = self.haversine_distance(self.data_set[ix, :], self.data_set[ixs, :])
-        sorted_indices = np.argsort(distances)
-
-        kk = min(k, len(sorted_indices))
-        k_nearest = sorted_indices[range(kk)]
-        return base_indices[k_nearest]
+        total = self.data_set.shape[0]
+        kk = min(k, np.count_nonzero(self.indices))
+        if kk == 0:
+            return np.array([], dtype=int)
+
+        query_k = kk
+        while True:
+            query_k = min(2 * query_k, total)
+            nearest = self.get_neighbours(ix, query_k)
+            nearest = nearest[self.indices[nearest]]
+            if len(nearest) >= kk or query_k == total:
+                return nearest[:kk]
+
+    def get_neighbours(self, ix, count):
+        """
+        Finds the nearest points to the point indexed by ix, active or not.
+        Results are cached per point and only requeried for a larger count.
+        :param ix: Index of the starting point
+        :param count: Number of neighbors to find
+        :return: Array of indices into the data set array, nearest first
+        """
+        nearest = self.neighbours.get(ix)
+        if nearest is None or len(nearest) < count:
+            _, nearest = self.build_tree().query(self.vectors[ix], k=count)
+            nearest = np.atleast_1d(nearest)
+            self.neighbours[ix] = nearest
+        return nearest[:count]
 
     def calculate_headings(self, ix, ixs, ref_heading=0.0):
         """
@@ -117,37 +410,96 @@ class ConcaveHull(object):
 
     def recurse_calculate(self):
         """
-        Calculates the concave hull using the next value for k while reusing the distances dictionary
+        Calculates the concave hull using the next value for k, reusing the data set,
+        the KD-tree and the nearest neighbors found so far
         :return: Concave hull
         """
-        recurse = ConcaveHull(self.data_set, self.prime_ix + 1)
-        next_k = recurse.get_next_k()
+        self.prime_ix += 1
+        next_k = self.get_next_k()
         if next_k == -1:
             return None
         # print("k={0}".format(next_k))
-        return recurse.calculate(next_k)
+        return self.trace(next_k)
 
     def calculate(self, k=3):
         """
-        Calculates the convex hull of the data set as an array of points
-        :param k: Number of nearest neighbors
+        Calculates the concave hull of the data set as an array of points, increasing
+        the number of nearest neighbors until the hull is simple and covers every point.
+        The number of attempts made is kept in self.attempts, the points each one left
+        uncovered in self.trials and the k used in self.k
+        :param k: Number of nearest neighbors for the first attempt
         :return: Array of points (N, 2) with the concave hull of the data set
         """
+        self.attempts = 0
+        self.k = None
+        self.trials = []
         if self.data_set.shape[0] < 3:
             return None
 
         if self.data_set.shape[0] == 3:
             return self.data_set
 
+        hull = self.trace(k)
+        if hull is not None or self.search == 'linear':
+            while hull is None and self.get_next_k() != -1:
+                hull = self.recurse_calculate()
+            return hull
+
+        # Gallop through prime_k until an attempt succeeds, remembering the last failure
+        last_ix = len(self.prime_k) - 1
+        failed_ix = self.prime_ix
+        step = 1
+        hull_ix = None
+        while failed_ix < last_ix:
+            ix = min(failed_ix + step, last_ix)
+            hull = self.trace(self.prime_k[ix])
+            if hull is not None:
+                hull_ix = ix
+                break
+            failed_ix = ix
+            # A simple hull missing only a few points is close to working, so the step only
+            # grows while attempts self-intersect or miss more
+            if self.uncovered is None or len(self.uncovered) > max(1, self.data_set.shape[0] // 100):
+                step *= 2
+        if hull_ix is None:
+            return None
+
+        # Bisect between the last failure and the first success for the smallest k that works
+        while hull_ix - failed_ix > 1:
+            ix = (failed_ix + hull_ix) // 2
+            trial = self.trace(self.prime_k[ix])
+            if trial is not None:
+                hull, hull_ix = trial, ix
+            else:
+                failed_ix = ix
+        self.prime_ix = hull_ix
+        self.k = self.prime_k[hull_ix]
+        return hull
+
+    def trace(self, k):
+        """
+        Traces the concave hull of the data set with a single value of k
+        :param k: Number of nearest neighbors
+        :return: Array of points (N, 2) with the concave hull of the data set, or None
+                 if the hull self-intersects or does not cover every point, recording
+                 which points were left uncovered in self.uncovered and self.trials
+        """
+        self.attempts += 1
+        self.indices[:] = True
+
         # Make sure that k neighbors can be found
         kk = min(k, self.data_set.shape[0])
 
         first_point = self.get_lowest_latitude_index(self.data_set)
         current_point = first_point
 
-        # Note that hull and test_hull are matrices (N, 2)
-        hull = np.reshape(np.array(self.data_set[first_point, :]), (1, 2))
-        test_hull = hull
+        # Preallocated hull vertex buffer (N, 2), only hull[:hull_size] is in use.
+        # Each point enters the hull at most once, except the first point closing it
+        points = self.data_set.tolist()
+        hull = np.empty((self.data_set.shape[0] + 1, 2))
+        hull[0, :] = self.data_set[first_point, :]
+        hull_size = 1
+        segments = SegmentIndex(self.data_set)
 
         # Remove the first point
         self.indices[first_point] = False
@@ -175,41 +527,35 @@ class ConcaveHull(object):
             while invalid_hull and i < len(candidates):
                 candidate = candidates[i]
 
-                # Create a test hull to check if there are any self-intersections
-                next_point = np.reshape(self.data_set[knn[candidate]], (1,2))
-                test_hull = np.append(hull, next_point, axis=0)
-
-                line = asLineString(test_hull)
-                invalid_hull = not line.is_simple
+                # Check if the new edge would create any self-intersections
+                invalid_hull = segments.creates_intersection(points[current_point], points[knn[candidate]],
+                                                             closing=knn[candidate] == first_point)
                 i += 1
 
             if invalid_hull:
-                return self.recurse_calculate()
+                self.uncovered = None
+                self.trials.append((k, None))
+                return None
 
             # prev_angle = self.calculate_headings(current_point, np.array([knn[candidate]]))
             prev_angle = self.calculate_headings(knn[candidate], np.array([current_point]))
+            segments.add(points[current_point], points[knn[candidate]])
             current_point = knn[candidate]
-            hull = test_hull
+            hull[hull_size, :] = self.data_set[current_point, :]
+            hull_size += 1
 
             # write_line_string(hull)
 
             self.indices[current_point] = False
             step += 1
 
-        poly = asPolygon(hull)
-
-        count = 0
-        total = self.data_set.shape[0]
-        for ix in range(total):
-            pt = asPoint(self.data_set[ix, :])
-            if poly.intersects(pt) or pt.within(poly):
-                count += 1
-            else:
-                d = poly.distance(pt)
-                if d < 1e-5:
-                    count += 1
+        hull = hull[:hull_size].copy()
 
-        if count == total:
+        # Check that every point is covered by the hull, keeping the ones that are not
+        self.uncovered = find_uncovered(hull, self.data_set, stop_early=False)
+        self.trials.append((k, self.uncovered))
+        if len(self.uncovered) == 0:
+            self.k = k
             return hull
         else:
-            return self.recurse_calculate()
\ No newline at end of file
+            return None
\ No newline at end of file
@@ -0,0 +1,15 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000 # metres
+
+
+def to_metres(lats, lngs, origin_lat):
+    """
+    Project coordinates onto a plane in metres, accurate near the origin latitude.
+    :param lats: Latitudes in degrees
+    :param lngs: Longitudes in degrees
+    :param origin_lat: Latitude the projection is centred on
+    :return: (N, 2) array of x and y coordinates in metres
+    """
+    lats, lngs = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+    return np.column_stack([EARTH_RADIUS*lngs*np.cos(np.radians(origin_lat)), EARTH_RADIUS*lats])
@@ -0,0 +1,136 @@
+import math
+import numpy as np
+
+"""
+This module contains an adaptive alternative to the uniform lattice of points.
+
+Rather than querying every point of an N x N lattice, a coarse lattice is
+    queried first and only the cells whose corners fall into different cutoff
+    bins are subdivided and queried again, round by round, until the resolution
+    of the full lattice or a budget of points is reached.
+"""
+
+def lattice_bounds(map_type_, N, origin_coords, global_coords,
+                   lat_multiplier=0.002, lng_multiplier=0.003):
+    """
+    Find the extent of the lattice generate.generate_points would produce
+
+    Args:
+        map_type_ (string): 'local' or 'global'
+        N (int): N**2 is the number of points in the lattice
+        origin_coords (dict): origin coordinates
+        global_coords (dict): maximum and minimum coordinates if generating a global map
+        lat_multipler (double): distance separator for latitude for the local grid
+        lng_multiple (double): distance separator for longitude for the local grid
+
+    Returns:
+        (tuple): minimum latitude, maximum latitude, minimum longitude, maximum longitude
+    """
+    if map_type_ == 'local':
+        origin_lat, origin_lng = origin_coords['origin_lat'], origin_coords['origin_lng']
+        return (origin_lat - int(N/2)*lat_multiplier, origin_lat + int(N/2)*lat_multiplier,
+                origin_lng - int(N/2)*lng_multiplier, origin_lng + int(N/2)*lng_multiplier)
+    elif map_type_ == 'global':
+        return (global_coords['min_lat'], global_coords['max_lat'],
+                global_coords['min_lng'], global_coords['max_lng'])
+    else:
+        raise ValueError('Map type must be either "local" or "global"')
+
+def sample_travel_times(retrieve, map_type_, N, origin_coords, global_coords,
+                        cutoff_mins_, coarse_N=16, max_points=None,
+                        lat_multiplier=0.002, lng_multiplier=0.003):
+    """
+    Retrieve travel times on a lattice refined only near cutoff boundaries
+
+    The fine lattice spans the same area as generate.generate_points with at
+    least N points per side. A coarse_N x coarse_N subset of it is retrieved
+    first. Each round, every cell whose corner travel times fall into different
+    cutoff bins (unreachable corners count as beyond the last cutoff) is split
+    into four, and the new corner points are retrieved together.
+
+    Args:
+        retrieve (function): takes destination latitudes and longitudes and returns
+            the reachable latitudes, longitudes and travel times, e.g. a partial of
+            generate.retrieve_travel_times
+        map_type_ (string): 'local' or 'global'
+        N (int): resolution limit, the refined lattice has at least N points per side
+        origin_coords (dict): origin coordinates
+        global_coords (dict): maximum and minimum coordinates if generating a global map
+        cutoff_mins_ (list): cutoff times in minutes whose boundaries are refined
+        coarse_N (int): number of points per side of the initial lattice
+        max_points (int): maximum number of points to retrieve, defaults to no limit
+        lat_multipler (double): distance separator for latitude for the local grid
+        lng_multiple (double): distance separator for longitude for the local grid
+
+    Returns:
+        lats (numpy array): destination latitudes that can be travelled to
+        lngs (numpy array): destination longitudes that can be travelled to
+        travel_times (numpy array): travel times to each coordinate
+    """
+    if coarse_N < 2:
+        raise ValueError('Coarse lattice must have at least 2 points per side')
+    # number of times the coarse cells can be halved before reaching N points per side
+    depth = max(0, int(math.ceil(math.log2(max(N - 1, 1)/(coarse_N - 1)))))
+    step = 2**depth
+    fine_N = (coarse_N - 1)*step + 1
+
+    min_lat, max_lat, min_lng, max_lng = lattice_bounds(map_type_, N, origin_coords, global_coords,
+                                                        lat_multiplier, lng_multiplier)
+    lat_axis = np.linspace(min_lat, max_lat, fine_N)
+    lng_axis = np.linspace(min_lng, max_lng, fine_N)
+    cutoffs = np.array(cutoff_mins_)
+
+    # travel times on the fine lattice: NaN if not retrieved, inf if unreachable
+    times = np.full((fine_N, fine_N), np.nan)
+
+    def _retrieve_round(rows, cols):
+        """Retrieve travel times for lattice indices and store them in `times`"""
+        lats, lngs = lat_axis[rows], lng_axis[cols]
+        good_lats, good_lngs, good_times = retrieve(lats, lngs)
+        reached = {(lat, lng): time_ for lat, lng, time_ in zip(good_lats, good_lngs, good_times)}
+        times[rows, cols] = [reached.get((lat, lng), np.inf) for lat, lng in zip(lats, lngs)]
+
+    coarse = np.arange(coarse_N)*step
+    rows, cols = [index.flatten() for index in np.meshgrid(coarse, coarse, indexing='ij')]
+    if max_points is not None and len(rows) > max_points:
+        raise ValueError('Point budget is smaller than the coarse lattice')
+    _retrieve_round(rows, cols)
+    num_points = len(rows)
+
+    # lower-left corners of the cells still eligible for refinement
+    cell_rows, cell_cols = [index.flatten() for index in np.meshgrid(coarse[:-1], coarse[:-1], indexing='ij')]
+    size = step
+    round_index = 0
+    while size > 1 and len(cell_rows):
+        # bin corner travel times the same way transform.group_coords does
+        corners = np.stack([times[cell_rows, cell_cols], times[cell_rows + size, cell_cols],
+                            times[cell_rows, cell_cols + size], times[cell_rows + size, cell_cols + size]])
+        corner_bins = np.digitize(np.round(corners/60, 1), cutoffs)
+        split = corner_bins.min(axis=0) != corner_bins.max(axis=0)
+        cell_rows, cell_cols = cell_rows[split], cell_cols[split]
+        if not len(cell_rows):
+            break
+
+        half = size//2
+        offsets = [(half, 0), (0, half), (half, half), (size, half), (half, size)]
+        new_rows = np.concatenate([cell_rows + dr for dr, dc in offsets])
+        new_cols = np.concatenate([cell_cols + dc for dr, dc in offsets])
+        # drop points shared between neighbouring cells or already retrieved
+        flat = np.unique(new_rows*fine_N + new_cols)
+        flat = flat[np.isnan(times.ravel()[flat])]
+        if max_points is not None and num_points + len(flat) > max_points:
+            print('Point budget of {} reached after {} rounds'.format(max_points, round_index))
+            break
+        round_index += 1
+        print('Refinement round {}: retrieving {} points for {} cells'.format(round_index, len(flat), len(cell_rows)))
+        _retrieve_round(flat//fine_N, flat % fine_N)
+        num_points += len(flat)
+
+        # each split cell becomes four cells of half the size
+        cell_rows = np.concatenate([cell_rows, cell_rows + half, cell_rows, cell_rows + half])
+        cell_cols = np.concatenate([cell_cols, cell_cols, cell_cols + half, cell_cols + half])
+        size = half
+
+    print('Retrieved {} points, equivalent lattice {}x{}'.format(num_points, fine_N, fine_N))
+    reached_rows, reached_cols = np.where(np.isfinite(times))
+    return lat_axis[reached_rows], lng_axis[reached_cols], times[reached_rows, reached_cols]
@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import datetime as dt
+import numpy as np
+
+"""
+This module contains a persistent cache of travel times to single coordinates.
+
+Each travel time is stored against its origin (rounded to a tolerance), its
+    destination, travel mode and departure slot, so any run that shares an
+    origin can reuse points already paid for, whatever its grid size, bounding
+    box or map type.
+
+A departure slot is a time of day on a class of days, rather than a date, so
+    transit times fetched for 9am one Monday are reused for 9am on the Tuesday
+    after. By default Monday to Friday share a class, and Saturday and Sunday
+    each have their own.
+"""
+
+# destinations are polyline encoded to 5 decimal places when sent to the API
+DESTINATION_PRECISION = 1e-5
+# multiplier used to pack an integer latitude and longitude into a single key
+_KEY_MULTIPLIER = 2**26
+# length of a departure slot in seconds
+SLOT_SECONDS = 900
+# class of each day from Monday to Sunday, days of a class share cached travel times
+WORKDAYS_ALIKE = (0, 0, 0, 0, 0, 5, 6)
+
+
+class TravelTimeCache(object):
+    """
+    SQLite backed store of travel times from an origin to destination coordinates
+
+    Travel times of `None`/NaN record destinations the API could not route to,
+    so they are not requested again.
+
+    Args:
+        path (str): path to the SQLite database, created if it does not exist
+        origin_tolerance (double): origins closer than this (in degrees) share cached times
+        slot_seconds (int): departure times of day are grouped into slots of this length,
+            slots of different lengths are cached apart
+        day_classes (tuple): class of each day from Monday to Sunday, days of the same
+            class share cached times, e.g. tuple(range(7)) to keep every day apart
+    """
+
+    def __init__(self, path='data/coords/travel_times.sqlite',
+                 origin_tolerance=1e-4, slot_seconds=SLOT_SECONDS, day_classes=WORKDAYS_ALIKE):
+        self.path = path
+        self.origin_tolerance = origin_tolerance
+        self.slot_seconds = slot_seconds
+        self.day_classes = day_classes
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path)
+        # travel_times, keyed by dated slots, is left unread in older caches
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS slot_travel_times ('
+            'origin_lat INTEGER, origin_lng INTEGER, mode TEXT, '
+            'day_class INTEGER, slot_seconds INTEGER, slot INTEGER, '
+            'dest_lat INTEGER, dest_lng INTEGER, travel_time REAL, '
+            'PRIMARY KEY (origin_lat, origin_lng, mode, day_class, slot_seconds, slot, dest_lat, dest_lng)'
+            ') WITHOUT ROWID')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _origin_key(self, origin_lat, origin_lng, travel_mode, departure_time):
+        """
+        Round an origin and departure time to the values they are stored under
+
+        Args:
+            origin_lat (double): origin latitude
+            origin_lng (double): origin longitude
+            travel_mode (string): 'transit' or 'walking'
+            departure_time (string): seconds from epoch as string, None if irrelevant
+
+        Returns:
+            (tuple): origin latitude, origin longitude, mode, day class, slot length
+                and slot of the day
+        """
+        if departure_time is None:
+            day_class, slot = 0, 0
+        else:
+            # as generate.next_best_date, the seconds count the local time as if it were UTC
+            departure = dt.datetime(1970, 1, 1) + dt.timedelta(seconds=int(departure_time))
+            day_class = self.day_classes[departure.weekday()]
+            slot = (departure.hour*3600 + departure.minute*60 + departure.second)//self.slot_seconds
+        return (int(round(origin_lat/self.origin_tolerance)),
+                int(round(origin_lng/self.origin_tolerance)),
+                travel_mode, day_class, self.slot_seconds, slot)
+
+    @staticmethod
+    def _destination_keys(lats, lngs):
+        """
+        Round destination coordinates to integers at the API precision
+
+        Returns:
+            (numpy array): integer latitudes
+            (numpy array): integer longitudes
+        """
+        lat_ints = np.round(np.asarray(lats, dtype=float)/DESTINATION_PRECISION).astype(np.int64)
+        lng_ints = np.round(np.asarray(lngs, dtype=float)/DESTINATION_PRECISION).astype(np.int64)
+        return lat_ints, lng_ints
+
+    def lookup(self, destination_lats, destination_lngs,
+               origin_lat, origin_lng, travel_mode, departure_time=None):
+        """
+        Look up travel times to many destinations in one query
+
+        Args:
+            destination_lats (list): destination latitudes
+            destination_lngs (list): destination longitudes
+            origin_lat (double): origin latitude
+            origin_lng (double): origin longitude
+            travel_mode (string): 'transit' or 'walking'
+            departure_time (string): seconds from epoch as string, None if irrelevant
+
+        Returns:
+            (numpy array): boolean mask of destinations found in the cache
+            (numpy array): cached travel times, NaN where missing or unreachable
+        """
+        lat_ints, lng_ints = self._destination_keys(destination_lats, destination_lngs)
+        keys = lat_ints*_KEY_MULTIPLIER + lng_ints
+        found = np.zeros(len(keys), dtype=bool)
+        travel_times = np.full(len(keys), np.nan)
+
+        rows = self.connection.execute(
+            'SELECT dest_lat, dest_lng, travel_time FROM slot_travel_times '
+            'WHERE origin_lat=? AND origin_lng=? AND mode=? AND day_class=? AND slot_seconds=? AND slot=?',
+            self._origin_key(origin_lat, origin_lng, travel_mode, departure_time)).fetchall()
+        if not rows or not len(keys):
+            return found, travel_times
+
+        cached = np.array(rows, dtype=float)
+        cached_keys = cached[:, 0].astype(np.int64)*_KEY_MULTIPLIER + cached[:, 1].astype(np.int64)
+        order = np.argsort(cached_keys)
+        cached_keys = cached_keys[order]
+        cached_times = cached[order, 2]
+
+        # match each destination against the sorted cached keys
+        positions = np.clip(np.searchsorted(cached_keys, keys), 0, len(cached_keys)-1)
+        found = cached_keys[positions] == keys
+        travel_times[found] = cached_times[positions[found]]
+        return found, travel_times
+
+    def insert(self, destination_lats, destination_lngs, travel_times,
+               origin_lat, origin_lng, travel_mode, departure_time=None):
+        """
+        Store travel times to many destinations in one transaction
+
+        Args:
+            destination_lats (list): destination latitudes
+            destination_lngs (list): destination longitudes
+            travel_times (list): travel time to each destination, NaN if unreachable
+            origin_lat (double): origin latitude
+            origin_lng (double): origin longitude
+            travel_mode (string): 'transit' or 'walking'
+            departure_time (string): seconds from epoch as string, None if irrelevant
+
+        Returns:
+            None
+        """
+        origin_key = self._origin_key(origin_lat, origin_lng, travel_mode, departure_time)
+        lat_ints, lng_ints = self._destination_keys(destination_lats, destination_lngs)
+        rows = ((origin_key + (int(lat), int(lng), None if np.isnan(time_) else float(time_)))
+                for lat, lng, time_ in zip(lat_ints, lng_ints, np.asarray(travel_times, dtype=float)))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO slot_travel_times VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
@@ -1,5 +1,6 @@
 import os
-import pickle
+import numpy as np
+from mapping import dataset, journal
 
 def read_config():
     """
@@ -74,24 +75,82 @@ def read_config():
             global_coords, config.N, config.cutoff_mins
 
 
+def read_origins(origin_string, origin_coords):
+    """
+    Reads any further origins to map in the same run from the config file
+
+    Further origins are given in config.py as `origins`, a list of
+    (name, latitude, longitude) tuples. Every origin shares the other settings.
+
+    Args:
+        origin_string (str): origin address returned by read_config
+        origin_coords (dict): origin coordinates returned by read_config
+
+    Returns:
+        (list): (name, coordinates dict) of the main origin followed by any further origins
+    """
+    try:
+        import howfarcanigo.config as config
+    except:
+        import howfarcanigo.configExample as config
+
+    origins = [(origin_string, origin_coords)]
+    for name, lat, lng in getattr(config, 'origins', []):
+        assert isinstance(lat, (int,float)) and isinstance(lng, (int,float)), \
+            "Non-numeric coordinates provided for origin {}".format(name)
+        origins.append((name, {'origin_lat': lat, 'origin_lng': lng}))
+    return origins
+
+
+def dataset_path(data_name):
+    """
+    Path of the travel time dataset for a run
+
+    Args:
+        data_name (str): name of the data
+
+    Return:
+        (str): directory of the dataset
+    """
+    return 'data/coords/{}{}'.format(data_name, dataset.DATASET_SUFFIX)
+
+
+def journal_path(data_name):
+    """
+    Path of the journal of API responses for a run, kept until its dataset is saved
+
+    Args:
+        data_name (str): name of the data
+
+    Return:
+        (str): path of the journal
+    """
+    return 'data/coords/{}{}'.format(data_name, journal.JOURNAL_SUFFIX)
+
+
 def import_data(data_name):
     """
-    Import pickled coordinate and travel time data if it exists
+    Import coordinate and travel time data if it exists
+
+    Data pickled by earlier versions is migrated to a dataset the first time it is read.
 
     Args:
-        data_name (str): name of pickled data
+        data_name (str): name of the data
 
     Return:
-        lats (list): destination latitudes
-        lngs (list): destination longitudes
-        travel_times (list): time taken to trave to each destination coordinate
+        lats (numpy array): destination latitudes, memory-mapped
+        lngs (numpy array): destination longitudes, memory-mapped
+        travel_times (numpy array): time taken to trave to each destination coordinate, memory-mapped
     """
-    
+    path = dataset_path(data_name)
     pickle_path = 'data/coords/{}.p'.format(data_name)
-    if os.path.exists(pickle_path):
-        # If we already have data pickled, don't generate any more
-        print('Reading in from pickled file...')
-        lats, lngs, travel_times = pickle.load(open(pickle_path, 'rb')) # load in data if it exists
-        return lats, lngs, travel_times
+    if not os.path.exists(path) and os.path.exists(pickle_path):
+        print('Migrating pickled file to dataset...')
+        dataset.migrate_pickle(pickle_path, path)
+    if os.path.exists(path):
+        # If we already have data saved, don't generate any more
+        print('Reading in from dataset...')
+        data = dataset.TravelTimeDataset(path)
+        return data.lats, data.lngs, data.travel_times
     else:
-        return [], [], []
\ No newline at end of file
+        return np.empty(0), np.empty(0), np.empty(0)
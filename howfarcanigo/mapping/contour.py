@@ -0,0 +1,120 @@
+import numpy as np
+import contourpy
+from scipy.spatial import cKDTree
+
+"""
+This module contains a contouring alternative to the concave hulls in transform.
+
+Destination coordinates from generate.generate_points lie on a regular lattice,
+    so travel times can be rasterised back onto it and every cutoff contour
+    traced by marching squares, without clustering points into islands first.
+
+The output has the same structure as transform.generate_hull_arrays, so it can
+    be drawn with draw.draw_folium_map unchanged
+"""
+
+def rasterise(lats_, lngs_, travel_times_):
+    """
+    Place travel times back onto the lattice they were generated on
+
+    Lattice points missing from the data (e.g. those the API could not route to)
+    are left as NaN.
+
+    Args:
+        lats_ (list): destination latitudes
+        lngs_ (list): destination longitudes
+        travel_times_ (list): travel time to each destination coordinate
+
+    Returns:
+        (numpy array): latitudes of the lattice rows
+        (numpy array): longitudes of the lattice columns
+        (numpy array): travel times in minutes, with shape (rows, columns)
+    """
+    lats_, lngs_ = np.asarray(lats_), np.asarray(lngs_)
+    lat_axis, lat_index = np.unique(lats_, return_inverse=True)
+    lng_axis, lng_index = np.unique(lngs_, return_inverse=True)
+    if len(lat_axis) < 2 or len(lng_axis) < 2:
+        raise ValueError('At least two distinct latitudes and longitudes are needed to contour')
+    if len(lat_axis)*len(lng_axis) > 4*len(lats_):
+        raise ValueError('Coordinates do not lie on a regular lattice, use concave hulls instead')
+
+    grid = np.full((len(lat_axis), len(lng_axis)), np.nan)
+    # convert seconds to minutes for travel time, as in transform.group_coords
+    grid[lat_index, lng_index] = np.round(np.asarray(travel_times_)/60, 1)
+    return lat_axis, lng_axis, grid
+
+def bridge_holes(outer, holes):
+    """
+    Join holes to their outer ring with zero-width bridges, giving a single ring
+
+    Each hole is cut into the outer ring at the closest pair of vertices between
+    them. Drawn with an even-odd fill rule, as folium does, the holes remain unfilled.
+
+    Args:
+        outer (numpy array): (N, 2) closed outer ring
+        holes (list): (M, 2) closed hole rings
+
+    Returns:
+        (numpy array): (N + sum(M + 1), 2) ring including the holes
+    """
+    if not holes:
+        return outer
+    hole_points = np.concatenate(holes)
+    starts = np.cumsum([0] + [len(hole) for hole in holes[:-1]])
+    distances, ring_ixs = cKDTree(outer).query(hole_points)
+    # closest hole vertex to the outer ring, for each hole
+    hole_ixs = [start + np.argmin(distances[start:start+len(hole)]) for start, hole in zip(starts, holes)]
+
+    pieces = []
+    previous = 0
+    for hole in np.argsort(ring_ixs[hole_ixs], kind='mergesort'):
+        ring_ix = ring_ixs[hole_ixs[hole]]
+        hole_ix = hole_ixs[hole] - starts[hole]
+        # walk out to the hole, around it from the closest vertex, and back again
+        pieces.extend([outer[previous:ring_ix+1],
+                       np.roll(holes[hole][:-1], -hole_ix, axis=0),
+                       holes[hole][hole_ix:hole_ix+1],
+                       outer[ring_ix:ring_ix+1]])
+        previous = ring_ix + 1
+    pieces.append(outer[previous:])
+    return np.concatenate(pieces)
+
+def generate_contour_arrays(lats_, lngs_, travel_times_, cutoff_mins_, num_bins=-1):
+    """
+    Generate contour arrays for each island in each cutoff time
+
+    Every cutoff is extracted from the same contour generator, holes included,
+    in place of the DBSCAN islands and concave hulls of transform.generate_hull_arrays
+
+    Args:
+        lats_ (list): destination latitudes on a lattice
+        lngs_ (list): destination longitudes on a lattice
+        travel_times_ (list): travel time to each destination coordinate
+        cutoff_mins_ (list): upper limit of cut-off group
+        num_bins (int): the number of bins that we want to process, if not all. Defaults to all bins
+
+    Returns:
+        (list): list with each element being a list of (longitude, latitude) arrays
+            describing the islands reachable within each cutoff time, the last
+            element covering every reachable point
+    """
+    lat_axis, lng_axis, grid = rasterise(lats_, lngs_, travel_times_)
+    generator = contourpy.contour_generator(lng_axis, lat_axis, np.ma.masked_invalid(grid),
+                                            fill_type=contourpy.FillType.OuterOffset)
+
+    # every cutoff after the first, then one level above every travel time.
+    # cutoffs below every travel time have no bin in transform.group_coords either
+    lower = np.nanmin(grid) - 1
+    upper_levels = [cutoff for cutoff in cutoff_mins_[1:] if cutoff > lower]
+    upper_levels.append(np.nanmax(grid) + 1)
+    if num_bins == -1: num_bins = len(upper_levels)
+
+    cutoff_contour_arrays = []
+    print('\nGenerating contour arrays...')
+    for upper in upper_levels[0:num_bins]:
+        island_contour_arrays = []
+        for points, offsets in zip(*generator.filled(lower, upper)):
+            rings = [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            island_contour_arrays.append(bridge_holes(rings[0], rings[1:]))
+        cutoff_contour_arrays.append(island_contour_arrays)
+    return cutoff_contour_arrays
@@ -0,0 +1,289 @@
+import datetime as dt
+import json
+import os
+import pickle
+import re
+import numpy as np
+
+"""
+This module contains the on-disk format for travel time data.
+
+A dataset is a directory holding a JSON header and one .npy file per column
+    for each round of fetched results. Columns are opened memory-mapped, so
+    large grids are not read into memory until they are used. Points the API
+    could not route to are kept alongside the reachable ones.
+
+    data/coords/transit_localmap_N100.travel_times/
+        header.json
+        00000_lats.npy, 00000_lngs.npy, 00000_travel_times.npy,
+        00000_failed_lats.npy, 00000_failed_lngs.npy
+        00001_lats.npy, ...
+"""
+
+FORMAT_NAME = 'howfarcanigo-travel-times'
+FORMAT_VERSION = 1
+DATASET_SUFFIX = '.travel_times'
+COLUMNS = ('lats', 'lngs', 'travel_times', 'failed_lats', 'failed_lngs')
+_COLUMN_FILE = re.compile(r'^\d{{5}}_({})\.npy$'.format('|'.join(COLUMNS)))
+
+
+class TravelTimeDataset(object):
+    """
+    Versioned, append-only store of travel times to destination coordinates
+
+    Args:
+        path (str): directory of an existing dataset
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json')) as header_file:
+            self.header = json.load(header_file)
+        if self.header.get('format') != FORMAT_NAME:
+            raise ValueError('{} is not a travel time dataset'.format(path))
+        if self.header['version'] > FORMAT_VERSION:
+            raise ValueError('Dataset version {} is newer than supported version {}'.format(
+                self.header['version'], FORMAT_VERSION))
+
+    @classmethod
+    def create(cls, path, **metadata):
+        """
+        Create an empty dataset
+
+        A dataset already in the directory, such as one left without travel times
+        by an interrupted fetch, is replaced.
+
+        Args:
+            path (str): directory to create the dataset in
+            metadata: JSON serialisable description of the data, e.g. origin,
+                travel mode, departure time
+
+        Returns:
+            (TravelTimeDataset): the new dataset
+        """
+        os.makedirs(path, exist_ok=True)
+        header = {'format': FORMAT_NAME, 'version': FORMAT_VERSION,
+                  'created': dt.datetime.utcnow().isoformat(),
+                  'metadata': metadata, 'rounds': []}
+        cls._write_header(path, header)
+        # the old columns are only removed once the header no longer refers to them
+        for file_name in os.listdir(path):
+            if _COLUMN_FILE.match(file_name):
+                os.remove(os.path.join(path, file_name))
+        return cls(path)
+
+    @staticmethod
+    def _write_header(path, header):
+        # write to a temporary file first so a crash never leaves a partial header
+        temp_path = os.path.join(path, 'header.json.tmp')
+        with open(temp_path, 'w') as header_file:
+            json.dump(header, header_file, indent=2)
+        os.replace(temp_path, os.path.join(path, 'header.json'))
+
+    @property
+    def metadata(self):
+        return self.header['metadata']
+
+    @property
+    def rounds(self):
+        return self.header['rounds']
+
+    def _column_path(self, round_index, column):
+        return os.path.join(self.path, '{:05d}_{}.npy'.format(round_index, column))
+
+    def _next_round_index(self):
+        return max([round_info['index'] for round_info in self.rounds] + [-1]) + 1
+
+    def append_round(self, lats, lngs, travel_times, failed_lats=(), failed_lngs=()):
+        """
+        Add a round of fetched results to the dataset
+
+        The column files are written before the header lists them, so an
+        interrupted append leaves the dataset as it was.
+
+        Args:
+            lats (list): reachable destination latitudes
+            lngs (list): reachable destination longitudes
+            travel_times (list): travel time to each reachable destination in seconds
+            failed_lats (list): latitudes of destinations the API could not route to
+            failed_lngs (list): longitudes of destinations the API could not route to
+
+        Returns:
+            None
+        """
+        columns = dict(zip(COLUMNS, (lats, lngs, travel_times, failed_lats, failed_lngs)))
+        columns = {name: np.asarray(values, dtype=float) for name, values in columns.items()}
+        assert len(columns['lats']) == len(columns['lngs']) == len(columns['travel_times']), \
+            'Reachable columns must have the same length'
+        assert len(columns['failed_lats']) == len(columns['failed_lngs']), \
+            'Failed columns must have the same length'
+
+        round_index = self._next_round_index()
+        for name, values in columns.items():
+            np.save(self._column_path(round_index, name), values)
+        self.rounds.append({'index': round_index,
+                            'points': len(columns['lats']),
+                            'failed': len(columns['failed_lats']),
+                            'created': dt.datetime.utcnow().isoformat()})
+        self._write_header(self.path, self.header)
+
+    def column(self, name):
+        """
+        Read a column of every round
+
+        Args:
+            name (str): one of COLUMNS
+
+        Returns:
+            (numpy array): memory-mapped if the dataset has a single round, otherwise
+                the rounds concatenated in memory
+        """
+        if name not in COLUMNS:
+            raise ValueError('Unknown column {}'.format(name))
+        count_key = 'failed' if name.startswith('failed') else 'points'
+        parts = []
+        for round_info in self.rounds:
+            if round_info[count_key] == 0:
+                continue # empty files cannot be memory-mapped
+            parts.append(np.load(self._column_path(round_info['index'], name), mmap_mode='r'))
+        if not parts:
+            return np.empty(0)
+        elif len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    @property
+    def lats(self):
+        return self.column('lats')
+
+    @property
+    def lngs(self):
+        return self.column('lngs')
+
+    @property
+    def travel_times(self):
+        return self.column('travel_times')
+
+    @property
+    def failed_lats(self):
+        return self.column('failed_lats')
+
+    @property
+    def failed_lngs(self):
+        return self.column('failed_lngs')
+
+    def compact(self):
+        """
+        Merge every round into a single round, so columns can be memory-mapped again
+
+        Returns:
+            None
+        """
+        if len(self.rounds) < 2:
+            return
+        columns = {name: np.array(self.column(name)) for name in COLUMNS}
+        old_rounds = self.rounds
+        merged_index = self._next_round_index()
+        for name, values in columns.items():
+            np.save(self._column_path(merged_index, name), values)
+        self.header['rounds'] = [{'index': merged_index,
+                                  'points': len(columns['lats']),
+                                  'failed': len(columns['failed_lats']),
+                                  'created': dt.datetime.utcnow().isoformat()}]
+        self._write_header(self.path, self.header)
+        # the old rounds are only removed once the header no longer refers to them
+        for round_info in old_rounds:
+            for name in COLUMNS:
+                os.remove(self._column_path(round_info['index'], name))
+
+
+def failed_points(requested_lats, requested_lngs, lats, lngs):
+    """
+    Find the requested destinations missing from the reachable ones
+
+    Args:
+        requested_lats (list): latitudes sent to the API
+        requested_lngs (list): longitudes sent to the API
+        lats (list): reachable latitudes returned
+        lngs (list): reachable longitudes returned
+
+    Returns:
+        (numpy array): latitudes of destinations that could not be reached
+        (numpy array): longitudes of destinations that could not be reached
+    """
+    requested_lats, requested_lngs = np.asarray(requested_lats), np.asarray(requested_lngs)
+    reached = np.isin(requested_lats + 1j*requested_lngs, np.asarray(lats) + 1j*np.asarray(lngs))
+    return requested_lats[~reached], requested_lngs[~reached]
+
+
+def migrate_pickle(pickle_path, path, **metadata):
+    """
+    Convert a pickled [lats, lngs, travel_times] list into a dataset
+
+    Args:
+        pickle_path (str): path to the pickle written by earlier versions
+        path (str): directory to create the dataset in
+        metadata: JSON serialisable description of the data
+
+    Returns:
+        (TravelTimeDataset): the new dataset
+    """
+    with open(pickle_path, 'rb') as pickle_file:
+        lats, lngs, travel_times = pickle.load(pickle_file)
+    metadata.setdefault('migrated_from', os.path.basename(pickle_path))
+    dataset = TravelTimeDataset.create(path, **metadata)
+    dataset.append_round(lats, lngs, travel_times)
+    return dataset
+
+
+def save_hull_arrays(path, cutoff_hull_arrays):
+    """
+    Save the hull arrays of every island in every cutoff time to a single file
+
+    Args:
+        path (str): .npz file to write
+        cutoff_hull_arrays (list): list per cutoff time of hull arrays, as returned by
+            transform.generate_hull_arrays, None where no hull was found
+
+    Returns:
+        None
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    islands = [hull for hulls in cutoff_hull_arrays for hull in hulls]
+    found = [np.asarray(hull, dtype=float) for hull in islands if hull is not None]
+    np.savez(path,
+             format_version=FORMAT_VERSION,
+             islands_per_cutoff=np.array([len(hulls) for hulls in cutoff_hull_arrays], dtype=np.int64),
+             # -1 marks an island without a hull
+             island_sizes=np.array([-1 if hull is None else len(hull) for hull in islands], dtype=np.int64),
+             points=np.concatenate(found) if found else np.empty((0, 2)))
+
+
+def load_hull_arrays(path):
+    """
+    Load hull arrays saved by save_hull_arrays
+
+    Args:
+        path (str): .npz file to read
+
+    Returns:
+        (list): list per cutoff time of hull arrays, None where no hull was found
+    """
+    with np.load(path) as saved:
+        if int(saved['format_version']) > FORMAT_VERSION:
+            raise ValueError('Hull file version {} is newer than supported version {}'.format(
+                int(saved['format_version']), FORMAT_VERSION))
+        islands, offset = [], 0
+        for size in saved['island_sizes']:
+            if size < 0:
+                islands.append(None)
+            else:
+                islands.append(saved['points'][offset:offset+size])
+                offset += size
+        cutoff_hull_arrays, start = [], 0
+        for count in saved['islands_per_cutoff']:
+            cutoff_hull_arrays.append(islands[start:start+count])
+            start += count
+    return cutoff_hull_arrays
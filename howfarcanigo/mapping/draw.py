@@ -1,10 +1,20 @@
-import matplotlib.pyplot as plt
+import datetime as dt
+import json
+import os
 import folium
-import matplotlib
-import seaborn as sns; sns.set()
+import matplotlib.colors
 import random
 import numpy as np
 
+# pyplot and seaborn are slow to import and only needed by some functions,
+# so they are imported when first used
+
+def _pyplot():
+    """Import pyplot, styled by seaborn"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns; sns.set()
+    return plt
+
 def add_cutoff_points(map_object, cutoff_points_, layer_name, line_color, fill_color, weight, text=''):
     """
     Draw all islands in a cutoff minute set to a folium map object
@@ -28,7 +38,7 @@ def add_cutoff_points(map_object, cutoff_points_, layer_name, line_color, fill_c
         island_points = np.fliplr(island_points) # flip axis so we get long,lat tuple
         fg.add_child(folium.vector_layers.Polygon(locations=island_points, color=line_color, fill_color=fill_color,
                                               weight=weight)) #, popup=(folium.Popup(text)))
-        map_object.add_child(fg)
+    map_object.add_child(fg)
     return map_object
 
 def draw_folium_map(cutoff_hull_arrays_, cutoff_mins_, cmap, origin_lat, origin_lng):
@@ -58,6 +68,218 @@ def draw_folium_map(cutoff_hull_arrays_, cutoff_mins_, cmap, origin_lat, origin_
     folium.LayerControl(collapsed=False).add_to(my_map) # Add layer control and show map
     return my_map
 
+def hull_arrays_to_geojson(cutoff_hull_arrays_, cutoff_mins_):
+    """
+    Describe the islands of each cutoff time as GeoJSON polygons
+
+    As in draw_folium_map, the last set of hull arrays (all points) is skipped.
+
+    Args:
+        cutoff_hull_arrays_ (list): list of list containings points as concave hulls
+        cutoff_mins_ (list): cutoff minute integers
+
+    Returns:
+        (dict): GeoJSON FeatureCollection
+    """
+    features = []
+    for cutoff_index, cutoff_points in enumerate(cutoff_hull_arrays_[:-1]):
+        for island_points in cutoff_points:
+            if island_points is None: continue
+            # hull arrays are already (longitude, latitude), as GeoJSON expects
+            ring = np.asarray(island_points, dtype=float)
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            features.append({'type': 'Feature',
+                             'properties': {'cutoff_mins': cutoff_mins_[cutoff_index+1]},
+                             'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+def save_geojson(path, cutoff_hull_arrays_, cutoff_mins_):
+    """
+    Save the islands of each cutoff time as a GeoJSON file
+
+    Args:
+        path (str): file to write
+        cutoff_hull_arrays_ (list): list of list containings points as concave hulls
+        cutoff_mins_ (list): cutoff minute integers
+    """
+    # write to a temporary file first so a reader never sees a partial file
+    with open(path + '.tmp', 'w') as geojson_file:
+        json.dump(hull_arrays_to_geojson(cutoff_hull_arrays_, cutoff_mins_), geojson_file)
+    os.replace(path + '.tmp', path)
+
+def band_geometries(cutoff_hull_arrays_, tolerance=0.0):
+    """
+    Turn the cumulative islands of each cutoff time into non-overlapping bands
+
+    Band k covers what is reached within cutoff k but not within cutoff k-1.
+    Each cumulative area is simplified before the bands are cut from it, so
+    neighbouring bands share exactly the same boundary.
+    As in draw_folium_map, the last set of hull arrays (all points) is skipped.
+
+    Args:
+        cutoff_hull_arrays_ (list): list of list containings points as concave hulls
+        tolerance (double): maximum distance in degrees a simplified boundary may move,
+            0 to keep every vertex
+
+    Returns:
+        (list): shapely geometry of each band, possibly empty
+    """
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
+
+    bands = []
+    previous = None
+    for cutoff_points in cutoff_hull_arrays_[:-1]:
+        # buffer(0) repairs hulls that touch themselves
+        polygons = [Polygon(island_points).buffer(0) for island_points in cutoff_points
+                    if island_points is not None and len(island_points) >= 3]
+        if previous is not None:
+            polygons.append(previous)
+        reached = unary_union(polygons)
+        if tolerance:
+            reached = reached.simplify(tolerance, preserve_topology=True)
+        bands.append(reached if previous is None else reached.difference(previous))
+        previous = reached
+    return bands
+
+def _quantize_ring(ring, decimals):
+    """Round a ring's coordinates, dropping vertices that repeat the one before"""
+    ring = np.round(np.asarray(ring, dtype=float), decimals)
+    keep = np.ones(len(ring), dtype=bool)
+    keep[1:] = np.any(ring[1:] != ring[:-1], axis=1)
+    ring = ring[keep]
+    # a ring needs three distinct vertices and a closing vertex
+    return ring.tolist() if len(ring) >= 4 else None
+
+def quantize_geometry(geometry, decimals=5):
+    """
+    Describe a polygonal geometry as GeoJSON with rounded coordinates
+
+    5 decimal places is about 1m, the precision destinations are sent to the API with.
+
+    Args:
+        geometry (shapely geometry): Polygon, MultiPolygon or collection of them
+        decimals (int): decimal places kept
+
+    Returns:
+        (dict): GeoJSON MultiPolygon geometry, None if nothing is left
+    """
+    polygons = []
+    for polygon in getattr(geometry, 'geoms', [geometry]):
+        if polygon.geom_type != 'Polygon' or polygon.is_empty:
+            continue
+        exterior = _quantize_ring(polygon.exterior.coords, decimals)
+        if exterior is None:
+            continue
+        holes = [_quantize_ring(interior.coords, decimals) for interior in polygon.interiors]
+        polygons.append([exterior] + [hole for hole in holes if hole is not None])
+    if not polygons:
+        return None
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+def save_compact_map(path, cutoff_hull_arrays_, cutoff_mins_, cmap, origin_lat, origin_lng,
+                     tolerance=1e-4, decimals=5, external=True):
+    """
+    Save a map whose cutoff times are drawn as simplified, quantized, non-overlapping bands
+
+    Each band is a single GeoJSON layer. With external layers, they are written to
+    a `<map name>_layers` directory next to the map and loaded by the page, which
+    then has to be opened over HTTP (e.g. `python -m http.server`) rather than
+    as a local file.
+
+    Args:
+        path (str): html file to write
+        cutoff_hull_arrays_ (list): list of list containings points as concave hulls
+        cutoff_mins_ (list): cutoff minute integers
+        cmap (cmap object): colormap used to shade in the map
+        origin_lat (double): latitude of origin
+        origin_lng (double): longitude of origin
+        tolerance (double): simplification tolerance in degrees, see band_geometries
+        decimals (int): decimal places kept in coordinates
+        external (bool): write each band to its own GeoJSON file rather than into the page
+
+    Returns:
+        (folium map object): generated map
+    """
+    my_map = folium.Map(location=[origin_lat, origin_lng], zoom_start=11)
+    colormap = [matplotlib.colors.rgb2hex(cmap(i)[:3]) for i in range(cmap.N)][::4]
+    map_directory = os.path.dirname(os.path.abspath(path))
+    layer_directory = os.path.splitext(os.path.basename(path))[0] + '_layers'
+    if external and not os.path.exists(os.path.join(map_directory, layer_directory)):
+        os.makedirs(os.path.join(map_directory, layer_directory))
+
+    for cutoff_index, band in enumerate(band_geometries(cutoff_hull_arrays_, tolerance)):
+        geometry = quantize_geometry(band, decimals)
+        if geometry is None: continue
+        feature = {'type': 'Feature', 'geometry': geometry,
+                   'properties': {'from_mins': cutoff_mins_[cutoff_index],
+                                  'to_mins': cutoff_mins_[cutoff_index+1]}}
+        collection = {'type': 'FeatureCollection', 'features': [feature]}
+        style = {'color': 'black', 'weight': 1, 'fillColor': colormap[cutoff_index], 'fillOpacity': 0.5}
+        name = 'Cutoff {} mins'.format(cutoff_mins_[cutoff_index+1])
+        if external:
+            layer_path = '{}/band_{}.geojson'.format(layer_directory, cutoff_mins_[cutoff_index+1])
+            layer_file = os.path.join(map_directory, layer_path)
+            with open(layer_file, 'w') as geojson_file:
+                json.dump(collection, geojson_file, separators=(',', ':'))
+            layer = folium.GeoJson(layer_file, embed=False, name=name,
+                                   style_function=lambda _, style=style: style)
+            # folium links the page to the file it read, which the page loads relative to the map
+            layer.embed_link = layer_path
+        else:
+            layer = folium.GeoJson(collection, name=name, style_function=lambda _, style=style: style)
+        layer.add_to(my_map)
+    folium.LayerControl(collapsed=False).add_to(my_map)
+    my_map.save(path)
+    return my_map
+
+def draw_animated_map(sweep_hull_arrays, departure_times_, cutoff_mins_, cmap, origin_lat, origin_lng,
+                      every_mins=15):
+    """
+    Draw the hulls of a departure time sweep as a map with a time slider
+
+    Args:
+        sweep_hull_arrays (list): hull arrays of each departure time
+        departure_times_ (list): datetimes from epoch in seconds as strings
+        cutoff_mins_ (list): cutoff minute integers
+        cmap (cmap object): colormap used to shade in the map
+        origin_lat (double): latitude of origin
+        origin_lng (double): longitude of origin
+        every_mins (int): minutes each departure time is shown for
+
+    Returns:
+        (folium map object): generated map
+    """
+    from folium.plugins import TimestampedGeoJson
+
+    my_map = folium.Map(location=[origin_lat, origin_lng], zoom_start=11)
+    colormap = [matplotlib.colors.rgb2hex(cmap(i)[:3]) for i in range(cmap.N)][::4]
+    features = []
+    for departure_time, cutoff_hull_arrays in zip(departure_times_, sweep_hull_arrays):
+        # without a timezone, the slider shows the time of day given to generate.next_best_date
+        time_ = (dt.datetime(1970, 1, 1) + dt.timedelta(seconds=int(departure_time))).isoformat()
+        for feature in hull_arrays_to_geojson(cutoff_hull_arrays, cutoff_mins_)['features']:
+            cutoff_index = cutoff_mins_.index(feature['properties']['cutoff_mins']) - 1
+            feature['properties'].update(times=[time_], style={
+                'color': 'black', 'weight': 1, 'fillColor': colormap[cutoff_index], 'fillOpacity': 0.3})
+            features.append(feature)
+    TimestampedGeoJson({'type': 'FeatureCollection', 'features': features},
+                       # shown until just before the next departure, so the two are never drawn together
+                       period='PT{}M'.format(every_mins), duration='PT{}S'.format(every_mins*60 - 1),
+                       add_last_point=False, auto_play=False, date_options='HH:mm').add_to(my_map)
+    return my_map
+
+def default_cmap():
+    """
+    Colormap used for maps unless another is chosen
+
+    Returns:
+        (cmap object): colormap
+    """
+    import seaborn as sns
+    return sns.cubehelix_palette(8, dark=.2, light=.8, reverse=True, as_cmap=True)
+
 def pick_random_cmap(num_layers):
     """
     Pick a colormap as random to use in the folium map
@@ -67,6 +289,7 @@ def pick_random_cmap(num_layers):
     Returns:
         (cmap object): colormap
     """
+    import seaborn as sns
     cmaps = []
     cmaps.append(sns.diverging_palette(250, 15, s=75, l=40, as_cmap=True))
     cmaps.append(sns.color_palette("Paired", n_colors=num_layers+6))
@@ -94,7 +317,7 @@ def plot_coords(binned_coords, cutoff_mins):
     Returns:
         (matplotlib fig object)
     """
-    fig, ax = plt.subplots()
+    fig, ax = _pyplot().subplots()
     for val in binned_coords.keys():
         if val == max(binned_coords.keys()): continue
         print('Calculating cut off minute: ', cutoff_mins[val-1])
@@ -118,7 +341,7 @@ def draw_python_graph(cutoff_hull_arrays_):
         (matplotlib fig object
     """
 
-    fig, ax = plt.subplots()
+    fig, ax = _pyplot().subplots()
     # loop through points associated with each cut off time
     for cutoff_index, cutoff_points in enumerate(cutoff_hull_arrays_):
         # loop through each island in each cutoff time
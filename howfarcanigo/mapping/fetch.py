@@ -0,0 +1,233 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+from utils import telemetry
+
+"""
+This module contains the HTTP machinery used to query the Google API.
+
+Requests are sent from a bounded pool of threads sharing a single keep-alive
+    session, and are throttled by token buckets rather than fixed sleeps
+"""
+
+# top-level statuses worth retrying. Others, e.g. REQUEST_DENIED or
+# OVER_DAILY_LIMIT, will not change by asking again. HTTP_ERROR and
+# FETCH_ERROR stand in for server errors and failed connections
+RETRY_STATUSES = ('UNKNOWN_ERROR', 'OVER_QUERY_LIMIT', 'HTTP_ERROR', 'FETCH_ERROR')
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket used to rate limit calls to the API
+
+    Tokens are added continuously at `rate` per second up to `capacity`.
+    Callers block in `consume` until enough tokens are available.
+
+    Args:
+        rate (double): tokens added per second
+        capacity (double): maximum number of tokens held, defaults to one second's worth
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('Token bucket rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+        self.last = now
+
+    def consume(self, tokens=1):
+        """
+        Block until `tokens` tokens can be taken from the bucket
+
+        Args:
+            tokens (double): number of tokens to take, capped at the bucket capacity
+
+        Returns:
+            (double): seconds spent waiting
+        """
+        tokens = min(float(tokens), self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens)/self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def as_bucket(rate):
+    """
+    Find the token bucket limiting a rate
+
+    Args:
+        rate (double): tokens per second, None for no limit, or an existing TokenBucket
+
+    Returns:
+        (TokenBucket): the given bucket or a new one, None for no limit
+    """
+    if isinstance(rate, TokenBucket):
+        return rate
+    return TokenBucket(rate) if rate else None
+
+
+def make_session(max_workers):
+    """
+    Create a requests session whose connection pool can serve every worker
+
+    Args:
+        max_workers (int): number of threads that will share the session
+
+    Returns:
+        (requests.Session): session with keep-alive connections
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_json(session, url, timeout=60):
+    """
+    Fetch JSON from a url, describing any failure as a response with a non-OK status
+
+    Args:
+        session (requests.Session): session to send the request with
+        url (str): url to fetch
+        timeout (double): request timeout in seconds
+
+    Returns:
+        (int): HTTP status code, None if no response was received
+        (dict): decoded JSON response, or {'status': 'HTTP_ERROR' or 'FETCH_ERROR', 'error_message': ...}
+    """
+    try:
+        response = session.get(url, timeout=timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            return response.status_code, {'status': 'HTTP_ERROR',
+                                          'error_message': 'HTTP {}'.format(response.status_code)}
+        return response.status_code, response.json()
+    except (requests.RequestException, ValueError) as error:
+        return None, {'status': 'FETCH_ERROR', 'error_message': repr(error)}
+
+
+def iter_fetch(urls, elements_per_url, max_workers=8,
+               requests_per_second=10, elements_per_second=1000,
+               session=None, timeout=60, retries=3, backoff=1.0):
+    """
+    Fetch JSON from a list of urls concurrently, yielding each response as it arrives
+
+    At most 2*max_workers requests are in flight or finished but not yet
+    consumed, so responses do not pile up in memory if the consumer is slow.
+    Requests failing with a status in RETRY_STATUSES are retried after an
+    exponentially growing, jittered delay. If every retry fails, the last
+    failed response is yielded.
+
+    Args:
+        urls (list): urls to fetch
+        elements_per_url (list): number of API elements each url is billed for
+        max_workers (int): size of the thread pool
+        requests_per_second (double): maximum request rate, None for no limit, or a TokenBucket
+            shared with other fetches
+        elements_per_second (double): maximum element rate, None for no limit, or a TokenBucket
+            shared with other fetches
+        session (requests.Session): session to reuse, one is created if not provided
+        timeout (double): per-request timeout in seconds
+        retries (int): number of times a failed request is retried
+        backoff (double): seconds before the first retry, doubling for each one after
+
+    Yields:
+        (int): index of the url
+        (dict): decoded JSON response
+    """
+    assert len(urls) == len(elements_per_url), \
+        'Number of element counts must equal number of urls'
+
+    request_bucket = as_bucket(requests_per_second)
+    element_bucket = as_bucket(elements_per_second)
+    own_session = session is None
+    if own_session:
+        session = make_session(max_workers)
+
+    def _fetch(index):
+        for attempt in range(retries + 1):
+            if attempt:
+                telemetry.count('api_retries')
+                time.sleep(backoff*2**(attempt - 1)*random.uniform(0.5, 1.5))
+            throttled = 0.0
+            if request_bucket is not None:
+                throttled += request_bucket.consume(1)
+            if element_bucket is not None:
+                throttled += element_bucket.consume(elements_per_url[index])
+            start = time.perf_counter()
+            http_status, data = get_json(session, urls[index], timeout)
+            if telemetry.is_enabled():
+                seconds = time.perf_counter() - start
+                status = data.get('status')
+                telemetry.count('api_requests', status=status)
+                telemetry.count('api_elements', elements_per_url[index])
+                telemetry.observe('api_request_seconds', seconds)
+                telemetry.observe('api_throttled_seconds', throttled)
+                telemetry.event('api_request', chunk=index, seconds=round(seconds, 6),
+                                throttled=round(throttled, 6), http_status=http_status,
+                                status=status, elements=elements_per_url[index], attempt=attempt)
+            if data.get('status') not in RETRY_STATUSES:
+                break
+        return data
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            next_index = 0
+            while next_index < len(urls) or pending:
+                # keep the window of submitted requests full
+                while next_index < len(urls) and len(pending) < 2*max_workers:
+                    pending[executor.submit(_fetch, next_index)] = next_index
+                    next_index += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=pending.get):
+                    yield pending.pop(future), future.result()
+    finally:
+        if own_session:
+            session.close()
+
+
+def fetch_all(urls, elements_per_url, max_workers=8,
+              requests_per_second=10, elements_per_second=1000,
+              session=None, timeout=60, retries=3, backoff=1.0):
+    """
+    Fetch JSON from a list of urls concurrently, subject to rate limits
+
+    Args:
+        urls (list): urls to fetch
+        elements_per_url (list): number of API elements each url is billed for
+        max_workers (int): size of the thread pool
+        requests_per_second (double): maximum request rate, None for no limit, or a TokenBucket
+            shared with other fetches
+        elements_per_second (double): maximum element rate, None for no limit, or a TokenBucket
+            shared with other fetches
+        session (requests.Session): session to reuse, one is created if not provided
+        timeout (double): per-request timeout in seconds
+        retries (int): number of times a failed request is retried
+        backoff (double): seconds before the first retry, doubling for each one after
+
+    Returns:
+        (list): decoded JSON responses, in the same order as urls
+    """
+    responses = [None]*len(urls)
+    for index, data in iter_fetch(urls, elements_per_url, max_workers,
+                                  requests_per_second, elements_per_second,
+                                  session, timeout, retries, backoff):
+        responses[index] = data
+    return responses
@@ -1,10 +1,10 @@
-import os
+import math
 import numpy as np
 import datetime as dt
-import requests
 import polyline
-import folium
-import time
+from mapping import fetch
+from mapping import journal as journal_module
+from utils import telemetry
 
 """
 TO DO
@@ -12,30 +12,111 @@ TO DO
 
 """
 
-def next_best_date():
+DISTANCEMATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json?"
+# per-request limits of the distancematrix api
+MAX_ELEMENTS = 100
+MAX_ORIGINS = 25
+
+def build_url(api_url, origins, lats_subset, lngs_subset, API_key, travel_mode_, departure_time):
     """
-    Finds the next datetime which is a weekday, with a time of 9am
+    Builds url used to retrieve data from google distancematrix api
+
+    Args:
+        api_url (string): base url of the distancematrix api
+        origins (list): (latitude, longitude) of each origin
+        lats_subset (list): destination latitudes
+        lngs_subset (list): destination longitudes
+        API_key (string): API key for googlemaps client
+        travel_mode_ (string): 'transit' or 'walking'
+        departure_time (string): datetime object from epoch converted to string, time to begin travelling
+
+    Returns:
+        (string): url for these origins and destinations
+    """
+    # base url for calling distance/time google api    
+    url = api_url
+    # add in the origins
+    url += "origins=" + "|".join(str(lat) + "," + str(lng) for lat, lng in origins)
+    # add in the destination with polyline encoding
+    url += "&destinations=enc:" + polyline.encode(
+            [(lat,lng) for lat,lng in zip(lats_subset, lngs_subset)],5) + ":"
+    url += "&key=" + API_key
+    url += "&mode=" + travel_mode_
+    url += "&departure_time=" + departure_time
+    return url
+
+def next_best_date(time_of_day=dt.time(9)):
+    """
+    Finds the next datetime which is a weekday, at 9am unless another time of day is given
+
+    Args:
+        time_of_day (datetime.time): time of day to depart at
 
     Returns:
         (string): datetime from epoch in seconds as string
     """
     date_today = dt.datetime.today()
-    if date_today.hour > 9:
+    if date_today.time() > time_of_day:
         date_today += dt.timedelta(days=1)
     if date_today.weekday() == 5:
         date_today += dt.timedelta(days=2)
     elif date_today.weekday() == 6:
         date_today += dt.timedelta(days=1)
-    departure = dt.datetime.combine(date_today, dt.time(9))
+    departure = dt.datetime.combine(date_today, time_of_day)
     print('Departure date and time: ', departure.date(), departure.time()) 
     # api takes in time in seconds from epoch
     return str(int((departure-dt.datetime(1970,1,1)).total_seconds()))
 
-def retrieve_travel_times(destination_lats, destination_lngs, \
-                            API_key, travel_mode_, origin_lat, origin_lng, \
-                            departure_time=next_best_date()):
+def chunk_travel_times(data, lats_subset, lngs_subset):
     """
-    Retrieves time taken to travel to destination coordinates
+    Read travel times from a distancematrix response to a single origin
+
+    Args:
+        data (dict): decoded JSON response with an OK status
+        lats_subset (list): latitudes of the destinations requested
+        lngs_subset (list): longitudes of the destinations requested
+
+    Returns:
+        (numpy array): travel time to each destination, NaN if unreachable
+    """
+    travel_times = np.full(len(lats_subset), np.nan)
+    for index, element in  enumerate(data['rows'][0]['elements']):
+        if element['status'] != 'OK': # some areas are inaccessible (e.g. parts of Heathrow airport, Area 51)
+            print(lats_subset[index], lngs_subset[index], element)
+            telemetry.count('unreachable_elements', status=element['status'])
+        else:
+            travel_times[index] = element['duration']['value']
+    return travel_times
+
+def sweep_failed(failed, total):
+    """
+    Error raised when chunks still fail after every retry
+
+    Args:
+        failed (list): (chunk index, response) of each failed chunk
+        total (int): number of chunks requested
+
+    Returns:
+        (RuntimeError): error describing the failures
+    """
+    statuses = sorted(set(data.get('status') for _, data in failed))
+    return RuntimeError('{} of {} chunks failed ({}), run again to fetch only those'.format(
+        len(failed), total, ', '.join(str(status) for status in statuses)))
+
+def iter_travel_times(destination_lats, destination_lngs, \
+                      API_key, travel_mode_, origin_lat, origin_lng, \
+                      departure_time=None, \
+                      max_workers=8, requests_per_second=10, \
+                      elements_per_second=1000, api_url=DISTANCEMATRIX_URL, \
+                      cache=None, journal=None, retries=3, backoff=1.0):
+    """
+    Retrieves time taken to travel to destination coordinates, a chunk at a time
+
+    Travel times found in the cache or journal are yielded first, then each chunk
+    of up to 100 destinations as its response arrives, which need not be in the
+    order they were requested. Chunks whose requests still fail after every retry
+    are not yielded: a RuntimeError is raised once every other chunk is done, and
+    with a journal, running again requests only the chunks that failed.
 
     Args:
         destination_lats (list): destination latitudes
@@ -44,12 +125,23 @@ def retrieve_travel_times(destination_lats, destination_lngs, \
         travel_mode_ (string): 'transit' or 'walking'
         origin_lat (double): origin latitude
         origin_lng (double): origin longitude
-        departure_time (string): datetime object from epoch converted to string, time to begin travelling
-
-    Returns:
-        destination_lats (numpy array): destination latitudes that can be travelled to
-        destination_lngs (numpy array): destination longitudes that can be travelled ot
-        travel_times (numpy array): travel times to each coordinate
+        departure_time (string): datetime object from epoch converted to string, time to begin travelling,
+            the next weekday at 9am if not given
+        max_workers (int): number of requests sent concurrently
+        requests_per_second (double): maximum rate of requests to the API, None for no limit,
+            or a fetch.TokenBucket shared with other calls
+        elements_per_second (double): maximum rate of destination elements requested, None for no limit,
+            or a fetch.TokenBucket shared with other calls
+        api_url (string): base url of the distancematrix api
+        cache (TravelTimeCache): cache checked before calling the API and updated with new results
+        journal (ChunkJournal): journal every response is recorded in, and read back from
+            if it holds responses to the same sweep
+        retries (int): number of times a failed request is retried
+        backoff (double): seconds before the first retry, doubling for each one after
+
+    Yields:
+        indices (numpy array): indices into the destinations of the chunk
+        travel_times (numpy array): travel times to each destination of the chunk, NaN if unreachable
     """
 
     def _build_url(lats_subset, lngs_subset):
@@ -57,64 +149,281 @@ def retrieve_travel_times(destination_lats, destination_lngs, \
         Builds url used to retrieve data from google distancematrix api
 
         Args:
-            lats_subset (list): chunk of 100 latitude coordinates
-            lngs_subseet (list): chunk of 100 longitude coordinates
+            lats_subset (list): chunk of up to 100 latitude coordinates
+            lngs_subseet (list): chunk of up to 100 longitude coordinates
 
         Returns:
-            json file containing API data
+            (string): url for this chunk of destinations
         """
-        # base url for calling distance/time google api    
-        url = "https://maps.googleapis.com/maps/api/distancematrix/json?"
-        # add in the origin
-        url += "origins=" + str(origin_lat) + "," + str(origin_lng)
-        # add in the destination with polyline encoding
-        url += "&destinations=enc:" + polyline.encode(
-                [(lat,lng) for lat,lng in zip(lats_subset, lngs_subset)],5) + ":"
-        url += "&key=" + API_key
-        url += "&mode=" + travel_mode_
-        url += "&departure_time=" + departure_time
-        return requests.get(url).json()
-
-    # this 100 value is used later to multiply the chunks -> use variable instead?
+        return build_url(api_url, [(origin_lat, origin_lng)], lats_subset, lngs_subset,
+                         API_key, travel_mode_, departure_time)
+
     assert len(destination_lats) == len(destination_lngs), \
         print('Number of latitude coordinates must equal number of longitude coordinates')
-    assert (len(destination_lats)**2/100).is_integer(), \
-        print('Total number of coordinates must be divisible by 100, number of coordinates is {}'.format(len(destination_lats**2)))
+    destination_lats = np.asarray(destination_lats)
+    destination_lngs = np.asarray(destination_lngs)
+    # found when called rather than when imported, so long-running processes stay current
+    if departure_time is None:
+        departure_time = next_best_date()
+
+    # departure time only changes the route for transit
+    cache_departure = departure_time if travel_mode_ == 'transit' else None
+    if cache is not None:
+        # only destinations we have not already paid for are requested
+        cached, cached_travel_times = cache.lookup(destination_lats, destination_lngs,
+                                                   origin_lat, origin_lng,
+                                                   travel_mode_, cache_departure)
+        print('Found {} of {} travel times in cache'.format(cached.sum(), len(cached)))
+        telemetry.count('cache_hits', int(cached.sum()))
+        telemetry.count('cache_misses', int((~cached).sum()))
+        if cached.any():
+            yield np.where(cached)[0], cached_travel_times[cached]
+    else:
+        cached = np.zeros(len(destination_lats), dtype=bool)
+
+    done = cached.copy()
+    if journal is not None:
+        journal.open(journal_module.describe_sweep(destination_lats, destination_lngs,
+                                                   origin_lat, origin_lng,
+                                                   travel_mode_, departure_time))
+        completed = journal.completed()
+        print('Found {} answered chunks in journal {}'.format(len(completed), journal.path))
+        for indices, data in completed:
+            travel_times = chunk_travel_times(data, destination_lats[indices], destination_lngs[indices])
+            # chunks may overlap the cache, or each other if a chunk was fetched twice
+            new = ~done[indices]
+            done[indices] = True
+            if new.any():
+                yield indices[new], travel_times[new]
+    fetch_indices = np.where(~done)[0]
 
     # we are limited to 100 requests per api so must split up our coordinates
-    lats_list = np.split(destination_lats, len(destination_lats)//100)
-    lngs_list = np.split(destination_lngs, len(destination_lngs)//100)
-
-    # loop over coordinates to retrieve all data
-    all_travel_times = []
-    all_bad_indices = []
-    for chunk in range(len(lats_list)):
-        data = _build_url(lats_list[chunk], lngs_list[chunk])
-        print('Chunk index: ', chunk, ' status: ', data['status'])
-        if chunk % 50 == 0 and chunk != 0:
-            time.sleep(20); print('Sleeping for 20s to prevent API timeout')
-
-        travel_times = []
-        bad_indices = []
-        for index, element in  enumerate(data['rows'][0]['elements']):
-            if element['status'] != 'OK': # some areas are inaccessible (e.g. parts of Heathrow airport, Area 51)
-                print(lats_list[chunk][index], lngs_list[chunk][index], element)
-                print('bad chunk index: {}'.format(index + chunk*100)) # return the string of this bad lat/lng with the api if we want
-                bad_indices.append(index + chunk*100) # must save bad indices to remove them later
-            else:
-                travel_times.append(element['duration']['value'])
-        all_bad_indices = np.concatenate((all_bad_indices, np.asarray(bad_indices)))
-        all_travel_times = np.concatenate((all_travel_times, np.asarray(travel_times)))
+    chunk_indices = [fetch_indices[i:i+100] for i in range(0, len(fetch_indices), 100)]
+
+    # retrieve all chunks concurrently, rate limited to prevent API timeout
+    urls = [_build_url(destination_lats[indices], destination_lngs[indices]) for indices in chunk_indices]
+    responses = fetch.iter_fetch(urls, [len(indices) for indices in chunk_indices],
+                                 max_workers=max_workers,
+                                 requests_per_second=requests_per_second,
+                                 elements_per_second=elements_per_second,
+                                 retries=retries, backoff=backoff)
+
+    # collect each chunk as it arrives
+    failed = []
+    try:
+        for chunk, data in responses:
+            print('Chunk index: ', chunk, ' status: ', data['status'])
+            indices = chunk_indices[chunk]
+            if journal is not None:
+                journal.append(indices, data)
+            if data['status'] != 'OK':
+                # nothing is known about these destinations, so they are neither cached nor yielded
+                print('Chunk failed: ', data.get('error_message', ''))
+                failed.append((chunk, data))
+                continue
+            travel_times = chunk_travel_times(data, destination_lats[indices], destination_lngs[indices])
+            if cache is not None:
+                cache.insert(destination_lats[indices], destination_lngs[indices],
+                             travel_times, origin_lat, origin_lng,
+                             travel_mode_, cache_departure)
+            yield indices, travel_times
+    finally:
+        if journal is not None:
+            journal.close()
+    if failed:
+        raise sweep_failed(failed, len(chunk_indices))
+
+def retrieve_travel_times(destination_lats, destination_lngs, \
+                            API_key, travel_mode_, origin_lat, origin_lng, \
+                            departure_time=None, \
+                            max_workers=8, requests_per_second=10, \
+                            elements_per_second=1000, api_url=DISTANCEMATRIX_URL, \
+                            cache=None, journal=None, retries=3, backoff=1.0):
+    """
+    Retrieves time taken to travel to destination coordinates
+
+    Args:
+        destination_lats (list): destination latitudes
+        destination_lngs (list): destination longitudes
+        API_key (string): API key for googlemaps client
+        travel_mode_ (string): 'transit' or 'walking'
+        origin_lat (double): origin latitude
+        origin_lng (double): origin longitude
+        departure_time (string): datetime object from epoch converted to string, time to begin travelling,
+            the next weekday at 9am if not given
+        max_workers (int): number of requests sent concurrently
+        requests_per_second (double): maximum rate of requests to the API, None for no limit,
+            or a fetch.TokenBucket shared with other calls
+        elements_per_second (double): maximum rate of destination elements requested, None for no limit,
+            or a fetch.TokenBucket shared with other calls
+        api_url (string): base url of the distancematrix api
+        cache (TravelTimeCache): cache checked before calling the API and updated with new results
+        journal (ChunkJournal): journal every response is recorded in, so an interrupted
+            sweep can be resumed
+        retries (int): number of times a failed request is retried
+        backoff (double): seconds before the first retry, doubling for each one after
+
+    Returns:
+        destination_lats (numpy array): destination latitudes that can be travelled to
+        destination_lngs (numpy array): destination longitudes that can be travelled ot
+        travel_times (numpy array): travel times to each coordinate
+    """
+    destination_lats = np.asarray(destination_lats)
+    destination_lngs = np.asarray(destination_lngs)
+    all_travel_times = np.full(len(destination_lats), np.nan)
+    for indices, travel_times in iter_travel_times(destination_lats, destination_lngs,
+                                                   API_key, travel_mode_, origin_lat, origin_lng,
+                                                   departure_time, max_workers, requests_per_second,
+                                                   elements_per_second, api_url, cache,
+                                                   journal, retries, backoff):
+        all_travel_times[indices] = travel_times
 
     # delete elements with a bad status, as no information was returned for these
-    destination_lats = np.delete(destination_lats, np.asarray(all_bad_indices))
-    destination_lngs = np.delete(destination_lngs, np.asarray(all_bad_indices))  
+    good_indices = ~np.isnan(all_travel_times)
+    destination_lats = destination_lats[good_indices]
+    destination_lngs = destination_lngs[good_indices]
+    all_travel_times = all_travel_times[good_indices]
 
     assert len(all_travel_times) == len(destination_lats), \
         print('Different number of travel times to destination coordinates')
 
     return destination_lats, destination_lngs, all_travel_times
 
+def plan_blocks(num_origins, num_destinations, max_elements=MAX_ELEMENTS, max_origins=MAX_ORIGINS):
+    """
+    Choose how many origins and destinations to send in each request
+
+    Every request pairs all of its origins with all of its destinations, so the
+    product is limited by max_elements. The shape needing fewest requests is chosen.
+
+    Args:
+        num_origins (int): number of origins
+        num_destinations (int): number of destinations shared by every origin
+        max_elements (int): maximum origins x destinations per request
+        max_origins (int): maximum origins per request
+
+    Returns:
+        (int): origins per request
+        (int): destinations per request
+    """
+    best = None
+    for origins_per in range(1, min(num_origins, max_origins, max_elements) + 1):
+        destinations_per = max_elements//origins_per
+        requests = math.ceil(num_origins/origins_per)*math.ceil(num_destinations/destinations_per)
+        if best is None or requests < best[0]:
+            best = (requests, origins_per, destinations_per)
+    return best[1], best[2]
+
+def retrieve_travel_times_multi(destination_lats, destination_lngs, \
+                                API_key, travel_mode_, origins, \
+                                departure_time=None, \
+                                max_workers=8, requests_per_second=10, \
+                                elements_per_second=1000, api_url=DISTANCEMATRIX_URL, \
+                                cache=None, max_elements=MAX_ELEMENTS, max_origins=MAX_ORIGINS, \
+                                retries=3, backoff=1.0):
+    """
+    Retrieves time taken to travel from several origins to the same destination coordinates
+
+    Origins and destinations are packed together into requests of up to
+    max_elements elements, sharing one pool of connections and one rate limit.
+
+    Args:
+        destination_lats (list): destination latitudes shared by every origin
+        destination_lngs (list): destination longitudes shared by every origin
+        API_key (string): API key for googlemaps client
+        travel_mode_ (string): 'transit' or 'walking'
+        origins (list): origin coordinates as dicts with 'origin_lat' and 'origin_lng'
+        departure_time (string): datetime object from epoch converted to string, time to begin travelling,
+            the next weekday at 9am if not given
+        max_workers (int): number of requests sent concurrently
+        requests_per_second (double): maximum rate of requests to the API, None for no limit
+        elements_per_second (double): maximum rate of elements requested, None for no limit
+        api_url (string): base url of the distancematrix api
+        cache (TravelTimeCache): cache checked before calling the API and updated with new results
+        max_elements (int): maximum origins x destinations per request
+        max_origins (int): maximum origins per request
+        retries (int): number of times a failed request is retried
+        backoff (double): seconds before the first retry, doubling for each one after
+
+    Returns:
+        (list): for each origin, a tuple of the destination latitudes, longitudes and
+            travel times that can be travelled to, as returned by retrieve_travel_times.
+            If requests still fail after every retry, the answered destinations are
+            cached and a RuntimeError is raised
+    """
+    assert len(destination_lats) == len(destination_lngs), \
+        print('Number of latitude coordinates must equal number of longitude coordinates')
+    destination_lats = np.asarray(destination_lats)
+    destination_lngs = np.asarray(destination_lngs)
+    if departure_time is None:
+        departure_time = next_best_date()
+    origin_points = [(origin['origin_lat'], origin['origin_lng']) for origin in origins]
+
+    # travel time from each origin (rows) to each destination (columns)
+    all_travel_times = np.full((len(origins), len(destination_lats)), np.nan)
+    cache_departure = departure_time if travel_mode_ == 'transit' else None
+    needed = np.ones(len(destination_lats), dtype=bool)
+    if cache is not None:
+        needed[:] = False
+        for row, (origin_lat, origin_lng) in enumerate(origin_points):
+            cached, all_travel_times[row] = cache.lookup(destination_lats, destination_lngs,
+                                                         origin_lat, origin_lng,
+                                                         travel_mode_, cache_departure)
+            needed |= ~cached
+        print('Found {} of {} destinations in cache for every origin'.format((~needed).sum(), len(needed)))
+        telemetry.count('cache_hits', int((~needed).sum()))
+        telemetry.count('cache_misses', int(needed.sum()))
+    fetch_indices = np.where(needed)[0]
+
+    # pack blocks of origins and destinations into each request
+    origins_per, destinations_per = plan_blocks(len(origins), len(fetch_indices), max_elements, max_origins)
+    blocks = [(rows, fetch_indices[i:i+destinations_per])
+              for rows in [np.arange(j, min(j + origins_per, len(origins))) for j in range(0, len(origins), origins_per)]
+              for i in range(0, len(fetch_indices), destinations_per)]
+    print('Requesting {} destinations for {} origins in {} requests of up to {} origins x {} destinations'.format(
+        len(fetch_indices), len(origins), len(blocks), origins_per, destinations_per))
+
+    urls = [build_url(api_url, [origin_points[row] for row in rows],
+                      destination_lats[indices], destination_lngs[indices],
+                      API_key, travel_mode_, departure_time) for rows, indices in blocks]
+    responses = fetch.fetch_all(urls, [len(rows)*len(indices) for rows, indices in blocks],
+                                max_workers=max_workers,
+                                requests_per_second=requests_per_second,
+                                elements_per_second=elements_per_second,
+                                retries=retries, backoff=backoff)
+
+    # split each response back into its origins
+    answered = np.zeros(all_travel_times.shape, dtype=bool)
+    failed = []
+    for chunk, ((rows, indices), data) in enumerate(zip(blocks, responses)):
+        print('Chunk index: ', chunk, ' status: ', data['status'])
+        if data['status'] != 'OK':
+            print('Chunk failed: ', data.get('error_message', ''))
+            failed.append((chunk, data))
+            continue
+        answered[np.ix_(rows, indices)] = True
+        for row, response_row in zip(rows, data['rows']):
+            for index, element in enumerate(response_row['elements']):
+                if element['status'] == 'OK':
+                    all_travel_times[row, indices[index]] = element['duration']['value']
+                else:
+                    all_travel_times[row, indices[index]] = np.nan
+                    telemetry.count('unreachable_elements', status=element['status'])
+
+    results = []
+    for row, (origin_lat, origin_lng) in enumerate(origin_points):
+        if cache is not None and answered[row].any():
+            cache.insert(destination_lats[answered[row]], destination_lngs[answered[row]],
+                         all_travel_times[row, answered[row]], origin_lat, origin_lng,
+                         travel_mode_, cache_departure)
+        # delete elements with a bad status, as no information was returned for these
+        good_indices = ~np.isnan(all_travel_times[row])
+        results.append((destination_lats[good_indices], destination_lngs[good_indices],
+                        all_travel_times[row, good_indices]))
+    if failed:
+        raise sweep_failed(failed, len(blocks))
+    return results
+
 def generate_points(map_type_, N,
                     origin_coords, global_coords,
                     lat_multiplier=0.002, lng_multiplier=0.003):
@@ -0,0 +1,151 @@
+import numpy as np
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import cKDTree
+from geomath.projection import to_metres
+
+"""
+This module contains interpolation of travel times onto a denser lattice.
+
+Travel times fetched on a coarse lattice are interpolated onto a fine one
+    before being grouped into cutoff times, so hulls and contours follow the
+    boundaries more smoothly than the fetched points alone allow. Lattice
+    points far from every fetched point, such as across an unreachable area,
+    are left out rather than guessed.
+
+Cross-validation estimates how far interpolated travel times can be trusted,
+    by interpolating each fold of the fetched points from the others.
+"""
+
+METHODS = ('linear', 'idw')
+
+
+def sample_spacing(points):
+    """Median distance from each point to its nearest neighbour"""
+    distances, _ = cKDTree(points).query(points, k=2)
+    return np.median(distances[:, 1])
+
+
+def interpolator(points, travel_times_, method='linear', neighbours=8, power=2):
+    """
+    Fit an interpolator of travel times
+
+    Args:
+        points (numpy array): (N, 2) coordinates in metres
+        travel_times_ (numpy array): travel time to each point
+        method (str): 'linear' across a Delaunay triangulation, or 'idw' for inverse
+            distance weighting of the nearest neighbours
+        neighbours (int): number of neighbours weighted by idw
+        power (double): power of the distance weights of idw
+
+    Returns:
+        (function): takes (M, 2) coordinates in metres and returns their travel
+            times, NaN outside the triangulation for 'linear'
+    """
+    if method == 'linear':
+        return LinearNDInterpolator(points, travel_times_)
+    elif method == 'idw':
+        tree = cKDTree(points)
+        neighbours = min(neighbours, len(points))
+
+        def _idw(targets):
+            distances, indices = tree.query(targets, k=neighbours)
+            distances, indices = distances.reshape(len(targets), -1), indices.reshape(len(targets), -1)
+            # a target on a sample takes its travel time exactly
+            weights = 1/np.maximum(distances, 1e-9)**power
+            return (weights*travel_times_[indices]).sum(axis=1)/weights.sum(axis=1)
+        return _idw
+    raise ValueError('Interpolation method must be one of {}'.format(', '.join(METHODS)))
+
+
+def densify(lats_, lngs_, travel_times_, N, method='linear', max_gap=1.5, **method_kwargs):
+    """
+    Interpolate travel times onto an N x N lattice spanning the fetched points
+
+    Args:
+        lats_ (list): destination latitudes
+        lngs_ (list): destination longitudes
+        travel_times_ (list): travel time to each destination coordinate
+        N (int): N**2 is the number of lattice points
+        method (str): 'linear' or 'idw', see interpolator
+        max_gap (double): lattice points further than this many fetched point spacings
+            from every fetched point are left out
+        method_kwargs: passed to interpolator
+
+    Returns:
+        lats (numpy array): lattice latitudes with a travel time
+        lngs (numpy array): lattice longitudes with a travel time
+        travel_times (numpy array): interpolated travel time to each coordinate
+    """
+    lats_, lngs_ = np.asarray(lats_, dtype=float), np.asarray(lngs_, dtype=float)
+    travel_times_ = np.asarray(travel_times_, dtype=float)
+    origin_lat = np.mean(lats_)
+    points = to_metres(lats_, lngs_, origin_lat)
+
+    x = np.linspace(lats_.min(), lats_.max(), N)
+    y = np.linspace(lngs_.min(), lngs_.max(), N)
+    xv, yv = np.meshgrid(x, y)
+    lats, lngs = xv.flatten(), yv.flatten()
+    targets = to_metres(lats, lngs, origin_lat)
+
+    travel_times = interpolator(points, travel_times_, method, **method_kwargs)(targets)
+    distances, _ = cKDTree(points).query(targets, distance_upper_bound=max_gap*sample_spacing(points))
+    good_indices = np.isfinite(distances) & ~np.isnan(travel_times)
+    return lats[good_indices], lngs[good_indices], np.round(travel_times[good_indices])
+
+
+def cross_validate(lats_, lngs_, travel_times_, cutoff_mins_, method='linear', folds=5, seed=0,
+                   **method_kwargs):
+    """
+    Estimate the error of interpolated travel times by k-fold cross-validation
+
+    Each fold of fetched points is held out in turn and interpolated from the rest.
+    Held out points outside the triangulation of the rest are not scored.
+
+    Args:
+        lats_ (list): destination latitudes
+        lngs_ (list): destination longitudes
+        travel_times_ (list): travel time to each destination coordinate
+        cutoff_mins_ (list): cutoff times, to count points interpolated into the wrong one
+        method (str): 'linear' or 'idw', see interpolator
+        folds (int): number of folds
+        seed (int): seed of the random assignment of points to folds
+        method_kwargs: passed to interpolator
+
+    Returns:
+        (dict): points scored, mean absolute, root mean square and 90th percentile
+            errors in minutes, and the fraction of points in a different cutoff time
+    """
+    lats_, lngs_ = np.asarray(lats_, dtype=float), np.asarray(lngs_, dtype=float)
+    travel_times_ = np.asarray(travel_times_, dtype=float)
+    points = to_metres(lats_, lngs_, np.mean(lats_))
+    fold_of = np.random.default_rng(seed).permutation(len(points)) % folds
+
+    predicted = np.full(len(points), np.nan)
+    for fold in range(folds):
+        held_out = fold_of == fold
+        predicted[held_out] = interpolator(points[~held_out], travel_times_[~held_out],
+                                           method, **method_kwargs)(points[held_out])
+
+    scored = ~np.isnan(predicted)
+    errors = (predicted[scored] - travel_times_[scored])/60
+    if not len(errors):
+        return {'points': 0}
+    # binned as transform.group_coords bins them
+    bins = [np.digitize(np.round(times/60, 1), np.array(cutoff_mins_))
+            for times in (predicted[scored], travel_times_[scored])]
+    return {'points': int(scored.sum()),
+            'mean_absolute_error': float(np.mean(np.abs(errors))),
+            'root_mean_square_error': float(np.sqrt(np.mean(errors**2))),
+            'p90_absolute_error': float(np.percentile(np.abs(errors), 90)),
+            'wrong_cutoff_fraction': float(np.mean(bins[0] != bins[1]))}
+
+
+def describe_cross_validation(report):
+    """Print a cross-validation report from cross_validate"""
+    if not report['points']:
+        print('Too few points to cross-validate interpolation')
+        return
+    print('Interpolation cross-validated on {} points: mean error {:.1f} mins, RMS {:.1f} mins, '
+          '90% within {:.1f} mins, {:.1%} in the wrong cutoff time'.format(
+              report['points'], report['mean_absolute_error'], report['root_mean_square_error'],
+              report['p90_absolute_error'], report['wrong_cutoff_fraction']))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+"""
+This module contains an append-only journal of the API responses of a sweep.
+
+Each chunk's raw response is written as a line of JSON as soon as it arrives,
+    so a sweep that dies part way keeps every response already paid for.
+    Running the same sweep again reads the journal back and only requests the
+    destinations without an OK response.
+
+    data/coords/transit_localmap_N100.journal.jsonl
+        {"sweep": {...}}                                  first line, what was requested
+        {"indices": [...], "status": "OK", "response": {...}}
+        ...
+"""
+
+JOURNAL_SUFFIX = '.journal.jsonl'
+
+
+def describe_sweep(destination_lats, destination_lngs, origin_lat, origin_lng, travel_mode_, departure_time):
+    """
+    Identify a sweep, so a journal is only resumed by the same request
+
+    Args:
+        destination_lats (list): destination latitudes
+        destination_lngs (list): destination longitudes
+        origin_lat (double): origin latitude
+        origin_lng (double): origin longitude
+        travel_mode_ (string): 'transit' or 'walking'
+        departure_time (string): seconds from epoch as string
+
+    Returns:
+        (dict): JSON serialisable description of the sweep
+    """
+    destinations = np.column_stack((destination_lats, destination_lngs)).astype(float)
+    return {'origin': [float(origin_lat), float(origin_lng)],
+            'travel_mode': travel_mode_,
+            'departure_time': departure_time,
+            'destinations': len(destinations),
+            'destinations_sha1': hashlib.sha1(np.ascontiguousarray(destinations).tobytes()).hexdigest()}
+
+
+def read_sweep(path):
+    """
+    Read which sweep a journal belongs to
+
+    Args:
+        path (str): journal file
+
+    Returns:
+        (dict): description of the sweep, None if there is no readable journal
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as journal_file:
+        try:
+            return json.loads(journal_file.readline()).get('sweep')
+        except ValueError:
+            return None
+
+
+class ChunkJournal(object):
+    """
+    Journal of the responses to each chunk of a sweep
+
+    Args:
+        path (str): JSON lines file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.records = []
+
+    def open(self, sweep):
+        """
+        Read the responses of an earlier run of the same sweep and open the journal for appending
+
+        A journal left by a different sweep is replaced. A line cut short by a
+        crash is dropped.
+
+        Args:
+            sweep (dict): description of the sweep, from describe_sweep
+
+        Returns:
+            (int): number of chunks read back
+        """
+        self.records = []
+        lines = []
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as journal_file:
+                content = journal_file.read()
+            # anything after the last newline was never completely written
+            content = content[:content.rfind(b'\n') + 1]
+            lines = content.decode().splitlines()
+        if lines and json.loads(lines[0]).get('sweep') == sweep:
+            self.records = [json.loads(line) for line in lines[1:]]
+            with open(self.path, 'wb') as journal_file:
+                journal_file.write(content)
+        else:
+            if lines:
+                print('Journal {} is for a different sweep, starting again'.format(self.path))
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, 'w') as journal_file:
+                journal_file.write(json.dumps({'sweep': sweep}) + '\n')
+        self.file = open(self.path, 'a')
+        return len(self.records)
+
+    def completed(self):
+        """
+        Chunks with an OK response
+
+        Returns:
+            (list): (indices, response) of each chunk answered
+        """
+        return [(np.array(record['indices'], dtype=int), record['response'])
+                for record in self.records if record['status'] == 'OK']
+
+    def append(self, indices, response):
+        """
+        Record the response to a chunk, whatever its status
+
+        Args:
+            indices (list): indices into the destinations of the chunk
+            response (dict): decoded JSON response
+        """
+        record = {'indices': [int(index) for index in indices],
+                  'status': response.get('status'), 'response': response}
+        self.records.append(record)
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """Delete the journal, once its responses are saved elsewhere"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
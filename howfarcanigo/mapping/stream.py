@@ -0,0 +1,125 @@
+import numpy as np
+from mapping import transform, draw
+
+"""
+This module contains a streaming alternative to running each stage of the
+    pipeline to completion before the next.
+
+Chunks of travel times from generate.iter_travel_times are gathered as they
+    arrive, and the hulls and map are refreshed every few chunks, so a long
+    run gives a usable preview early. Only one array of travel times the size
+    of the lattice is kept, not the responses.
+"""
+
+class TravelTimeStream(object):
+    """
+    Travel times to a fixed set of destinations, filled in as chunks arrive
+
+    Args:
+        destination_lats (list): destination latitudes requested
+        destination_lngs (list): destination longitudes requested
+        cutoff_mins_ (list): cutoff times in minutes the points are binned by
+    """
+
+    def __init__(self, destination_lats, destination_lngs, cutoff_mins_):
+        self.destination_lats = np.asarray(destination_lats)
+        self.destination_lngs = np.asarray(destination_lngs)
+        self.cutoff_mins = cutoff_mins_
+        # NaN until a destination's chunk arrives, and for unreachable destinations
+        self.travel_times = np.full(len(self.destination_lats), np.nan)
+        self.received = np.zeros(len(self.destination_lats), dtype=bool)
+        # number of reachable points in each cutoff bin, as numbered by np.digitize
+        self.bin_counts = np.zeros(len(cutoff_mins_) + 1, dtype=int)
+        self.chunks = 0
+
+    def add(self, indices, travel_times):
+        """
+        Add a chunk of travel times
+
+        Args:
+            indices (numpy array): indices into the destinations
+            travel_times (numpy array): travel times in seconds, NaN if unreachable
+        """
+        self.travel_times[indices] = travel_times
+        self.received[indices] = True
+        reached = travel_times[~np.isnan(travel_times)]
+        # bin the same way as transform.group_coords
+        bins = np.digitize(np.round(reached/60, 1), np.array(self.cutoff_mins))
+        self.bin_counts += np.bincount(bins, minlength=len(self.bin_counts))
+        self.chunks += 1
+
+    @property
+    def complete(self):
+        return bool(self.received.all())
+
+    def arrays(self):
+        """
+        Reachable destinations so far, in the order they were requested
+
+        Returns:
+            lats (numpy array): destination latitudes that can be travelled to
+            lngs (numpy array): destination longitudes that can be travelled to
+            travel_times (numpy array): travel times to each coordinate
+        """
+        reached = ~np.isnan(self.travel_times)
+        return self.destination_lats[reached], self.destination_lngs[reached], self.travel_times[reached]
+
+    def grouped(self):
+        """Reachable destinations so far grouped as by transform.group_coords"""
+        return transform.group_coords(*self.arrays(), self.cutoff_mins)
+
+    def describe(self):
+        return '{} chunks, {} of {} destinations received, reachable per cutoff: {}'.format(
+            self.chunks, self.received.sum(), len(self.received),
+            ', '.join('<{} mins {}'.format(cutoff, count) for cutoff, count in
+                      zip(self.cutoff_mins[1:], np.cumsum(self.bin_counts)[1:])))
+
+
+def write_preview(stream, data_name, origin_coords, num_bins=4, **hull_kwargs):
+    """
+    Calculate hulls from the travel times received so far and save them as a map
+        and a GeoJSON file
+
+    Args:
+        stream (TravelTimeStream): travel times received so far
+        data_name (str): name of the data, used to name the files
+        origin_coords (dict): origin coordinates
+        num_bins (int): passed to transform.generate_hull_arrays
+        hull_kwargs: passed to transform.generate_hull_arrays
+
+    Returns:
+        (list): hull arrays, as returned by transform.generate_hull_arrays
+    """
+    if not np.isfinite(stream.travel_times).any():
+        return []
+    cutoff_hull_arrays = transform.generate_hull_arrays(stream.grouped(), num_bins=num_bins, **hull_kwargs)
+    map_object = draw.draw_folium_map(cutoff_hull_arrays, stream.cutoff_mins, draw.default_cmap(), **origin_coords)
+    map_object.save('data/{}.html'.format(data_name))
+    draw.save_geojson('data/{}.geojson'.format(data_name), cutoff_hull_arrays, stream.cutoff_mins)
+    return cutoff_hull_arrays
+
+
+def consume(chunks, stream, refresh_every=50, on_refresh=None, final_refresh=True):
+    """
+    Add chunks to a stream as they arrive, refreshing every refresh_every chunks
+
+    Args:
+        chunks (iterator): (indices, travel_times) chunks, e.g. from generate.iter_travel_times
+        stream (TravelTimeStream): stream to add the chunks to
+        refresh_every (int): number of chunks between refreshes
+        on_refresh (function): called with the stream after every refresh_every chunks,
+            e.g. a partial of write_preview
+        final_refresh (bool): call on_refresh once more when every chunk has arrived, False
+            if the complete travel times are drawn afterwards anyway
+
+    Returns:
+        (TravelTimeStream): the stream, with every chunk added
+    """
+    for indices, travel_times in chunks:
+        stream.add(indices, travel_times)
+        if on_refresh is not None and stream.chunks % refresh_every == 0:
+            print('Refreshing preview: ' + stream.describe())
+            on_refresh(stream)
+    if on_refresh is not None and final_refresh and stream.chunks % refresh_every != 0:
+        on_refresh(stream)
+    return stream
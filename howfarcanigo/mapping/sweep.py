@@ -0,0 +1,208 @@
+import datetime as dt
+import hashlib
+import json
+import os
+import numpy as np
+from mapping import cache as cache_module, dataset, fetch, generate, transform
+
+"""
+This module contains sweeps over a day's departure times.
+
+Travel times for each departure are fetched in turn under one rate limit and
+    one cache, so the limit holds across the whole sweep and any departure
+    sharing a cache slot, or a walking sweep, is only paid for once. Between
+    consecutive departures, hulls are only calculated again for the cutoff
+    times whose points changed.
+
+A sweep is saved as a directory of hull files indexed by departure time
+
+    data/hulls/transit_localmap_N100.sweep/
+        index.json
+        0700.hulls.npz, 0715.hulls.npz, ...
+"""
+
+FORMAT_NAME = 'howfarcanigo-sweep'
+FORMAT_VERSION = 1
+
+
+def departure_times(start, end, every_mins):
+    """
+    Departure times from start to end, on the next weekday start has not passed
+
+    Args:
+        start (datetime.time): first departure
+        end (datetime.time): last departure, included if on the interval
+        every_mins (int): minutes between departures
+
+    Returns:
+        (list): datetimes from epoch in seconds as strings, as from generate.next_best_date
+    """
+    if end < start:
+        raise ValueError('Sweep must end after it starts')
+    first = int(generate.next_best_date(start))
+    span = (dt.datetime.combine(dt.date.min, end) - dt.datetime.combine(dt.date.min, start)).total_seconds()
+    return [str(first + offset) for offset in range(0, int(span) + 1, every_mins*60)]
+
+
+def sweep_cache(path, every_mins):
+    """
+    Open a travel time cache whose departure slots are no longer than the interval between departures
+
+    With longer slots, departures sharing a slot would be answered from the cache rather than fetched.
+
+    Args:
+        path (str): path to the SQLite database
+        every_mins (int): minutes between departures
+
+    Returns:
+        (TravelTimeCache): the cache
+    """
+    return cache_module.TravelTimeCache(path, slot_seconds=min(cache_module.SLOT_SECONDS, every_mins*60))
+
+
+def iter_sweep(destination_lats, destination_lngs, API_key, travel_mode_, origin_lat, origin_lng,
+               departure_times_, requests_per_second=10, elements_per_second=1000, cache=None,
+               **retrieve_kwargs):
+    """
+    Retrieve travel times for each departure time in turn, under a shared rate limit and cache
+
+    Args:
+        destination_lats (list): destination latitudes
+        destination_lngs (list): destination longitudes
+        API_key (string): API key for googlemaps client
+        travel_mode_ (string): 'transit' or 'walking'
+        origin_lat (double): origin latitude
+        origin_lng (double): origin longitude
+        departure_times_ (list): datetimes from epoch in seconds as strings
+        requests_per_second (double): maximum rate of requests to the API over the sweep, None for no limit
+        elements_per_second (double): maximum rate of elements requested over the sweep, None for no limit
+        cache (TravelTimeCache): cache shared by every departure, with slots no longer than the
+            interval between them, see sweep_cache
+        retrieve_kwargs: passed to generate.retrieve_travel_times
+
+    Yields:
+        (string): departure time
+        (tuple): destination latitudes, longitudes and travel times, as from generate.retrieve_travel_times
+    """
+    request_bucket = fetch.as_bucket(requests_per_second)
+    element_bucket = fetch.as_bucket(elements_per_second)
+    results = None
+    for departure_time in departure_times_:
+        # walking times do not depend on the departure, so are only fetched once
+        if results is None or travel_mode_ == 'transit':
+            print('Sweeping departure {}'.format(describe_departure(departure_time)))
+            results = generate.retrieve_travel_times(destination_lats, destination_lngs, API_key, travel_mode_,
+                                                     origin_lat, origin_lng, departure_time=departure_time,
+                                                     requests_per_second=request_bucket,
+                                                     elements_per_second=element_bucket,
+                                                     cache=cache, **retrieve_kwargs)
+        yield departure_time, results
+
+
+def describe_departure(departure_time, format_='%Y-%m-%d %H:%M'):
+    """Format a departure time from epoch as it was given to generate.next_best_date"""
+    return (dt.datetime(1970, 1, 1) + dt.timedelta(seconds=int(departure_time))).strftime(format_)
+
+
+def _signature(points):
+    """Digest of a set of points, whatever order they are in"""
+    points = np.unique(np.asarray(points, dtype=float).reshape(-1, 2), axis=0)
+    return hashlib.sha1(np.ascontiguousarray(points).tobytes()).hexdigest()
+
+
+class SweepHulls(object):
+    """
+    Hull arrays of consecutive departure times, calculating only those of bins that changed
+
+    Args:
+        num_bins (int): the number of bins to calculate hulls for, as in transform.generate_hull_arrays
+        hull_kwargs: passed to transform.generate_hull_arrays
+    """
+
+    def __init__(self, num_bins=4, **hull_kwargs):
+        self.num_bins = num_bins
+        self.hull_kwargs = hull_kwargs
+        self.signatures = {} # bin to digest of its points, for the previous departure
+        self.hulls = {} # bin to hull arrays, for the previous departure
+        self.calculated = 0
+        self.reused = 0
+
+    def update(self, b_coords):
+        """
+        Find the hull arrays of the next departure time
+
+        Args:
+            b_coords (dict): cumulative dictionary of points returned from the group_coords function
+
+        Returns:
+            (list): list with each element being a list describing the hull array, as
+                from transform.generate_hull_arrays
+        """
+        bins = list(b_coords.keys())
+        num_bins = max(bins) if self.num_bins == -1 else self.num_bins
+        bins = bins[0:num_bins]
+        signatures = {key: _signature(b_coords[key]) for key in bins}
+        changed = [key for key in bins if self.signatures.get(key) != signatures[key]]
+        print('Calculating hulls for {} of {} bins, the others are unchanged'.format(len(changed), len(bins)))
+        hulls = {key: self.hulls[key] for key in bins if key not in changed}
+        if changed:
+            changed_hulls = transform.generate_hull_arrays({key: b_coords[key] for key in changed},
+                                                           num_bins=len(changed), **self.hull_kwargs)
+            hulls.update(zip(changed, changed_hulls))
+        self.calculated += len(changed)
+        self.reused += len(bins) - len(changed)
+        self.signatures, self.hulls = signatures, hulls
+        return [hulls[key] for key in bins]
+
+
+def save_sweep(path, departure_times_, sweep_hull_arrays, cutoff_mins_):
+    """
+    Save the hull arrays of every departure time of a sweep
+
+    Args:
+        path (str): directory to save the sweep in, replacing any sweep already there
+        departure_times_ (list): datetimes from epoch in seconds as strings
+        sweep_hull_arrays (list): hull arrays of each departure time
+        cutoff_mins_ (list): cutoff minute integers
+
+    Returns:
+        None
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    slices = []
+    for departure_time, cutoff_hull_arrays in zip(departure_times_, sweep_hull_arrays):
+        file_name = '{}.hulls.npz'.format(describe_departure(departure_time, '%H%M'))
+        dataset.save_hull_arrays(os.path.join(path, file_name), cutoff_hull_arrays)
+        slices.append({'departure_time': departure_time, 'hulls': file_name})
+    index = {'format': FORMAT_NAME, 'version': FORMAT_VERSION,
+             'cutoff_mins': list(cutoff_mins_), 'slices': slices}
+    # the index is written last, so it only lists hull files that exist
+    temp_path = os.path.join(path, 'index.json.tmp')
+    with open(temp_path, 'w') as index_file:
+        json.dump(index, index_file, indent=2)
+    os.replace(temp_path, os.path.join(path, 'index.json'))
+
+
+def load_sweep(path):
+    """
+    Load a sweep saved by save_sweep
+
+    Args:
+        path (str): directory the sweep was saved in
+
+    Returns:
+        (list): datetimes from epoch in seconds as strings
+        (list): hull arrays of each departure time
+        (list): cutoff minute integers
+    """
+    with open(os.path.join(path, 'index.json')) as index_file:
+        index = json.load(index_file)
+    if index.get('format') != FORMAT_NAME:
+        raise ValueError('{} is not a sweep'.format(path))
+    if index['version'] > FORMAT_VERSION:
+        raise ValueError('Sweep version {} is newer than supported version {}'.format(
+            index['version'], FORMAT_VERSION))
+    return [slice_['departure_time'] for slice_ in index['slices']], \
+        [dataset.load_hull_arrays(os.path.join(path, slice_['hulls'])) for slice_ in index['slices']], \
+        index['cutoff_mins']
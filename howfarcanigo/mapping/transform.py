@@ -1,6 +1,10 @@
+import time
 import numpy as np
-from sklearn.cluster import DBSCAN
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 from geomath import hulls
+from utils import telemetry
 
 """
 This module contains transformations to be performed on the coordinates
@@ -48,7 +52,7 @@ def group_coords(lats_, lngs_, travel_times_, cutoff_mins_):
         return dictionary_
 
     # convert seconds to minutes for travel time
-    travel_times_mins = [round(i/60, 1) for i in travel_times_]
+    travel_times_mins = np.round(np.asarray(travel_times_, dtype=float)/60, 1)
     # bin the data
     inds = np.digitize(travel_times_mins, np.array(cutoff_mins_))
     # initialise an empty dictionary
@@ -56,7 +60,7 @@ def group_coords(lats_, lngs_, travel_times_, cutoff_mins_):
 
     # numpy array of lats and lngs together
     # hulls takes in longitude as the first element, latitude as the second element!!
-    lng_lat = np.asarray(list(zip(lngs_, lats_)))
+    lng_lat = np.column_stack((lngs_, lats_)).astype(float)
     for ind in np.unique(inds):
         # find indices of each bin, and apply a mask
         bin_mask = np.where(inds==ind)[0]
@@ -66,41 +70,336 @@ def group_coords(lats_, lngs_, travel_times_, cutoff_mins_):
     return _make_dict_cumulative(ttime_dict)
 
 
-def cluster_points(points, max_distance=np.sqrt(2*0.003**2)): #points list e.g. binned_coords[3]
+def lattice_indices(values, tolerance=1e-6):
+    """
+    Find the position of each coordinate on an evenly spaced axis, if there is one
+
+    Args:
+        values (numpy array): coordinates along one axis
+        tolerance (double): largest allowed deviation from the axis, as a fraction of its spacing
+
+    Returns:
+        (numpy array): integer position of each coordinate along the axis, None if not evenly spaced
+        (double): spacing of the axis, infinite if every coordinate is the same
+    """
+    axis = np.unique(values)
+    if len(axis) == 1:
+        return np.zeros(len(values), dtype=np.int64), np.inf
+    step = np.diff(axis).min()
+    positions = np.round((values - axis[0])/step).astype(np.int64)
+    if not np.allclose(axis[0] + positions*step, values, rtol=0, atol=step*tolerance):
+        return None, step
+    return positions, step
+
+def _lattice_pairs(points, max_distance):
+    """
+    Find every pair of points within max_distance of each other on a lattice
+
+    Only the lattice offsets that can be within max_distance are looked up,
+    so the cost is linear in the number of points.
+
+    Args:
+        points (numpy array): coordinate pairs
+        max_distance (double): maximum distance between paired points
+
+    Returns:
+        (numpy array): first point of each pair, None if the points are not on a lattice
+        (numpy array): second point of each pair
+    """
+    rows, row_step = lattice_indices(points[:, 0])
+    cols, col_step = lattice_indices(points[:, 1])
+    if rows is None or cols is None:
+        return None, None
+    max_row, max_col = int(max_distance/row_step), int(max_distance/col_step)
+    # too many offsets to check means the lattice is fine compared with max_distance
+    if (2*max_row + 1)*(2*max_col + 1) > 1000:
+        return None, None
+
+    width = cols.max() + 2*max_col + 1
+    keys = rows*width + cols
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    first, second = [], []
+    for d_row in range(0, max_row + 1):
+        for d_col in range(-max_col, max_col + 1):
+            # each pair is found once, from the point with the lower key
+            if (d_row == 0 and d_col <= 0) or \
+                    np.hypot(d_row*row_step, d_col*col_step) > max_distance*(1 + 1e-9):
+                continue
+            positions = np.searchsorted(sorted_keys, keys + d_row*width + d_col)
+            positions = np.minimum(positions, len(keys) - 1)
+            found = sorted_keys[positions] == keys + d_row*width + d_col
+            first.append(np.flatnonzero(found))
+            second.append(order[positions[found]])
+    # only one of several points at the same position is found by its key, so each is paired with the one before it
+    duplicates = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+    first.append(order[duplicates])
+    second.append(order[duplicates + 1])
+    first, second = np.concatenate(first), np.concatenate(second)
+    # offsets on the limit are checked on the actual coordinates, as DBSCAN would
+    close = np.hypot(*(points[first] - points[second]).T) <= max_distance
+    return first[close], second[close]
+
+def spaced_max_distances(points, sample, max_distance=np.sqrt(2*0.003**2), neighbours=4):
+    """
+    Widen the distance within which points are grouped where the samples around them are sparse
+
+    Adaptively sampled travel times are dense near cutoff boundaries and sparse
+    elsewhere, so a single max_distance would break their sparse parts apart.
+    Each point may instead reach as far as the diagonal of a lattice cell as wide
+    as the distance to its neighbours-th nearest sample, which is the lattice
+    spacing on a uniform lattice.
+
+    Args:
+        points (numpy array): coordinate pairs to find the distance of, each one of the samples
+        sample (numpy array): coordinate pairs of every sampled point
+        max_distance (double): smallest distance returned
+        neighbours (int): number of nearest samples spanning a point's lattice cells
+
+    Returns:
+        (numpy array): maximum distance of each point
+    """
+    # the nearest sample to each point is itself
+    distances, _ = cKDTree(sample).query(points, k=neighbours + 1)
+    return np.maximum(max_distance, np.sqrt(2)*distances[:, -1])
+
+def label_points(points, max_distance=np.sqrt(2*0.003**2), method='auto'):
+    """
+    Labels points by the island they belong to
+
+    Points are in the same island if they are linked by a chain of points each
+    within max_distance of the next, as DBSCAN with min_samples=1 would group them.
+    Points on a lattice are linked through their lattice neighbours, and any
+    other points through a KD-tree radius search.
+
+    Args:
+        points (list): coordinate pairs, e.g. a set of binned coordinates
+        max_distance (double or numpy array): maximum distance beyond which two points will no longer
+            be grouped, or that of each point, where two points are grouped within the larger of theirs
+        method (str): 'auto' to use the lattice when there is one, 'lattice', 'tree' or 'dbscan'
+
+    Returns:
+        (numpy array): island label of each point, numbered in order of first appearance
+    """
+    points = np.asarray(points, dtype=float)
+    per_point = np.ndim(max_distance) > 0
+    if per_point and method in ('lattice', 'dbscan'):
+        raise ValueError('A distance for each point needs the tree method')
+    if method == 'dbscan':
+        from sklearn.cluster import DBSCAN
+        clustering = DBSCAN(eps=max_distance, min_samples=1).fit(points)
+        # points labelled as -1 have no cluster
+        assert len(clustering.labels_) == len(points)
+        return clustering.labels_
+    if len(points) == 0:
+        return np.array([], dtype=int)
+
+    first = second = None
+    if method in ('auto', 'lattice') and not per_point:
+        first, second = _lattice_pairs(points, max_distance)
+        if first is None and method == 'lattice':
+            raise ValueError('Points do not lie on a lattice')
+    if first is None:
+        pairs = cKDTree(points).query_pairs(r=np.max(max_distance), output_type='ndarray')
+        first, second = pairs[:, 0], pairs[:, 1]
+    if per_point:
+        reach = np.maximum(max_distance[first], max_distance[second])
+        close = np.hypot(*(points[first] - points[second]).T) <= reach
+        first, second = first[close], second[close]
+
+    graph = coo_matrix((np.ones(len(first), dtype=bool), (first, second)), shape=(len(points), len(points)))
+    _, labels = connected_components(graph, directed=False)
+    # renumber islands in order of their first point, matching DBSCAN
+    _, first_index = np.unique(labels, return_index=True)
+    renumber = np.empty(len(first_index), dtype=int)
+    renumber[np.argsort(first_index)] = np.arange(len(first_index))
+    return renumber[labels]
+
+def cluster_points(points, max_distance=np.sqrt(2*0.003**2), method='auto', sample=None): #points list e.g. binned_coords[3]
     """
     Clusters points into islands
 
-    Uses the DBSCAN algorithm to group points based on nearest neighbours
+    Groups points based on nearest neighbours, see label_points
 
     Args:
         points (list): coordinate pairs, e.g. a set of binned coordinates
         max_distance (double): maximum distance beyond which two points will no longer be grouped
+        method (str): 'auto' to use the lattice when there is one, 'lattice', 'tree' or 'dbscan'
+        sample (numpy array): every sampled point, to widen max_distance where the samples
+            are sparse, see spaced_max_distances. Defaults to max_distance everywhere
 
     Returns:
         (dict): keys identifying islands with values as lists where each list is a separate cluster of points
     """
-    clustering = DBSCAN(eps=max_distance, min_samples=1).fit(points)
-    # points labelled as -1 have no cluster
-    assert len(clustering.labels_) == len(points)
-    #plt.scatter(points[:,0], points[:,1], c=clustering.labels_, cmap='bwr')
-    # initialise dictionary of empty lists
-    islands = {i: [] for i in set(clustering.labels_)}
-    # group clustered coordinates by label
-    for index in range(len(points)):
-        islands[clustering.labels_[index]].append(points[index])
-    # change each grouping to a numpy array so that points can use slicing etc.
-    for key in islands.keys():
-        islands[key] = np.asarray(islands[key])
-    return islands
-
-def generate_hull_arrays(b_coords, num_bins=-1):
+    points = np.asarray(points)
+    if sample is not None:
+        max_distance, method = spaced_max_distances(points, sample, max_distance), 'tree'
+    labels = label_points(points, max_distance, method)
+    #plt.scatter(points[:,0], points[:,1], c=labels, cmap='bwr')
+    # group clustered coordinates by label, keeping their order within each island
+    order = np.argsort(labels, kind='mergesort')
+    splits = np.flatnonzero(np.diff(labels[order])) + 1
+    return {label: island for label, island in
+            zip(labels[order][np.concatenate(([0], splits))] if len(order) else [],
+                np.split(points[order], splits))}
+
+def track_islands(b_coords, keys, max_distance=np.sqrt(2*0.003**2), sample=None):
+    """
+    Cluster cumulative bins into islands, reusing the islands of the previous bin
+
+    Each bin is a superset of the one before it, so an island can only grow or
+    merge with others. Only the islands within max_distance of the points new to
+    a bin are clustered again, together with those new points; every other island
+    is carried over unchanged. Duplicate points are dropped.
+
+    Args:
+        b_coords (dict): cumulative dictionary of points returned from the group_coords function
+        keys (list): bins to cluster, in increasing order
+        max_distance (double): maximum distance beyond which two points will no longer be grouped
+        sample (numpy array): every sampled point, to widen max_distance where the samples
+            are sparse, see spaced_max_distances. Defaults to max_distance everywhere
+
+    Returns:
+        (list): points of every distinct island, in the order they were created
+        (list): for each bin, the indices into the first list of its islands
+    """
+    # every point of the last bin, which holds the points of all earlier bins
+    universe = np.unique(np.asarray(b_coords[keys[-1]]), axis=0)
+    # complex numbers sort the same way as the (lng, lat) rows from np.unique
+    universe_keys = universe[:, 0] + 1j*universe[:, 1]
+    tree = cKDTree(universe)
+    if sample is not None:
+        max_distance = spaced_max_distances(universe, sample, max_distance)
+
+    island_of = np.full(len(universe), -1) # island index of each point seen so far
+    members = {} # island index to point indices, for the islands of the current bin
+    island_points = []
+    bin_islands = []
+    previous_ids = np.array([], dtype=int)
+    for key in keys:
+        band = np.asarray(b_coords[key])
+        band_ids = np.unique(np.searchsorted(universe_keys, band[:, 0] + 1j*band[:, 1]))
+        new_ids = np.setdiff1d(band_ids, previous_ids, assume_unique=True)
+        previous_ids = band_ids
+
+        # islands within reach of a new point are merged with the new points and clustered again
+        neighbours = tree.query_ball_point(universe[new_ids], r=np.max(max_distance))
+        neighbours = np.asarray([ix for near in neighbours for ix in near], dtype=int)
+        touched = np.unique(island_of[neighbours])
+        touched = touched[touched >= 0]
+        subset = np.concatenate([new_ids] + [members.pop(island) for island in touched])
+        print('Processing island: ', key, ', reclustering {} new points with {} islands'.format(len(new_ids), len(touched)))
+
+        if len(subset):
+            labels = label_points(universe[subset], max_distance if sample is None else max_distance[subset])
+            for label in np.unique(labels):
+                ids = subset[labels == label]
+                island_of[ids] = len(island_points)
+                members[len(island_points)] = ids
+                island_points.append(universe[ids])
+        bin_islands.append(list(members.keys()))
+    return island_points, bin_islands
+
+def calculate_hull(points, hull_search='linear'):
+    """
+    Calculate the concave hull of a single island
+
+    Args:
+        points (numpy array): coordinate pairs of the island, at least 3
+        hull_search (str): how ConcaveHull searches for k, 'linear' or 'gallop'
+
+    Returns:
+        (numpy array): hull array, None if no hull was found
+        (int): number of values of k attempted
+        (int): value of k used for the hull
+    """
+    concave_hull = hulls.ConcaveHull(points, search=hull_search)
+    hull_array = concave_hull.calculate()
+    return hull_array, concave_hull.attempts, concave_hull.k
+
+def _calculate_shared_hull(shm_name, total, offset, size, hull_search):
+    """
+    Calculate the concave hull of an island stored in shared memory, in a worker process
+
+    Args:
+        shm_name (str): name of the shared memory block holding every island
+        total (int): number of points in the shared memory block
+        offset (int): index of the island's first point in the block
+        size (int): number of points in the island
+        hull_search (str): how ConcaveHull searches for k, 'linear' or 'gallop'
+
+    Returns:
+        (tuple): as returned by calculate_hull
+    """
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        points = np.ndarray((total, 2), dtype=float, buffer=shm.buf)[offset:offset+size].copy()
+    finally:
+        shm.close()
+    return calculate_hull(points, hull_search)
+
+def calculate_hulls_parallel(point_sets, hull_search='linear', processes=None):
+    """
+    Calculate the concave hulls of many islands in a pool of processes
+
+    Every island is copied once into a shared memory block that the workers read
+    from, rather than being pickled to them. Islands are submitted largest first
+    so that the biggest hulls do not finish last.
+
+    Args:
+        point_sets (list): coordinate pairs of each island
+        hull_search (str): how ConcaveHull searches for k, 'linear' or 'gallop'
+        processes (int): number of worker processes, defaults to the number of CPUs
+
+    Returns:
+        (list): a tuple as returned by calculate_hull for each island, in the order given
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    sizes = np.array([len(points) for points in point_sets], dtype=int)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(int)
+    total = int(sizes.sum())
+    results = [None]*len(point_sets)
+    if total == 0:
+        return results
+
+    shm = shared_memory.SharedMemory(create=True, size=total*2*np.dtype(float).itemsize)
+    try:
+        shared = np.ndarray((total, 2), dtype=float, buffer=shm.buf)
+        for points, offset in zip(point_sets, offsets):
+            shared[offset:offset+len(points)] = points
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(_calculate_shared_hull, shm.name, total,
+                                       int(offsets[ix]), int(sizes[ix]), hull_search): ix
+                       for ix in np.argsort(-sizes, kind='mergesort')}
+            for future, ix in futures.items():
+                results[ix] = future.result()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+def generate_hull_arrays(b_coords, num_bins=-1, hull_search='linear', processes=1, incremental=False,
+                         local_spacing=False):
     """
     Generate hull arrays for each island in each cutoff time
 
+    Islands are clustered, and padded where too small, in order first so that
+    the random padding points are the same whichever way the hulls are calculated.
+
     Args:
         b_coords (dict): cumulative dictionary of points belonging to each travel-time set of islands
             returned from the group_coords function
         num_bins (int): the number of bins that we want to process, if not all. Defaults to all bins
+        hull_search (str): how ConcaveHull searches for k, 'linear' or 'gallop'
+        processes (int): number of processes calculating hulls at once, None for the number of CPUs
+        incremental (bool): build each bin's islands from the previous bin's with track_islands,
+            calculating hulls only for islands that changed
+        local_spacing (bool): group points within a distance that grows where the samples are
+            sparse, for travel times sampled by adaptive.sample_travel_times
 
     Returns:
         (list): list with each element being a list describing the hull array
@@ -108,28 +407,94 @@ def generate_hull_arrays(b_coords, num_bins=-1):
     rng = np.random.RandomState(42) # initialise random state to generate points later
     bins = list(b_coords.keys()) # make dict keys in a list so we don't have to process them all
     if num_bins == -1: num_bins = max(bins)
-    cutoff_hull_arrays = [] # initialise empty array to store all hull arrays for this cut off time
+    # the last bin holds every sampled point
+    sample = np.asarray(b_coords[bins[-1]]) if local_spacing else None
     print('\nGenerating hull arrays...')
-    for key in bins[0:num_bins]: # take a certain number of bins 
-        print('Processing island: ', key, ' of ', num_bins)
-        islands = cluster_points(b_coords[key])
-        island_hull_arrays = [] # initialise empty array to store all hull arrays for this island
-        for point_set in islands.keys():
-            print('\t Processing cluster {} of {}'.format(point_set+1, len(islands.keys())))
-            if point_set == -1:
-                raise ValueError('POINT SET -1')
-                continue
-            if len(islands[point_set]) < 3: # need at least 3 points to make a hull array
-                # generate two very close by points at random so that we can draw a concave hull
-                extra_points = 3 - len(islands[point_set]) 
-                temp_points = islands[point_set][0] + rng.rand(extra_points,2)*(10**-7) # this gives the nearby points a resolution of ~1m
-                hull_array = hulls.ConcaveHull(np.append(islands[point_set], temp_points).reshape((3, 2))).calculate() # append new points and reshape to correct size
-            else:
-                hull_array = hulls.ConcaveHull(islands[point_set]).calculate()
-            island_hull_arrays.append(hull_array)
-        cutoff_hull_arrays.append(island_hull_arrays)
+    if incremental:
+        island_points, bin_islands = track_islands(b_coords, bins[0:num_bins], sample=sample)
+    else:
+        island_points = [] # points of every island, in output order
+        bin_islands = [] # indices of the islands in each cut off time
+        for key in bins[0:num_bins]: # take a certain number of bins 
+            print('Processing island: ', key, ' of ', num_bins)
+            islands = cluster_points(b_coords[key], sample=sample)
+            bin_islands.append(list(range(len(island_points), len(island_points) + len(islands))))
+            for point_set in islands.keys():
+                if point_set == -1:
+                    raise ValueError('POINT SET -1')
+                    continue
+                island_points.append(islands[point_set])
+
+    point_sets = [] # points of every island to calculate a hull for
+    for points in island_points:
+        if len(points) < 3: # need at least 3 points to make a hull array
+            # generate two very close by points at random so that we can draw a concave hull
+            extra_points = 3 - len(points) 
+            temp_points = points[0] + rng.rand(extra_points,2)*(10**-7) # this gives the nearby points a resolution of ~1m
+            point_sets.append(np.append(points, temp_points).reshape((3, 2))) # append new points and reshape to correct size
+        else:
+            point_sets.append(points)
+
+    # seconds spent on each hull, only known when calculated in this process
+    seconds = [None]*len(point_sets)
+    if processes == 1:
+        results = []
+        for index, points in enumerate(point_sets):
+            print('\t Processing cluster {} of {}'.format(index+1, len(point_sets)))
+            start = time.perf_counter()
+            results.append(calculate_hull(points, hull_search))
+            seconds[index] = time.perf_counter() - start
+    else:
+        print('\t Processing {} clusters in parallel'.format(len(point_sets)))
+        with telemetry.timer('hull_pool', processes=processes, islands=len(point_sets)):
+            results = calculate_hulls_parallel(point_sets, hull_search, processes)
+
+    if telemetry.is_enabled():
+        for cutoff_index, islands in enumerate(bin_islands):
+            for island in islands:
+                hull_array, attempts, k = results[island]
+                telemetry.observe('hull_attempts', attempts)
+                if seconds[island] is not None:
+                    telemetry.observe('hull_seconds', seconds[island])
+                telemetry.count('hulls', found=hull_array is not None)
+                telemetry.event('island', cutoff_index=cutoff_index, island=island,
+                                points=len(island_points[island]), attempts=attempts,
+                                k=k, found=hull_array is not None,
+                                seconds=None if seconds[island] is None else round(seconds[island], 6))
+
+    for points, (hull_array, attempts, k) in zip(island_points, results):
+        if hull_array is None:
+            print('\t\t {} points, no hull found after {} attempts'.format(len(points), attempts))
+        elif attempts > 1:
+            print('\t\t {} points, hull found with k={} after {} attempts'.format(len(points), k, attempts))
+
+    # initialise empty array to store all hull arrays for each cut off time
+    cutoff_hull_arrays = [[results[island][0] for island in islands] for islands in bin_islands]
     return cutoff_hull_arrays
 
+def buffer_hull_arrays(cutoff_hull_arrays, meters):
+    """
+    Buffer the islands of each cutoff time by a distance, merging those that then overlap
+
+    Each cutoff time is buffered as a whole, see hulls.buffer_hulls
+
+    Args:
+        cutoff_hull_arrays (list): list of list containings points as concave hulls
+        meters (double): distance to buffer by in metres
+
+    Returns:
+        (list): hull arrays in the same form, holes joined to their island as by contour.bridge_holes
+    """
+    # contour is only needed, and contourpy only imported, when buffering
+    from mapping.contour import bridge_holes
+    buffered_hull_arrays = []
+    for cutoff_hulls in cutoff_hull_arrays:
+        buffered = hulls.buffer_hulls(cutoff_hulls, meters)
+        buffered_hull_arrays.append([bridge_holes(np.asarray(polygon.exterior.coords),
+                                                  [np.asarray(interior.coords) for interior in polygon.interiors])
+                                     for polygon in buffered.geoms])
+    return buffered_hull_arrays
+
 def describe_cutoffs(cutoff_mins, binned_coords):
     """
     FUTURE:: Do we want to remove this and just keep it in main?
@@ -0,0 +1,358 @@
+import csv
+import io
+import zipfile
+import datetime as dt
+import numpy as np
+from scipy.spatial import cKDTree
+from geomath.projection import to_metres
+
+"""
+This module contains an offline alternative to the distancematrix api for transit.
+
+A GTFS feed (a zip of timetable csv files) is compiled into array-backed
+    timetables for a single service day, then searched from the origin with
+    RAPTOR (round-based public transit routing): each round rides every route
+    serving a stop improved in the round before, then walks between nearby stops.
+    Walking legs to and from stops are straight lines at walking pace.
+
+Only trips in stop_times.txt are used, frequencies.txt is not expanded.
+"""
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def _read_csv(feed, name, required=True):
+    """Read a file of the feed as a list of dicts, empty if an optional file is missing"""
+    if name not in feed.namelist():
+        if required:
+            raise ValueError('GTFS feed has no {}'.format(name))
+        return []
+    with feed.open(name) as csv_file:
+        # utf-8-sig drops the byte order mark some feeds are written with
+        return list(csv.DictReader(io.TextIOWrapper(csv_file, encoding='utf-8-sig')))
+
+
+def _seconds(time_string):
+    """Convert a GTFS HH:MM:SS time, which may pass 24:00:00, to seconds after midnight"""
+    if not time_string or not time_string.strip():
+        return np.nan
+    hours, minutes, seconds = time_string.strip().split(':')
+    return int(hours)*3600 + int(minutes)*60 + int(seconds)
+
+
+def active_services(calendar, calendar_dates, date):
+    """
+    Find the services running on a date
+
+    Args:
+        calendar (list): rows of calendar.txt
+        calendar_dates (list): rows of calendar_dates.txt
+        date (datetime.date): service day
+
+    Returns:
+        (set): ids of the services running
+    """
+    day = date.strftime('%Y%m%d')
+    services = {row['service_id'] for row in calendar
+                if row['start_date'] <= day <= row['end_date'] and row[WEEKDAYS[date.weekday()]] == '1'}
+    for row in calendar_dates:
+        if row['date'] != day:
+            continue
+        if row['exception_type'] == '1':
+            services.add(row['service_id'])
+        elif row['exception_type'] == '2':
+            services.discard(row['service_id'])
+    return services
+
+
+class Timetable(object):
+    """
+    Trips of a single service day, grouped into routes RAPTOR can scan
+
+    Trips sharing a sequence of stops form a route, split further where a trip
+    would overtake another, so the trips of a route are ordered at every stop.
+
+    Args:
+        stop_lats (numpy array): latitude of each stop
+        stop_lngs (numpy array): longitude of each stop
+        routes (list): (stops, arrivals, departures) of each route, the stop indices
+            it calls at in order and (trips, stops) arrays of times in seconds after midnight
+        transfers (list): (from stop, to stop, seconds) of each transfer between stops
+        stop_ids (list): GTFS id of each stop
+    """
+
+    def __init__(self, stop_lats, stop_lngs, routes, transfers=(), stop_ids=None):
+        self.stop_lats = np.asarray(stop_lats, dtype=float)
+        self.stop_lngs = np.asarray(stop_lngs, dtype=float)
+        self.stop_ids = stop_ids
+        num_stops = len(self.stop_lats)
+        self.route_stops = [np.asarray(stops, dtype=np.int64) for stops, _, _ in routes]
+        # a row of inf after the last trip stands for not catching any trip
+        self.route_arrivals = [np.vstack([arrivals, np.full(len(stops), np.inf)])
+                               for stops, arrivals, _ in routes]
+        self.route_departures = [np.asarray(departures, dtype=float) for _, _, departures in routes]
+
+        # routes calling at each stop, in compressed sparse rows
+        stop_route_pairs = np.array([(stop, route) for route, stops in enumerate(self.route_stops)
+                                     for stop in set(stops.tolist())], dtype=np.int64).reshape(-1, 2)
+        order = np.argsort(stop_route_pairs[:, 0], kind='mergesort')
+        self.stop_routes = stop_route_pairs[order, 1]
+        self.stop_route_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(stop_route_pairs[:, 0], minlength=num_stops))])
+
+        # transfers leaving each stop, in compressed sparse rows
+        transfers = np.array(list(transfers), dtype=float).reshape(-1, 3)
+        order = np.argsort(transfers[:, 0], kind='mergesort')
+        self.transfer_targets = transfers[order, 1].astype(np.int64)
+        self.transfer_seconds = transfers[order, 2]
+        self.transfer_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(transfers[:, 0].astype(np.int64), minlength=num_stops))])
+
+    @property
+    def num_stops(self):
+        return len(self.stop_lats)
+
+    @property
+    def num_routes(self):
+        return len(self.route_stops)
+
+    def routes_serving(self, stops):
+        """Indices of the routes calling at any of the stops"""
+        if not len(stops):
+            return np.empty(0, dtype=np.int64)
+        starts, ends = self.stop_route_offsets[stops], self.stop_route_offsets[stops + 1]
+        return np.unique(np.concatenate([self.stop_routes[start:end] for start, end in zip(starts, ends)]))
+
+    def transfers_from(self, stops):
+        """(from stop, to stop, seconds) arrays of the transfers leaving any of the stops"""
+        counts = self.transfer_offsets[stops + 1] - self.transfer_offsets[stops]
+        rows = np.concatenate([np.arange(self.transfer_offsets[stop], self.transfer_offsets[stop + 1])
+                               for stop in stops]) if len(stops) else np.empty(0, dtype=np.int64)
+        return np.repeat(stops, counts), self.transfer_targets[rows], self.transfer_seconds[rows]
+
+
+def _split_overtaking(stops, trips):
+    """Split the trips of a stop sequence into routes in which no trip overtakes another"""
+    trips.sort(key=lambda trip: trip[1][0])
+    routes = []
+    for arrivals, departures in trips:
+        for route in routes:
+            if np.all(departures >= route[-1][1]) and np.all(arrivals >= route[-1][0]):
+                route.append((arrivals, departures))
+                break
+        else:
+            routes.append([(arrivals, departures)])
+    return [(stops, np.array([trip[0] for trip in route]), np.array([trip[1] for trip in route]))
+            for route in routes]
+
+
+def load_gtfs(path, date, walking_speed=1.4, transfer_radius=250):
+    """
+    Compile the trips of a GTFS feed running on a date into a timetable
+
+    Missing stop times between timepoints are interpolated by stop sequence.
+    Stops within transfer_radius of each other can be walked between, and
+    transfers.txt adds or lengthens transfers, or forbids them.
+
+    Args:
+        path (str): GTFS zip file
+        date (datetime.date): service day
+        walking_speed (double): walking speed in metres per second
+        transfer_radius (double): furthest distance in metres walked between stops
+
+    Returns:
+        (Timetable): the day's timetable
+    """
+    with zipfile.ZipFile(path) as feed:
+        stops = [row for row in _read_csv(feed, 'stops.txt') if row.get('stop_lat') and row.get('stop_lon')]
+        trips = _read_csv(feed, 'trips.txt')
+        stop_times = _read_csv(feed, 'stop_times.txt')
+        calendar = _read_csv(feed, 'calendar.txt', required=False)
+        calendar_dates = _read_csv(feed, 'calendar_dates.txt', required=False)
+        transfer_rows = _read_csv(feed, 'transfers.txt', required=False)
+
+    stop_index = {row['stop_id']: index for index, row in enumerate(stops)}
+    services = active_services(calendar, calendar_dates, date)
+    running = {row['trip_id'] for row in trips if row['service_id'] in services}
+
+    calls = {}
+    for row in stop_times:
+        if row['trip_id'] in running and row['stop_id'] in stop_index:
+            calls.setdefault(row['trip_id'], []).append(
+                (int(row['stop_sequence']), stop_index[row['stop_id']],
+                 _seconds(row['arrival_time']), _seconds(row['departure_time'])))
+
+    patterns = {}
+    for trip_calls in calls.values():
+        if len(trip_calls) < 2:
+            continue
+        trip_calls.sort()
+        trip_stops = tuple(call[1] for call in trip_calls)
+        arrivals = np.array([call[2] for call in trip_calls], dtype=float)
+        departures = np.array([call[3] for call in trip_calls], dtype=float)
+        # a missing arrival or departure takes the other, then untimed stops are interpolated
+        arrivals = np.where(np.isnan(arrivals), departures, arrivals)
+        departures = np.where(np.isnan(departures), arrivals, departures)
+        timed = ~np.isnan(arrivals)
+        if timed.sum() < 2:
+            continue
+        sequence = np.arange(len(trip_calls))
+        arrivals = np.interp(sequence, sequence[timed], arrivals[timed])
+        departures = np.interp(sequence, sequence[timed], departures[timed])
+        patterns.setdefault(trip_stops, []).append((arrivals, departures))
+
+    routes = []
+    for trip_stops, pattern_trips in patterns.items():
+        routes.extend(_split_overtaking(np.array(trip_stops), pattern_trips))
+
+    stop_lats = np.array([float(row['stop_lat']) for row in stops])
+    stop_lngs = np.array([float(row['stop_lon']) for row in stops])
+    transfers = {}
+    if len(stops):
+        points = to_metres(stop_lats, stop_lngs, np.mean(stop_lats))
+        for source, target in cKDTree(points).query_pairs(transfer_radius, output_type='ndarray'):
+            seconds = np.hypot(*(points[source] - points[target]))/walking_speed
+            transfers[source, target] = transfers[target, source] = seconds
+    for row in transfer_rows:
+        if row['from_stop_id'] not in stop_index or row['to_stop_id'] not in stop_index:
+            continue
+        pair = (stop_index[row['from_stop_id']], stop_index[row['to_stop_id']])
+        if pair[0] == pair[1]:
+            continue
+        if row.get('transfer_type') == '3':
+            transfers.pop(pair, None)
+        elif row.get('min_transfer_time'):
+            transfers[pair] = max(transfers.get(pair, 0), float(row['min_transfer_time']))
+
+    print('Loaded {} trips on {} routes between {} stops for {}'.format(
+        sum(len(trips_) for trips_ in patterns.values()), len(routes), len(stops), date))
+    return Timetable(stop_lats, stop_lngs, routes,
+                     [(source, target, seconds) for (source, target), seconds in transfers.items()],
+                     stop_ids=[row['stop_id'] for row in stops])
+
+
+def raptor(timetable, access_stops, access_seconds, departure_seconds, max_transfers=4, max_seconds=np.inf):
+    """
+    Earliest arrival at every stop, riding at most max_transfers + 1 vehicles
+
+    Args:
+        timetable (Timetable): timetable to search
+        access_stops (numpy array): stops reachable on foot from the origin
+        access_seconds (numpy array): seconds walked to each of them
+        departure_seconds (double): time leaving the origin, in seconds after midnight
+        max_transfers (int): maximum number of changes between vehicles
+        max_seconds (double): arrivals more than this long after departure are ignored
+
+    Returns:
+        (numpy array): earliest arrival at each stop in seconds after midnight, inf if not reached
+    """
+    limit = departure_seconds + max_seconds
+    best = np.full(timetable.num_stops, np.inf)
+    np.minimum.at(best, access_stops, departure_seconds + access_seconds)
+    best[best > limit] = np.inf
+    previous = best.copy()
+    # earliest arrival at each stop by vehicle, the only arrivals walked on from
+    by_vehicle = np.full(timetable.num_stops, np.inf)
+    marked = np.flatnonzero(np.isfinite(best))
+
+    for _ in range(max_transfers + 1):
+        if not len(marked):
+            break
+        rode = np.full(timetable.num_stops, np.inf)
+        for route in timetable.routes_serving(marked):
+            stops = timetable.route_stops[route]
+            departures = timetable.route_departures[route]
+            # the first trip that can be boarded at each stop, given arrivals from the round before
+            boardable = (departures < previous[stops]).sum(axis=0)
+            # trips are ordered, so the trip ridden is the earliest boarded at any stop before
+            ridden = np.minimum.accumulate(boardable)[:-1]
+            arrivals = timetable.route_arrivals[route][ridden, np.arange(1, len(stops))]
+            np.minimum.at(rode, stops[1:], arrivals)
+        rode[rode > limit] = np.inf
+        # a stop reached sooner on foot can still be walked on from once reached by vehicle
+        improved = np.flatnonzero(rode < by_vehicle)
+        by_vehicle = np.minimum(by_vehicle, rode)
+        current = np.minimum(previous, rode)
+
+        # walk between stops reached by vehicle this round
+        sources, targets, seconds = timetable.transfers_from(improved)
+        np.minimum.at(current, targets, rode[sources] + seconds)
+        current[current > limit] = np.inf
+        marked = np.flatnonzero(current < previous)
+        best = np.minimum(best, current)
+        previous = current
+    return best
+
+
+def service_time(departure_time):
+    """
+    Split a departure time from generate.next_best_date into a service day and seconds after midnight
+
+    Args:
+        departure_time (string): datetime from epoch in seconds as string
+
+    Returns:
+        (datetime.date): service day
+        (int): seconds after midnight
+    """
+    departure = dt.datetime(1970, 1, 1) + dt.timedelta(seconds=int(departure_time))
+    return departure.date(), departure.hour*3600 + departure.minute*60 + departure.second
+
+
+def retrieve_travel_times(destination_lats, destination_lngs, timetable, origin_lat, origin_lng,
+                          departure_time, walking_speed=1.4, max_walk=1000, max_transfers=4,
+                          max_seconds=3*3600, egress_stops=8):
+    """
+    Finds time taken to travel to destination coordinates by transit, without the API
+
+    Returns the same arrays as generate.retrieve_travel_times. Each destination is
+    reached by walking from one of its egress_stops nearest stops within max_walk,
+    or directly from the origin, whichever is sooner.
+
+    Args:
+        destination_lats (list): destination latitudes
+        destination_lngs (list): destination longitudes
+        timetable (Timetable): timetable of the departure's service day, from load_gtfs
+        origin_lat (double): origin latitude
+        origin_lng (double): origin longitude
+        departure_time (string): datetime from epoch in seconds as string, as from generate.next_best_date
+        walking_speed (double): walking speed in metres per second
+        max_walk (double): furthest distance in metres walked to or from a stop
+        max_transfers (int): maximum number of changes between vehicles
+        max_seconds (double): destinations further than this are treated as unreachable
+        egress_stops (int): number of stops considered near each destination
+
+    Returns:
+        destination_lats (numpy array): destination latitudes that can be travelled to
+        destination_lngs (numpy array): destination longitudes that can be travelled to
+        travel_times (numpy array): travel times to each coordinate
+    """
+    destination_lats = np.asarray(destination_lats, dtype=float)
+    destination_lngs = np.asarray(destination_lngs, dtype=float)
+    _, departure_seconds = service_time(departure_time)
+
+    origin = to_metres(origin_lat, origin_lng, origin_lat)[0]
+    destinations = to_metres(destination_lats, destination_lngs, origin_lat)
+    travel_times = np.hypot(*(destinations - origin).T)/walking_speed
+    travel_times[travel_times > max_seconds] = np.inf
+
+    if timetable.num_stops:
+        stop_tree = cKDTree(to_metres(timetable.stop_lats, timetable.stop_lngs, origin_lat))
+        access_stops = np.array(stop_tree.query_ball_point(origin, max_walk), dtype=np.int64)
+        access_seconds = np.hypot(*(stop_tree.data[access_stops] - origin).T)/walking_speed
+        arrivals = raptor(timetable, access_stops, access_seconds, departure_seconds,
+                          max_transfers, max_seconds)
+        print('Reached {} of {} stops'.format(np.isfinite(arrivals).sum(), timetable.num_stops))
+
+        # missing neighbours are given the index num_stops, which arrives at inf
+        distances, stops = stop_tree.query(destinations, k=min(egress_stops, timetable.num_stops),
+                                           distance_upper_bound=max_walk)
+        distances, stops = distances.reshape(len(destinations), -1), stops.reshape(len(destinations), -1)
+        arrivals = np.append(arrivals, np.inf)
+        by_transit = (arrivals[stops] + distances/walking_speed).min(axis=1) - departure_seconds
+        travel_times = np.minimum(travel_times, by_transit)
+
+    # drop unreachable destinations, as generate.retrieve_travel_times drops those with a bad status
+    good_indices = travel_times <= max_seconds
+    return destination_lats[good_indices], destination_lngs[good_indices], \
+        np.round(travel_times[good_indices])
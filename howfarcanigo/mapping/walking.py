@@ -0,0 +1,280 @@
+import bz2
+import csv
+import gzip
+import numpy as np
+import xml.etree.ElementTree as ElementTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+from geomath.projection import to_metres
+
+"""
+This module contains an offline alternative to the distancematrix api for walking.
+
+A street network is loaded into a graph in compressed sparse rows, then a single
+    shortest path tree from the origin, bounded by the largest cutoff time,
+    gives the walking time to every destination snapped onto the network.
+
+Street networks can be read from
+    an OpenStreetMap extract, .osm (optionally .gz or .bz2) or .osm.pbf, the
+        latter needing the osmium package
+    an edge list, a .csv with from_lat, from_lng, to_lat, to_lng and optionally
+        length columns, lengths in metres defaulting to straight lines
+"""
+
+# highway values of OpenStreetMap ways that cannot be walked along
+NOT_WALKABLE = {'motorway', 'motorway_link', 'trunk', 'trunk_link', 'construction',
+                'proposed', 'raceway', 'bus_guideway', 'escape'}
+
+
+class StreetGraph(object):
+    """
+    Undirected street network, with edge lengths in metres
+
+    Args:
+        node_lats (numpy array): latitude of each node
+        node_lngs (numpy array): longitude of each node
+        sources (numpy array): first node of each edge
+        targets (numpy array): second node of each edge
+        lengths (numpy array): length of each edge in metres, straight lines if not given
+    """
+
+    def __init__(self, node_lats, node_lngs, sources, targets, lengths=None):
+        self.node_lats = np.asarray(node_lats, dtype=float)
+        self.node_lngs = np.asarray(node_lngs, dtype=float)
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        self.points = to_metres(self.node_lats, self.node_lngs,
+                                np.mean(self.node_lats) if len(self.node_lats) else 0)
+        if lengths is None:
+            lengths = np.hypot(*(self.points[sources] - self.points[targets]).T)
+        # csgraph treats an explicit zero as a missing edge, so coincident nodes are kept joined
+        lengths = np.maximum(np.asarray(lengths, dtype=float), 1e-3)
+        num_nodes = len(self.node_lats)
+        # both directions of every edge
+        self.adjacency = _adjacency(np.concatenate([sources, targets]), np.concatenate([targets, sources]),
+                                    np.concatenate([lengths, lengths]), num_nodes)
+        self._tree = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_lats)
+
+    @property
+    def num_edges(self):
+        return self.adjacency.nnz//2
+
+    def snap(self, lats, lngs, max_snap=np.inf):
+        """
+        Find the node nearest each coordinate
+
+        Args:
+            lats (list): latitudes
+            lngs (list): longitudes
+            max_snap (double): furthest distance in metres a coordinate is moved
+
+        Returns:
+            (numpy array): nearest node of each coordinate, num_nodes if none within max_snap
+            (numpy array): distance to it in metres, inf if none within max_snap
+        """
+        if self._tree is None:
+            self._tree = cKDTree(self.points)
+        origin_lat = np.mean(self.node_lats)
+        distances, nodes = self._tree.query(to_metres(lats, lngs, origin_lat), distance_upper_bound=max_snap)
+        return nodes, distances
+
+    def distances_from(self, node, limit=np.inf):
+        """
+        Network distance from a node to every other node, by Dijkstra's algorithm
+
+        Args:
+            node (int): node to start from
+            limit (double): nodes further than this many metres are not searched past
+
+        Returns:
+            (numpy array): distance in metres to each node, inf if further than limit
+        """
+        return dijkstra(self.adjacency, directed=False, indices=node, limit=limit)
+
+
+def _adjacency(rows, cols, lengths, num_nodes):
+    """Sparse adjacency matrix in which duplicate edges keep their shortest length, rather than their sum"""
+    order = np.lexsort((lengths, cols, rows))
+    rows, cols, lengths = rows[order], cols[order], lengths[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    return csr_matrix((lengths[first], (rows[first], cols[first])), shape=(num_nodes, num_nodes))
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    elif path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _walkable(tags):
+    return 'highway' in tags and tags['highway'] not in NOT_WALKABLE \
+        and tags.get('foot') != 'no' and tags.get('access') not in ('no', 'private')
+
+
+def _graph_from_ways(node_coords, ways):
+    """Build a StreetGraph from {osm id: (lat, lng)} and lists of osm node ids along walkable ways"""
+    used = sorted({node for way in ways for node in way if node in node_coords})
+    index = {node: position for position, node in enumerate(used)}
+    sources, targets = [], []
+    for way in ways:
+        way = [index[node] for node in way if node in index]
+        sources.extend(way[:-1])
+        targets.extend(way[1:])
+    coords = np.array([node_coords[node] for node in used], dtype=float).reshape(-1, 2)
+    return StreetGraph(coords[:, 0], coords[:, 1], sources, targets)
+
+
+def read_osm_xml(path):
+    """
+    Read the walkable ways of an OpenStreetMap XML extract
+
+    Args:
+        path (str): .osm file, optionally compressed as .gz or .bz2
+
+    Returns:
+        (StreetGraph): street network
+    """
+    node_coords, ways = {}, []
+    with _open(path) as osm_file:
+        for _, element in ElementTree.iterparse(osm_file):
+            if element.tag == 'node':
+                node_coords[element.get('id')] = (float(element.get('lat')), float(element.get('lon')))
+                element.clear()
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                if _walkable(tags):
+                    ways.append([node.get('ref') for node in element.iter('nd')])
+                element.clear()
+    return _graph_from_ways(node_coords, ways)
+
+
+def read_osm_pbf(path):
+    """
+    Read the walkable ways of an OpenStreetMap PBF extract, using the osmium package
+
+    Args:
+        path (str): .osm.pbf file
+
+    Returns:
+        (StreetGraph): street network
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError('Reading .osm.pbf files needs osmium, `pip install osmium`, '
+                          'or convert the extract to .osm first')
+
+    class _WayHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super(_WayHandler, self).__init__()
+            self.node_coords, self.ways = {}, []
+
+        def way(self, way):
+            if _walkable({tag.k: tag.v for tag in way.tags}):
+                refs = []
+                for node in way.nodes:
+                    if node.location.valid():
+                        self.node_coords[node.ref] = (node.location.lat, node.location.lon)
+                        refs.append(node.ref)
+                self.ways.append(refs)
+
+    handler = _WayHandler()
+    handler.apply_file(path, locations=True)
+    return _graph_from_ways(handler.node_coords, handler.ways)
+
+
+def read_edge_list(path):
+    """
+    Read a street network from a csv of edges
+
+    Edge ends at the same coordinates are the same node.
+
+    Args:
+        path (str): .csv file with from_lat, from_lng, to_lat, to_lng and optionally length columns
+
+    Returns:
+        (StreetGraph): street network
+    """
+    with open(path, newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    ends = np.array([[float(row['from_lat']), float(row['from_lng']), float(row['to_lat']), float(row['to_lng'])]
+                     for row in rows]).reshape(-1, 4)
+    coords, nodes = np.unique(np.concatenate([ends[:, :2], ends[:, 2:]]), axis=0, return_inverse=True)
+    nodes = nodes.reshape(-1)
+    lengths = np.array([float(row['length']) for row in rows]) if rows and rows[0].get('length') else None
+    return StreetGraph(coords[:, 0], coords[:, 1], nodes[:len(rows)], nodes[len(rows):], lengths)
+
+
+def load_streets(path):
+    """
+    Load a street network, choosing the reader by file extension
+
+    Args:
+        path (str): .osm, .osm.gz, .osm.bz2, .osm.pbf or .csv file
+
+    Returns:
+        (StreetGraph): street network
+    """
+    if path.endswith('.pbf'):
+        graph = read_osm_pbf(path)
+    elif path.endswith('.csv'):
+        graph = read_edge_list(path)
+    elif path.endswith(('.osm', '.osm.gz', '.osm.bz2', '.xml')):
+        graph = read_osm_xml(path)
+    else:
+        raise ValueError('Street networks must be .osm, .osm.pbf or .csv files, not {}'.format(path))
+    print('Loaded {} nodes and {} edges of street network'.format(graph.num_nodes, graph.num_edges))
+    return graph
+
+
+def retrieve_travel_times(destination_lats, destination_lngs, graph, origin_lat, origin_lng,
+                          walking_speed=1.4, max_seconds=3600, max_snap=200):
+    """
+    Finds time taken to walk to destination coordinates along a street network, without the API
+
+    Returns the same arrays as generate.retrieve_travel_times. The origin and each
+    destination are snapped to their nearest nodes, and the walk to or from the node is
+    added in a straight line.
+
+    Args:
+        destination_lats (list): destination latitudes
+        destination_lngs (list): destination longitudes
+        graph (StreetGraph): street network, from load_streets
+        origin_lat (double): origin latitude
+        origin_lng (double): origin longitude
+        walking_speed (double): walking speed in metres per second
+        max_seconds (double): the search stops at this walking time, e.g. the largest cutoff,
+            and destinations further away are treated as unreachable
+        max_snap (double): destinations further than this many metres from the network are
+            treated as unreachable
+
+    Returns:
+        destination_lats (numpy array): destination latitudes that can be travelled to
+        destination_lngs (numpy array): destination longitudes that can be travelled to
+        travel_times (numpy array): travel times to each coordinate
+    """
+    destination_lats = np.asarray(destination_lats, dtype=float)
+    destination_lngs = np.asarray(destination_lngs, dtype=float)
+    origin_nodes, origin_snaps = graph.snap([origin_lat], [origin_lng], max_snap)
+    if not np.isfinite(origin_snaps[0]):
+        raise ValueError('Origin is more than {}m from the street network'.format(max_snap))
+    limit = max_seconds*walking_speed
+    distances = graph.distances_from(origin_nodes[0], limit - origin_snaps[0]) + origin_snaps[0]
+    print('Reached {} of {} street nodes'.format(np.isfinite(distances).sum(), graph.num_nodes))
+
+    # destinations too far from the network are snapped to num_nodes, which is never reached
+    nodes, snaps = graph.snap(destination_lats, destination_lngs, max_snap)
+    distances = np.append(distances, np.inf)
+    travel_times = (distances[nodes] + snaps)/walking_speed
+
+    # drop unreachable destinations, as generate.retrieve_travel_times drops those with a bad status
+    good_indices = travel_times <= max_seconds
+    return destination_lats[good_indices], destination_lngs[good_indices], \
+        np.round(travel_times[good_indices])
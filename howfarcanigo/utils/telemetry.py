@@ -0,0 +1,249 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+"""
+This module contains lightweight instrumentation for the pipeline.
+
+Counters, summaries (count, sum, min and max of observed values) and
+    structured events are recorded while telemetry is enabled, and exported as
+    JSON lines or as a Prometheus text file. Telemetry is off by default, in
+    which case every call returns straight away.
+
+    telemetry.enable('data/telemetry.jsonl')
+    with telemetry.timer('stage', stage='fetch'):
+        ...
+    telemetry.count('api_requests', status='OK')
+    telemetry.event('hull', points=120, attempts=2, k=5)
+    telemetry.close()
+"""
+
+METRIC_PREFIX = 'howfarcanigo_'
+# returned by timer while disabled, so timing costs nothing
+_NULL_TIMER = contextlib.nullcontext()
+_recorder = None
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Recorder(object):
+    """
+    Thread-safe store of counters, summaries and events
+
+    Args:
+        stream (file): open text file events are written to as JSON lines as they
+            are recorded, None to only keep them in memory
+    """
+
+    def __init__(self, stream=None):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.summaries = {}
+        self.events = []
+        self.stream = stream
+
+    def count(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                self.summaries[key] = [1, value, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = min(summary[2], value)
+                summary[3] = max(summary[3], value)
+
+    def event(self, name, **fields):
+        record = dict(fields, event=name, time=round(time.time(), 6))
+        with self.lock:
+            self.events.append(record)
+            if self.stream is not None:
+                self.stream.write(json.dumps(record, default=_to_json) + '\n')
+                self.stream.flush()
+
+    def metrics(self):
+        """
+        Counters and summaries as JSON serialisable records
+
+        Returns:
+            (list): one dict per counter or summary and set of labels
+        """
+        with self.lock:
+            records = [{'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in sorted(self.counters.items())]
+            records += [{'type': 'summary', 'name': name, 'labels': dict(labels),
+                         'count': count, 'sum': total, 'min': minimum, 'max': maximum}
+                        for (name, labels), (count, total, minimum, maximum) in sorted(self.summaries.items())]
+        return records
+
+    def write_json_lines(self, text_file, events=True):
+        """
+        Write events and then metrics as one JSON object per line
+
+        Args:
+            text_file (file): open text file
+            events (bool): include the events, False if they were already streamed
+        """
+        records = list(self.events) if events else []
+        records += [dict(record, event='metric') for record in self.metrics()]
+        for record in records:
+            text_file.write(json.dumps(record, default=_to_json) + '\n')
+
+    def write_prometheus(self, text_file):
+        """
+        Write metrics in the Prometheus text exposition format
+
+        Counters become `<name>_total` and summaries `<name>_count` and `<name>_sum`,
+        followed by separate `<name>_min` and `<name>_max` gauges. Events are not exported.
+
+        Args:
+            text_file (file): open text file
+        """
+        # samples of each family are written together, under its one type line
+        families = {}
+        for record in self.metrics():
+            name = METRIC_PREFIX + record['name']
+            labels = _prometheus_labels(record['labels'])
+            if record['type'] == 'counter':
+                samples = [(name + '_total', 'counter', '{}_total{} {}'.format(name, labels, record['value']))]
+            else:
+                samples = [(name, 'summary', '{}_count{} {}'.format(name, labels, record['count'])),
+                           (name, 'summary', '{}_sum{} {}'.format(name, labels, record['sum'])),
+                           (name + '_min', 'gauge', '{}_min{} {}'.format(name, labels, record['min'])),
+                           (name + '_max', 'gauge', '{}_max{} {}'.format(name, labels, record['max']))]
+            for family, type_, sample in samples:
+                families.setdefault((family, type_), []).append(sample)
+        lines = []
+        for (family, type_), samples in families.items():
+            lines.append('# TYPE {} {}'.format(family, type_))
+            lines.extend(samples)
+        text_file.write('\n'.join(lines) + '\n')
+
+
+class _Timer(object):
+    """Context manager observing the seconds spent inside it"""
+
+    def __init__(self, recorder, name, labels):
+        self.recorder = recorder
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.recorder.observe(self.name + '_seconds', self.seconds, **self.labels)
+        self.recorder.event(self.name, seconds=round(self.seconds, 6), **self.labels)
+
+
+def _to_json(value):
+    # numpy scalars are the usual values that json cannot serialise
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+               for key, value in sorted(labels.items()))
+    return '{' + ','.join(escaped) + '}'
+
+
+def enable(path=None):
+    """
+    Start recording telemetry, replacing anything recorded so far
+
+    Args:
+        path (str): file telemetry is written to by close. A path ending .prom is
+            written as a Prometheus text file, anything else as JSON lines with the
+            events streamed to it as they happen. None to only keep it in memory
+
+    Returns:
+        (Recorder): the recorder now in use
+    """
+    global _recorder
+    stream = None
+    if path is not None and not path.endswith('.prom'):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        stream = open(path, 'w')
+    _recorder = Recorder(stream)
+    _recorder.path = path
+    return _recorder
+
+
+def disable():
+    """Stop recording telemetry, discarding anything not written by close"""
+    global _recorder
+    if _recorder is not None and _recorder.stream is not None:
+        _recorder.stream.close()
+    _recorder = None
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def close():
+    """
+    Write the telemetry recorded to the path given to enable, then stop recording
+
+    Returns:
+        (Recorder): the recorder that was in use, None if telemetry was disabled
+    """
+    recorder = _recorder
+    if recorder is None:
+        return None
+    if recorder.stream is not None:
+        recorder.write_json_lines(recorder.stream, events=False)
+    elif recorder.path is not None:
+        directory = os.path.dirname(recorder.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(recorder.path, 'w') as text_file:
+            recorder.write_prometheus(text_file)
+    disable()
+    return recorder
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter"""
+    if _recorder is not None:
+        _recorder.count(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Add a value to a summary"""
+    if _recorder is not None:
+        _recorder.observe(name, value, **labels)
+
+
+def event(name, **fields):
+    """Record a structured event"""
+    if _recorder is not None:
+        _recorder.event(name, **fields)
+
+
+def timer(name, **labels):
+    """
+    Time a block of code, observing `<name>_seconds` and recording a `<name>` event
+
+    Returns:
+        context manager
+    """
+    if _recorder is None:
+        return _NULL_TIMER
+    return _Timer(_recorder, name, labels)
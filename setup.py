@@ -37,7 +37,7 @@ setup(
                         'folium', 'matplotlib', 'seaborn', \
                         ##(ipython) 'ipython', 'parso', 'jedi', 'pygments', 'ipython-genutils', \   
                         'numpy', 'datetime', 'requests', \
-                        'polyline', 'sklearn',
+                        'polyline', 'sklearn', 'scipy', 'contourpy',
                         'shapely'], 
 
 
@@ -46,11 +46,10 @@ setup(
     # `pip` to create the appropriate form of executable for the target
     # platform.
     #
-    # For example, the following would provide a command called `sample` which
-    # executes the function `main` from this package when invoked:
-    entry_points={  # Optional
+    # The `howfarcanigo` command runs the function `main` in howfarcanigo/cli.py
+    entry_points={
         'console_scripts': [
-            'sample=sample:main',
+            'howfarcanigo=howfarcanigo.cli:main',
         ],
     },
 
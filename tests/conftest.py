@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the package modules import each other as top-level `mapping`, `geomath` and `utils`
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'howfarcanigo')
+if PACKAGE_DIR not in sys.path:
+    sys.path.insert(0, PACKAGE_DIR)
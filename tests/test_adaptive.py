@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import cli
+from bench.standin import StandInServer, uniform_speed
+from mapping import adaptive, configure, dataset, transform
+
+ORIGIN = {'origin_lat': 51.5, 'origin_lng': -0.1}
+CUTOFF_MINS = [0, 10, 20, 30, 40, 50, 60]
+# walking from the origin, or from stops reached after a wait
+HUBS = [(51.5, -0.1, 0), (51.53, -0.05, 900), (51.47, -0.15, 1200), (51.52, -0.16, 1500)]
+
+
+def _retrieve(lats, lngs):
+    lats, lngs = np.asarray(lats), np.asarray(lngs)
+    travel_times = np.full(len(lats), np.inf)
+    for lat, lng, wait in HUBS:
+        distances = np.hypot((lats - lat)*111e3, (lngs - lng)*69e3)
+        travel_times = np.minimum(travel_times, wait + distances/1.4)
+    return lats, lngs, travel_times
+
+
+def _same_partition(labels, other_labels):
+    pairs = set(zip(labels, other_labels))
+    return len(pairs) == len(set(labels)) == len(set(other_labels))
+
+
+def test_adaptive_samples_form_the_islands_of_a_uniform_lattice():
+    lats, lngs, travel_times = adaptive.sample_travel_times(_retrieve, 'local', 65, ORIGIN, None,
+                                                            CUTOFF_MINS, coarse_N=9)
+    # the full lattice the samples were refined towards
+    min_lat, max_lat, min_lng, max_lng = adaptive.lattice_bounds('local', 65, ORIGIN, None)
+    lattice_lats, lattice_lngs = [axis.flatten() for axis in np.meshgrid(
+        np.linspace(min_lat, max_lat, 65), np.linspace(min_lng, max_lng, 65), indexing='ij')]
+    assert len(lats) < len(lattice_lats)
+
+    sampled = transform.group_coords(lats, lngs, travel_times, CUTOFF_MINS)
+    uniform = transform.group_coords(*_retrieve(lattice_lats, lattice_lngs), CUTOFF_MINS)
+    sample = sampled[max(sampled)]
+    broken_apart = False
+    for key, points in sampled.items():
+        # label the lattice, then compare the labels of the points that were sampled
+        lattice_labels = transform.label_points(uniform[key])
+        lookup = {tuple(point): label for point, label in zip(uniform[key], lattice_labels)}
+        expected = [lookup[tuple(point)] for point in points]
+        labels = transform.label_points(points, transform.spaced_max_distances(points, sample))
+        assert _same_partition(labels, expected)
+        broken_apart |= not _same_partition(transform.label_points(points), expected)
+    # a single distance breaks the sparse parts apart
+    assert broken_apart
+
+
+def test_tracked_islands_use_the_local_spacing():
+    lats, lngs, travel_times = adaptive.sample_travel_times(_retrieve, 'local', 65, ORIGIN, None,
+                                                            CUTOFF_MINS, coarse_N=9)
+    grouped = transform.group_coords(lats, lngs, travel_times, CUTOFF_MINS)
+    keys = list(grouped)
+    sample = np.asarray(grouped[keys[-1]])
+    island_points, bin_islands = transform.track_islands(grouped, keys, sample=sample)
+    for key, islands in zip(keys, bin_islands):
+        clustered = transform.cluster_points(grouped[key], sample=sample)
+        # tracked islands drop the duplicate points of the cumulative bins
+        assert sorted(len(island_points[island]) for island in islands) == \
+            sorted(len(np.unique(points, axis=0)) for points in clustered.values())
+
+
+def test_fetch_samples_adaptively(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings = {'API_key': 'key', 'origins': [('Origin', ORIGIN)], 'data_names': ['adaptive'],
+                'travel_mode': 'walking', 'map_type': 'local', 'global_coords': None, 'N': 20,
+                'cutoff_mins': [0, 20, 40, 60, 80]}
+    with StandInServer(speed_field=uniform_speed()) as server:
+        args = cli.make_parser().parse_args(['run', '--adaptive', '5', '--api-url', server.url])
+        cli.run(settings, args)
+    data = dataset.TravelTimeDataset(configure.dataset_path('adaptive'))
+    assert data.metadata['adaptive'] == 5
+    # fewer points than the 33 x 33 lattice they refine towards
+    assert 25 < len(data.travel_times) < 33*33
+    assert os.path.exists(cli.hull_path('adaptive'))
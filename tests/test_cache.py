@@ -0,0 +1,86 @@
+import datetime as dt
+import numpy as np
+import pytest
+from mapping import cache
+
+ORIGIN = (51.5, -0.1)
+LATS, LNGS = [51.51, 51.52, 51.53], [-0.11, -0.12, -0.13]
+
+
+def _departure(year, month, day, hour, minute=0):
+    """Seconds from epoch as string, as from generate.next_best_date"""
+    return str(int((dt.datetime(year, month, day, hour, minute) - dt.datetime(1970, 1, 1)).total_seconds()))
+
+
+@pytest.fixture
+def travel_time_cache(tmp_path):
+    travel_time_cache = cache.TravelTimeCache(str(tmp_path / 'travel_times.sqlite'))
+    # Monday 19 October 2026 at 9am, the middle destination is unreachable
+    travel_time_cache.insert(LATS, LNGS, [600, np.nan, 900], *ORIGIN, 'transit', _departure(2026, 10, 19, 9))
+    yield travel_time_cache
+    travel_time_cache.close()
+
+
+def _lookup(travel_time_cache, departure_time, travel_mode='transit'):
+    return travel_time_cache.lookup(LATS + [51.54], LNGS + [-0.14], *ORIGIN, travel_mode, departure_time)
+
+
+def test_lookup_finds_inserted_times(travel_time_cache):
+    found, travel_times = _lookup(travel_time_cache, _departure(2026, 10, 19, 9, 10))
+    np.testing.assert_array_equal(found, [True, True, True, False])
+    np.testing.assert_array_equal(travel_times, [600, np.nan, 900, np.nan])
+
+
+@pytest.mark.parametrize('departure_time', [
+    # the next day, and a week later, in the same slot
+    _departure(2026, 10, 20, 9, 5),
+    _departure(2026, 10, 26, 9, 14),
+])
+def test_workdays_share_slots(travel_time_cache, departure_time):
+    found, _ = _lookup(travel_time_cache, departure_time)
+    assert found[:3].all()
+
+
+@pytest.mark.parametrize('departure_time', [
+    # the next slot
+    _departure(2026, 10, 19, 9, 15),
+    # a Saturday
+    _departure(2026, 10, 24, 9),
+])
+def test_other_slots_miss(travel_time_cache, departure_time):
+    found, _ = _lookup(travel_time_cache, departure_time)
+    assert not found.any()
+
+
+def test_walking_ignores_departure_time(tmp_path):
+    travel_time_cache = cache.TravelTimeCache(str(tmp_path / 'travel_times.sqlite'))
+    travel_time_cache.insert(LATS, LNGS, [600, 700, 800], *ORIGIN, 'walking')
+    found, _ = _lookup(travel_time_cache, None, 'walking')
+    assert found[:3].all()
+    found, _ = _lookup(travel_time_cache, _departure(2026, 10, 19, 9), 'walking')
+    assert not found.any()
+    travel_time_cache.close()
+
+
+def test_day_classes_keep_days_apart(tmp_path):
+    travel_time_cache = cache.TravelTimeCache(str(tmp_path / 'travel_times.sqlite'), day_classes=tuple(range(7)))
+    travel_time_cache.insert(LATS, LNGS, [600, 700, 800], *ORIGIN, 'transit', _departure(2026, 10, 19, 9))
+    assert _lookup(travel_time_cache, _departure(2026, 10, 26, 9))[0][:3].all()
+    assert not _lookup(travel_time_cache, _departure(2026, 10, 20, 9))[0].any()
+    travel_time_cache.close()
+
+
+def test_slot_lengths_are_cached_apart(tmp_path):
+    path = str(tmp_path / 'travel_times.sqlite')
+    coarse = cache.TravelTimeCache(path)
+    coarse.insert(LATS, LNGS, [600, 700, 800], *ORIGIN, 'transit', _departure(2026, 10, 19, 9, 10))
+    coarse.close()
+    fine = cache.TravelTimeCache(path, slot_seconds=300)
+    # 09:00 shares the coarse slot of 09:10, but not a fine one
+    assert not _lookup(fine, _departure(2026, 10, 19, 9))[0].any()
+    fine.insert(LATS, LNGS, [500, 600, 700], *ORIGIN, 'transit', _departure(2026, 10, 19, 9))
+    assert not _lookup(fine, _departure(2026, 10, 19, 9, 5))[0].any()
+    fine.close()
+    coarse = cache.TravelTimeCache(path)
+    np.testing.assert_array_equal(_lookup(coarse, _departure(2026, 10, 19, 9))[1][:3], [600, 700, 800])
+    coarse.close()
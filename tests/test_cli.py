@@ -0,0 +1,31 @@
+import json
+import os
+import pytest
+import cli
+from bench.standin import StandInServer, uniform_speed
+from mapping import dataset, draw
+
+SETTINGS = {'API_key': 'key', 'origins': [('Origin', {'origin_lat': 51.5, 'origin_lng': -0.1})],
+            'data_names': ['streamed'], 'travel_mode': 'walking', 'map_type': 'local',
+            'global_coords': None, 'N': 20, 'cutoff_mins': [0, 20, 40, 60, 80]}
+
+
+@pytest.fixture
+def working_directory(tmp_path, monkeypatch):
+    # the commands read and write data/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_run_replaces_streamed_preview_geojson(working_directory):
+    with StandInServer(speed_field=uniform_speed()) as server:
+        # 4 chunks, so the last preview is drawn after 3 of them
+        args = cli.make_parser().parse_args(['run', '--stream', '3', '--api-url', server.url])
+        cli.run(SETTINGS, args)
+    with open(cli.geojson_path('streamed')) as geojson_file:
+        saved = json.load(geojson_file)
+    hull_arrays = dataset.load_hull_arrays(cli.hull_path('streamed'))
+    expected = json.loads(json.dumps(draw.hull_arrays_to_geojson(hull_arrays, SETTINGS['cutoff_mins'])))
+    assert saved == expected
+    assert len(saved['features'])
+    assert os.path.exists(cli.map_path('streamed'))
@@ -0,0 +1,49 @@
+import json
+import numpy as np
+import cli
+from mapping import configure, contour, dataset, draw, generate, transform
+
+ORIGIN = {'origin_lat': 51.5, 'origin_lng': -0.1}
+CUTOFF_MINS = [0, 10, 20, 30]
+
+
+def _lattice():
+    lats, lngs = generate.generate_points('local', 30, ORIGIN, None)
+    lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+    # walking from the origin, or from a stop reached after 10 minutes
+    travel_times = np.minimum(np.hypot((lats - 51.5)*111e3, (lngs + 0.1)*69e3),
+                              600*1.4 + np.hypot((lats - 51.52)*111e3, (lngs + 0.06)*69e3))/1.4
+    return lats, lngs, travel_times
+
+
+def test_contour_arrays_have_the_shape_of_hull_arrays():
+    lats, lngs, travel_times = _lattice()
+    contour_arrays = contour.generate_contour_arrays(lats, lngs, travel_times, CUTOFF_MINS)
+    hull_arrays = transform.generate_hull_arrays(transform.group_coords(lats, lngs, travel_times, CUTOFF_MINS))
+    # a list of islands for each cutoff time, and one covering every point
+    assert len(contour_arrays) == len(hull_arrays) == len(CUTOFF_MINS)
+    assert [len(islands) for islands in contour_arrays] == [len(islands) for islands in hull_arrays]
+    for islands in contour_arrays:
+        for island in islands:
+            assert island.ndim == 2 and island.shape[1] == 2 and island.dtype == float
+            # (longitude, latitude), closed
+            assert lngs.min() - 1e-9 <= island[:, 0].min() and island[:, 0].max() <= lngs.max() + 1e-9
+            assert lats.min() - 1e-9 <= island[:, 1].min() and island[:, 1].max() <= lats.max() + 1e-9
+            np.testing.assert_array_equal(island[0], island[-1])
+
+    my_map = draw.draw_folium_map(contour_arrays, CUTOFF_MINS, draw.default_cmap(), **ORIGIN)
+    html = my_map.get_root().render()
+    assert html.count('L.polygon(') == sum(len(islands) for islands in contour_arrays[:-1])
+
+
+def test_hulls_contour_saves_contour_arrays(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    settings = {'data_names': ['contoured'], 'cutoff_mins': CUTOFF_MINS}
+    lats, lngs, travel_times = _lattice()
+    dataset.TravelTimeDataset.create(configure.dataset_path('contoured')).append_round(lats, lngs, travel_times)
+    args = cli.make_parser().parse_args(['hulls', '--contour', '--num-bins', '-1'])
+    cli.hulls(settings, args, [(lats, lngs, travel_times)])
+    saved = dataset.load_hull_arrays(cli.hull_path('contoured'))
+    expected = contour.generate_contour_arrays(lats, lngs, travel_times, CUTOFF_MINS)
+    assert json.dumps(draw.hull_arrays_to_geojson(saved, CUTOFF_MINS)) == \
+        json.dumps(draw.hull_arrays_to_geojson(expected, CUTOFF_MINS))
@@ -0,0 +1,48 @@
+import os
+import numpy as np
+from mapping import configure, dataset
+
+
+def test_rounds_are_read_back(tmp_path):
+    path = str(tmp_path / ('run' + dataset.DATASET_SUFFIX))
+    data = dataset.TravelTimeDataset.create(path, travel_mode='transit')
+    data.append_round([51.5, 51.6], [-0.1, -0.2], [600, 700], [51.7], [-0.3])
+    data.append_round([51.8], [-0.4], [800])
+    reopened = dataset.TravelTimeDataset(path)
+    assert reopened.metadata == {'travel_mode': 'transit'}
+    np.testing.assert_array_equal(reopened.travel_times, [600, 700, 800])
+    np.testing.assert_array_equal(reopened.failed_lats, [51.7])
+    reopened.compact()
+    assert len(dataset.TravelTimeDataset(path).rounds) == 1
+    np.testing.assert_array_equal(dataset.TravelTimeDataset(path).lats, [51.5, 51.6, 51.8])
+
+
+def test_create_replaces_dataset_left_by_interrupted_fetch(tmp_path):
+    path = str(tmp_path / ('run' + dataset.DATASET_SUFFIX))
+    dataset.TravelTimeDataset.create(path, departure_time='0')
+    # columns written by an append interrupted before its header was
+    np.save(os.path.join(path, '00000_lats.npy'), np.array([51.5]))
+    other_file = os.path.join(path, 'notes.txt')
+    open(other_file, 'w').close()
+
+    data = dataset.TravelTimeDataset.create(path, departure_time='900')
+    assert data.metadata == {'departure_time': '900'}
+    assert not data.rounds
+    assert not os.path.exists(os.path.join(path, '00000_lats.npy'))
+    assert os.path.exists(other_file)
+    data.append_round([51.6], [-0.2], [600])
+    np.testing.assert_array_equal(dataset.TravelTimeDataset(path).lats, [51.6])
+
+
+def test_dataset_without_travel_times_is_fetched_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = configure.dataset_path('run')
+    # every destination was unreachable
+    dataset.TravelTimeDataset.create(path).append_round([], [], [], [51.5], [-0.1])
+    lats, lngs, travel_times = configure.import_data('run')
+    assert not len(travel_times)
+    data = dataset.TravelTimeDataset.create(path)
+    data.append_round([51.5], [-0.1], [600])
+    np.testing.assert_array_equal(configure.import_data('run')[2], [600])
+    assert sorted(os.listdir(path)) == ['00000_failed_lats.npy', '00000_failed_lngs.npy', '00000_lats.npy',
+                                        '00000_lngs.npy', '00000_travel_times.npy', 'header.json']
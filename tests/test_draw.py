@@ -0,0 +1,49 @@
+import json
+import os
+import numpy as np
+from mapping import draw
+
+CUTOFF_MINS = [0, 10, 20, 30]
+
+
+def _square(lat, lng, half):
+    return np.array([[lat - half, lng - half], [lat + half, lng - half],
+                     [lat + half, lng + half], [lat - half, lng + half]])
+
+
+def _hull_arrays():
+    # nested squares, the last cutoff (every point) is not drawn
+    return [[_square(51.5, -0.1, 0.01*size)] for size in (1, 2, 3)]
+
+
+def test_compact_map_links_external_layers(tmp_path):
+    path = str(tmp_path / 'maps' / 'compact.html')
+    os.makedirs(os.path.dirname(path))
+    working_directory = os.getcwd()
+    draw.save_compact_map(path, _hull_arrays(), CUTOFF_MINS, draw.default_cmap(), 51.5, -0.1)
+    assert os.getcwd() == working_directory
+
+    assert sorted(os.listdir(str(tmp_path / 'maps' / 'compact_layers'))) == ['band_10.geojson', 'band_20.geojson']
+    with open(str(tmp_path / 'maps' / 'compact_layers' / 'band_20.geojson')) as geojson_file:
+        band = json.load(geojson_file)['features'][0]
+    assert band['properties'] == {'from_mins': 10, 'to_mins': 20}
+    # the band is the outer square with the inner one cut out
+    assert len(band['geometry']['coordinates'][0]) == 2
+
+    with open(path) as html_file:
+        page = html_file.read()
+    # the page loads each band relative to itself, without embedding its coordinates
+    assert '"compact_layers/band_10.geojson"' in page
+    assert '"compact_layers/band_20.geojson"' in page
+    assert str(tmp_path) not in page
+    assert '51.49' not in page
+
+
+def test_compact_map_embeds_layers(tmp_path):
+    path = str(tmp_path / 'embedded.html')
+    draw.save_compact_map(path, _hull_arrays(), CUTOFF_MINS, draw.default_cmap(), 51.5, -0.1, external=False)
+    assert not os.path.exists(str(tmp_path / 'embedded_layers'))
+    with open(path) as html_file:
+        page = html_file.read()
+    assert 'band_10.geojson' not in page
+    assert '51.49' in page
@@ -0,0 +1,68 @@
+import time
+import numpy as np
+import pytest
+from bench.standin import StandInServer
+from mapping import fetch, generate
+
+ORIGIN = {'origin_lat': 51.5, 'origin_lng': -0.1}
+
+
+def _retrieve(server, lats, lngs, **kwargs):
+    kwargs.setdefault('requests_per_second', None)
+    kwargs.setdefault('elements_per_second', None)
+    return generate.retrieve_travel_times(lats, lngs, 'key', 'transit', departure_time='0',
+                                          api_url=server.url, backoff=0, **ORIGIN, **kwargs)
+
+
+@pytest.fixture
+def lattice():
+    # 900 destinations, so 9 chunks of 100
+    return generate.generate_points('local', 30, ORIGIN, None)
+
+
+def test_concurrent_fetch_matches_serial(lattice):
+    # some destinations are ZERO_RESULTS and some requests fail with UNKNOWN_ERROR before a retry
+    with StandInServer(unreachable_rate=0.1, error_rate=0.3, seed=1) as server:
+        serial = _retrieve(server, *lattice, max_workers=1, retries=10)
+        concurrent = _retrieve(server, *lattice, max_workers=8, retries=10)
+    assert len(serial[0]) < len(lattice[0])
+    for serial_array, concurrent_array in zip(serial, concurrent):
+        assert np.array_equal(serial_array, concurrent_array)
+
+
+def test_unreachable_destinations_are_dropped(lattice):
+    with StandInServer(unreachable_rate=0.1) as server:
+        lats, lngs, travel_times = _retrieve(server, *lattice, max_workers=8)
+        unreachable = server._unreachable(*lattice)
+    assert unreachable.any()
+    assert np.array_equal(lats, lattice[0][~unreachable])
+    assert np.array_equal(lngs, lattice[1][~unreachable])
+    assert not np.isnan(travel_times).any()
+
+
+def test_failed_chunk_raises(lattice):
+    # every request fails, so no chunk can be answered
+    with StandInServer(error_rate=1.0) as server:
+        with pytest.raises(RuntimeError, match='9 of 9 chunks failed'):
+            _retrieve(server, *lattice, max_workers=8, retries=1)
+
+
+def test_token_bucket_limits_rate():
+    bucket = fetch.TokenBucket(rate=100, capacity=10)
+    start = time.monotonic()
+    for _ in range(50):
+        bucket.consume(1)
+    # the first 10 tokens are held in the bucket, the other 40 arrive at 100 per second
+    assert time.monotonic() - start >= 0.4*0.95
+
+
+def test_fetch_keeps_request_rate_within_limit():
+    # 1600 destinations, so 16 chunks
+    lats, lngs = generate.generate_points('local', 40, ORIGIN, None)
+    with StandInServer() as server:
+        start = time.monotonic()
+        _retrieve(server, lats, lngs, max_workers=8, requests_per_second=8)
+        elapsed = time.monotonic() - start
+        assert server.requests == 16
+    # the bucket holds one second's worth of requests, the other 8 are sent at 8 per second
+    assert elapsed >= (16 - 8)/8*0.95
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Polygon
+from geomath import hulls
+
+
+def test_orientation():
+    assert hulls.orientation((0, 0), (1, 0), (1, 1)) == 1
+    assert hulls.orientation((0, 0), (1, 0), (1, -1)) == -1
+    assert hulls.orientation((0, 0), (2, 2), (1, 1)) == 0
+
+
+def test_orientation_is_exact_when_nearly_collinear():
+    # the floating point determinant is too small to trust, the rational one is not
+    assert hulls.orientation((0, 0), (3, 3), (1, 1 + 2**-52)) == 1
+    assert hulls.orientation((0, 0), (3, 3), (1, 1 - 2**-53)) == -1
+    assert hulls.orientation((0.5, 0.5), (1e8, 1e8), (3.0, 3.0)) == 0
+
+
+@pytest.mark.parametrize('a, b, c, d, expected', [
+    # crossing
+    ((0, 0), (2, 2), (0, 2), (2, 0), True),
+    # collinear and overlapping
+    ((0, 0), (2, 0), (1, 0), (3, 0), True),
+    # collinear, one inside the other
+    ((0, 0), (4, 0), (1, 0), (2, 0), True),
+    # collinear and apart
+    ((0, 0), (1, 0), (2, 0), (3, 0), False),
+    # touching at end points
+    ((0, 0), (1, 1), (1, 1), (2, 0), True),
+    # an end point touching the middle of the other
+    ((0, 0), (2, 0), (1, 0), (1, 1), True),
+    # parallel
+    ((0, 0), (2, 0), (0, 1), (2, 1), False),
+    # would cross if extended
+    ((0, 0), (1, 1), (3, 0), (2, 1), False),
+])
+def test_segments_intersect(a, b, c, d, expected):
+    assert hulls.segments_intersect(a, b, c, d) == expected
+    assert hulls.segments_intersect(c, d, a, b) == expected
+
+
+def _index(*vertices, grid=None):
+    """SegmentIndex holding the line through the vertices"""
+    points = np.asarray(grid if grid is not None else vertices, dtype=float)
+    index = hulls.SegmentIndex(points)
+    for p, q in zip(vertices[:-1], vertices[1:]):
+        index.add(p, q)
+    return index
+
+
+def test_next_edge_may_share_the_last_end_point():
+    index = _index((0, 0), (1, 0), (1, 1))
+    assert not index.creates_intersection((1, 1), (0, 1))
+
+
+def test_next_edge_doubling_back_over_the_last_one_intersects():
+    index = _index((0, 0), (2, 0))
+    assert index.creates_intersection((2, 0), (1, 0))
+    # turning back at an angle only shares the end point
+    assert not index.creates_intersection((2, 0), (1, 0.1))
+
+
+def test_next_edge_touching_an_earlier_vertex_intersects():
+    index = _index((0, 0), (2, 0), (2, 2), (1, 2))
+    assert index.creates_intersection((1, 2), (2, 0))
+    assert index.creates_intersection((1, 2), (1, 0))
+
+
+def test_closing_edge_may_return_to_the_first_point():
+    index = _index((0, 0), (2, 0), (2, 2), (0, 2))
+    assert not index.creates_intersection((0, 2), (0, 0), closing=True)
+    # without closing, ending on the first point touches the first edge
+    assert index.creates_intersection((0, 2), (0, 0), closing=False)
+
+
+def test_closing_edge_overlapping_the_first_edge_intersects():
+    # running back along the first edge past the first point
+    index = _index((0, 0), (2, 0), (2, 1), (3, 0))
+    assert index.creates_intersection((3, 0), (0, 0), closing=True)
+    # collinear with the first edge, but only sharing the first point
+    index = _index((1, 0), (3, 0), (3, 1), (0, 0))
+    assert not index.creates_intersection((0, 0), (1, 0), closing=True)
+
+
+def test_segments_straddling_grid_cells():
+    # 100 points spanning a 9 x 9 square give cells of side 0.9
+    grid = np.mgrid[0:10, 0:10].reshape(2, -1).T + 0.5
+    index = _index((0.5, 0.5), (9.5, 9.5), (9.5, 0.5), grid=grid)
+    assert index.cell_size == pytest.approx(0.9)
+    # crosses the long diagonal far from both its end cells
+    assert index.creates_intersection((9.5, 0.5), (0.5, 9.2))
+    # crosses exactly on a cell boundary
+    boundary = index.origin[0] + 5*index.cell_size
+    assert index.creates_intersection((9.5, 0.5), (boundary - 0.5, boundary + 0.5))
+    # runs alongside the diagonal through the same cells without touching it
+    assert not index.creates_intersection((9.5, 0.5), (6.0, 5.9))
+
+
+def test_matches_shapely_on_random_lines():
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        vertices = [tuple(vertex) for vertex in rng.randint(0, 6, (8, 2)).astype(float)]
+        if any(p == q for p, q in zip(vertices[:-1], vertices[1:])):
+            continue
+        index = hulls.SegmentIndex(np.asarray(vertices))
+        index.add(vertices[0], vertices[1])
+        for end in range(2, len(vertices)):
+            # shapely takes a line back to its first point as a ring
+            closing = vertices[end] == vertices[0]
+            expected = not LineString(vertices[:end + 1]).is_simple
+            assert index.creates_intersection(vertices[end - 1], vertices[end], closing=closing) == expected
+            if expected or closing:
+                break
+            index.add(vertices[end - 1], vertices[end])
+
+
+def test_concave_hull_is_simple_and_covers_every_point():
+    rng = np.random.RandomState(1)
+    angles = rng.uniform(0, 2*np.pi, 300)
+    radii = np.sqrt(rng.uniform(0, 1, 300))*(1 + 0.5*np.cos(3*angles))
+    points = np.column_stack([-0.1 + 0.01*radii*np.cos(angles), 51.5 + 0.01*radii*np.sin(angles)])
+    for search in ('linear', 'gallop'):
+        hull = hulls.ConcaveHull(points, search=search).calculate()
+        assert hull is not None
+        assert Polygon(hull).is_valid
+        assert len(hulls.find_uncovered(hull, points, stop_early=False)) == 0
+
+
+def test_failed_attempts_report_uncovered_points():
+    rng = np.random.RandomState(0)
+    # an island of 40 points away from the others can never be covered
+    island = rng.uniform(0, 0.2, (40, 2)) + [1.5, 0.4]
+    points = np.vstack([rng.uniform(0, 1, (200, 2)), island])*0.01 + [-0.1, 51.5]
+    for search in ('linear', 'gallop'):
+        concave_hull = hulls.ConcaveHull(points, search=search)
+        assert concave_hull.calculate() is None
+        assert len(concave_hull.trials) == concave_hull.attempts
+        traced = [uncovered for _, uncovered in concave_hull.trials if uncovered is not None]
+        assert traced
+        for uncovered in traced:
+            np.testing.assert_array_equal(uncovered, np.arange(200, 240))
+
+
+def test_last_trial_is_the_covering_hull():
+    rng = np.random.RandomState(1)
+    angles = rng.uniform(0, 2*np.pi, 300)
+    radii = np.sqrt(rng.uniform(0, 1, 300))*(1 + 0.5*np.cos(3*angles))
+    points = np.column_stack([-0.1 + 0.01*radii*np.cos(angles), 51.5 + 0.01*radii*np.sin(angles)])
+    concave_hull = hulls.ConcaveHull(points, search='gallop')
+    hull = concave_hull.calculate()
+    assert concave_hull.trials[-1] == (concave_hull.k, concave_hull.uncovered)
+    assert len(concave_hull.uncovered) == 0
+    assert len(hulls.find_uncovered(hull, points, stop_early=False)) == 0
@@ -0,0 +1,46 @@
+import datetime as dt
+import numpy as np
+import pytest
+from bench.standin import StandInServer
+from mapping import cache, generate, sweep
+
+ORIGIN = {'origin_lat': 51.5, 'origin_lng': -0.1}
+
+
+def _sweep(server, travel_time_cache, departure_times, travel_mode='transit'):
+    # 400 destinations, so 4 chunks of 100
+    lats, lngs = generate.generate_points('local', 20, ORIGIN, None)
+    return list(sweep.iter_sweep(lats, lngs, 'key', travel_mode, departure_times_=departure_times,
+                                 requests_per_second=None, elements_per_second=None, cache=travel_time_cache,
+                                 api_url=server.url, backoff=0, **ORIGIN))
+
+
+@pytest.mark.parametrize('every_mins', [5, 10, 15, 30])
+def test_every_departure_is_fetched(tmp_path, every_mins):
+    departure_times = sweep.departure_times(dt.time(7), dt.time(7, 30), every_mins)
+    travel_time_cache = sweep.sweep_cache(str(tmp_path / 'travel_times.sqlite'), every_mins)
+    with StandInServer() as server:
+        results = _sweep(server, travel_time_cache, departure_times)
+    travel_time_cache.close()
+    assert server.requests == 4*len(departure_times)
+    assert [departure_time for departure_time, _ in results] == departure_times
+
+
+def test_default_slots_answer_close_departures_from_the_cache(tmp_path):
+    departure_times = sweep.departure_times(dt.time(7), dt.time(7, 10), 5)
+    travel_time_cache = cache.TravelTimeCache(str(tmp_path / 'travel_times.sqlite'))
+    with StandInServer() as server:
+        _sweep(server, travel_time_cache, departure_times)
+    travel_time_cache.close()
+    # 07:05 and 07:10 share the 15 minute slot of 07:00
+    assert server.requests == 4
+
+
+def test_walking_is_fetched_once(tmp_path):
+    departure_times = sweep.departure_times(dt.time(7), dt.time(8), 15)
+    travel_time_cache = sweep.sweep_cache(str(tmp_path / 'travel_times.sqlite'), 15)
+    with StandInServer() as server:
+        results = _sweep(server, travel_time_cache, departure_times, 'walking')
+    travel_time_cache.close()
+    assert server.requests == 4
+    assert all(np.array_equal(results[0][1][2], travel_times) for _, (_, _, travel_times) in results)
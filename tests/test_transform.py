@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from mapping import generate, transform
+
+ORIGIN = {'origin_lat': 51.5, 'origin_lng': -0.1}
+CUTOFF_MINS = [0, 10, 20, 30, 40]
+
+
+@pytest.fixture(scope='module')
+def grouped():
+    lats, lngs = generate.generate_points('local', 30, ORIGIN, None)
+    lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+    # walking from the origin, or from two stops reached after a wait, giving several islands
+    travel_times = np.hypot((lats - 51.5)*111e3, (lngs + 0.1)*69e3)/1.4
+    for lat, lng, wait in [(51.52, -0.06, 900), (51.48, -0.14, 1500)]:
+        travel_times = np.minimum(travel_times, wait + np.hypot((lats - lat)*111e3, (lngs - lng)*69e3)/1.4)
+    return transform.group_coords(lats, lngs, travel_times, CUTOFF_MINS)
+
+
+def _assert_same_hull_arrays(cutoff_hull_arrays, expected):
+    assert [len(islands) for islands in cutoff_hull_arrays] == [len(islands) for islands in expected]
+    for islands, expected_islands in zip(cutoff_hull_arrays, expected):
+        for hull_array, expected_hull_array in zip(islands, expected_islands):
+            if expected_hull_array is None:
+                assert hull_array is None
+            else:
+                np.testing.assert_array_equal(hull_array, expected_hull_array)
+
+
+@pytest.mark.parametrize('hull_search', ['linear', 'gallop'])
+def test_parallel_hulls_match_serial_hulls(grouped, hull_search):
+    serial = transform.generate_hull_arrays(grouped, hull_search=hull_search)
+    assert sum(len(islands) for islands in serial) > len(serial)
+    # the workers read every island from one shared memory block
+    parallel = transform.generate_hull_arrays(grouped, hull_search=hull_search, processes=2)
+    _assert_same_hull_arrays(parallel, serial)
+
+
+def test_shared_memory_hulls_match_calculate_hull():
+    rng = np.random.RandomState(0)
+    # islands of different sizes, including the 3 points of a padded island
+    point_sets = [rng.uniform(0, 0.01, (size, 2)) + [-0.1, 51.5] for size in (3, 40, 250, 12)]
+    results = transform.calculate_hulls_parallel(point_sets, processes=2)
+    for points, (hull_array, attempts, k) in zip(point_sets, results):
+        expected_hull_array, expected_attempts, expected_k = transform.calculate_hull(points)
+        np.testing.assert_array_equal(hull_array, expected_hull_array)
+        assert (attempts, k) == (expected_attempts, expected_k)
+
+
+def _by_island(islands):
+    # islands are created in a different order when tracked
+    return sorted((hull_array for hull_array in islands if hull_array is not None), key=lambda ring: ring.tobytes())
+
+
+def test_incremental_hulls_match_full_recomputation(grouped):
+    full = transform.generate_hull_arrays(grouped)
+    incremental = transform.generate_hull_arrays(grouped, incremental=True)
+    assert len(incremental) == len(full) >= 2
+    for islands, expected in zip(incremental, full):
+        assert len(islands) == len(expected)
+        for hull_array, expected_hull_array in zip(_by_island(islands), _by_island(expected)):
+            np.testing.assert_array_equal(hull_array, expected_hull_array)
+
+
+def _same_partition(labels, other_labels):
+    pairs = set(zip(labels, other_labels))
+    return len(pairs) == len(set(labels)) == len(set(other_labels))
+
+
+@pytest.mark.parametrize('method', ['auto', 'lattice', 'tree'])
+def test_labels_partition_points_as_dbscan(grouped, method):
+    rng = np.random.RandomState(0)
+    # a 40 x 25 lattice with steps of 0.002 and 0.003, as generate.generate_points makes, with holes
+    lngs, lats = [axis.flatten() for axis in np.meshgrid(-0.1 + 0.003*np.arange(40), 51.5 + 0.002*np.arange(25))]
+    kept = rng.uniform(size=len(lats)) < 0.55
+    point_sets = [np.column_stack((lngs[kept], lats[kept]))]
+    # the cumulative bins of group_coords, which repeat points
+    point_sets.extend(grouped.values())
+    for points in point_sets:
+        expected = transform.label_points(points, method='dbscan')
+        labels = transform.label_points(points, method=method)
+        assert _same_partition(labels, expected)
+        # numbered in order of first appearance, as DBSCAN does
+        np.testing.assert_array_equal(labels, expected)
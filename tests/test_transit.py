@@ -0,0 +1,211 @@
+import datetime as dt
+import zipfile
+import numpy as np
+import pytest
+from geomath.projection import to_metres
+from mapping import transit
+
+# a Monday
+DATE = dt.date(2026, 10, 19)
+CALENDAR = 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n' \
+           'WK,1,1,1,1,1,0,0,20260101,20271231\n' \
+           'EXTRA,1,1,1,1,1,0,0,20260101,20271231\n'
+
+# line 1 runs east from A to D, line 2 north from E, a short walk from C, to F
+STOPS = {'A': (51.5, -0.10), 'B': (51.5, -0.09), 'C': (51.5, -0.08), 'D': (51.5, -0.07),
+         'E': (51.5015, -0.08), 'H': (51.51, -0.08), 'F': (51.52, -0.08)}
+TRIPS = {
+    # H is untimed, so is interpolated to 08:25
+    'line2': ('WK', [('E', '08:15:00'), ('H', ''), ('F', '08:35:00')]),
+    # leaves A first and is overtaken by the express, B and C are interpolated
+    'slow': ('WK', [('A', '08:00:00'), ('B', ''), ('C', ''), ('D', '08:30:00')]),
+    'express': ('WK', [('A', '08:05:00'), ('B', '08:08:00'), ('C', '08:11:00'), ('D', '08:14:00')]),
+    # removed by calendar_dates, or it would reach F at 08:20
+    'cancelled': ('EXTRA', [('E', '08:14:00'), ('F', '08:20:00')]),
+}
+
+
+def _seconds(hours, minutes):
+    return hours*3600 + minutes*60
+
+
+def _write_feed(path, trips=TRIPS, stops=STOPS, calendar_dates='EXTRA,20261019,2\n', transfers=None):
+    """Write a GTFS zip of the stops and trips"""
+    with zipfile.ZipFile(str(path), 'w') as feed:
+        feed.writestr('stops.txt', 'stop_id,stop_name,stop_lat,stop_lon\n' + ''.join(
+            '{0},{0},{1},{2}\n'.format(stop, lat, lng) for stop, (lat, lng) in stops.items()) +
+            'STATION,Station without coordinates,,\n')
+        feed.writestr('trips.txt', 'route_id,service_id,trip_id\n' + ''.join(
+            'R,{},{}\n'.format(service, trip) for trip, (service, _) in trips.items()))
+        feed.writestr('stop_times.txt', 'trip_id,arrival_time,departure_time,stop_id,stop_sequence\n' + ''.join(
+            '{0},{2},{2},{1},{3}\n'.format(trip, stop, time, sequence)
+            for trip, (_, calls) in trips.items() for sequence, (stop, time) in enumerate(calls, 1)))
+        feed.writestr('calendar.txt', CALENDAR)
+        feed.writestr('calendar_dates.txt', 'service_id,date,exception_type\n' + calendar_dates)
+        if transfers is not None:
+            feed.writestr('transfers.txt', 'from_stop_id,to_stop_id,transfer_type,min_transfer_time\n' + transfers)
+    return str(path)
+
+
+def _connection_scan(timetable, access_stops, access_seconds, departure_seconds):
+    """
+    Earliest arrivals by scanning every connection in order of departure, with no limit on transfers
+
+    As in raptor, stops reached by vehicle can be walked on from once.
+    """
+    connections = []
+    for route in range(timetable.num_routes):
+        stops = timetable.route_stops[route]
+        arrivals, departures = timetable.route_arrivals[route][:-1], timetable.route_departures[route]
+        for trip in range(len(departures)):
+            for index in range(len(stops) - 1):
+                connections.append((departures[trip, index], arrivals[trip, index + 1],
+                                    stops[index], stops[index + 1], (route, trip)))
+    connections.sort(key=lambda connection: connection[0])
+    sources, targets, seconds = timetable.transfers_from(np.arange(timetable.num_stops))
+
+    # boardable holds the times stops are reached at, on foot or by vehicle
+    boardable = np.full(timetable.num_stops, np.inf)
+    np.minimum.at(boardable, access_stops, departure_seconds + access_seconds)
+    ridden = np.full(timetable.num_stops, np.inf)
+    boarded = set()
+    for departure, arrival, source, target, trip in connections:
+        if trip in boarded or boardable[source] <= departure:
+            boarded.add(trip)
+            if arrival < ridden[target]:
+                ridden[target] = arrival
+                boardable[target] = min(boardable[target], arrival)
+                for walked_to, walk in zip(targets[sources == target], seconds[sources == target]):
+                    boardable[walked_to] = min(boardable[walked_to], arrival + walk)
+    return np.minimum(ridden, boardable)
+
+
+def _random_feed(path, lines=6, stops_per_line=12, seed=0):
+    """Write a GTFS zip of a grid of lines with random headways, running times and timepoints"""
+    rng = np.random.default_rng(seed)
+    stops, trips = {}, {}
+    for line in range(lines):
+        offset = (line//2 - lines//4)*0.01
+        line_stops = []
+        for index in range(stops_per_line):
+            along = (index - stops_per_line/2)*0.004
+            stop = 'L{}S{}'.format(line, index)
+            stops[stop] = (51.5 + offset, -0.1 + along*1.5) if line % 2 else (51.5 + along, -0.1 + offset*1.5)
+            line_stops.append(stop)
+        headway = int(rng.integers(300, 1200))
+        for direction, calls in enumerate((line_stops, line_stops[::-1])):
+            start, number = _seconds(7, 0) + int(rng.integers(0, headway)), 0
+            while start < _seconds(10, 0):
+                time, times = start, []
+                for index, stop in enumerate(calls):
+                    timed = index % 3 == 0 or index == len(calls) - 1
+                    times.append((stop, '{:02d}:{:02d}:{:02d}'.format(time//3600, time % 3600//60, time % 60)
+                                  if timed else ''))
+                    time += int(rng.integers(60, 150))
+                trips['L{}D{}T{}'.format(line, direction, number)] = ('WK', times)
+                start, number = start + headway, number + 1
+    return _write_feed(path, trips, stops, calendar_dates='')
+
+
+@pytest.fixture
+def timetable(tmp_path):
+    return transit.load_gtfs(_write_feed(tmp_path / 'feed.zip'), DATE)
+
+
+def _arrivals(timetable, departure_seconds, stop='A', **raptor_kwargs):
+    """Earliest arrival at each stop id, leaving from a stop"""
+    arrivals = transit.raptor(timetable, np.array([timetable.stop_ids.index(stop)]), np.array([0.0]),
+                              departure_seconds, **raptor_kwargs)
+    return dict(zip(timetable.stop_ids, arrivals))
+
+
+def test_untimed_stops_are_interpolated(timetable):
+    slow = [route for route in range(timetable.num_routes)
+            if _seconds(8, 0) in timetable.route_departures[route][:, 0]][0]
+    np.testing.assert_array_equal(timetable.route_arrivals[slow][0],
+                                  [_seconds(8, 0), _seconds(8, 10), _seconds(8, 20), _seconds(8, 30)])
+    # line 2 is the only way to H
+    assert _arrivals(timetable, _seconds(8, 15), 'E')['H'] == _seconds(8, 25)
+
+
+def test_overtaking_trips_are_split_into_routes(timetable):
+    line1 = [route for route in range(timetable.num_routes) if len(timetable.route_stops[route]) == 4]
+    assert len(line1) == 2
+    arrivals = _arrivals(timetable, _seconds(7, 59))
+    # the slow trip is boarded first, but the express arrives everywhere sooner
+    assert arrivals['B'] == _seconds(8, 8)
+    assert arrivals['D'] == _seconds(8, 14)
+    arrivals = _arrivals(timetable, _seconds(8, 6))
+    assert arrivals['D'] == np.inf
+
+
+def test_transfer_walks_between_nearby_stops(timetable):
+    arrivals = _arrivals(timetable, _seconds(7, 59))
+    walk = arrivals['E'] - arrivals['C']
+    assert 100 < walk < 140
+    assert arrivals['F'] == _seconds(8, 35)
+
+
+def test_calendar_dates_remove_a_service(tmp_path, timetable):
+    # the cancelled trip only runs if its removal is left out
+    assert _arrivals(timetable, _seconds(7, 59))['F'] == _seconds(8, 35)
+    running = transit.load_gtfs(_write_feed(tmp_path / 'running.zip', calendar_dates=''), DATE)
+    assert _arrivals(running, _seconds(7, 59))['F'] == _seconds(8, 20)
+    assert transit.active_services([], [{'service_id': 'WK', 'date': '20261019', 'exception_type': '1'}],
+                                   DATE) == {'WK'}
+
+
+def test_transfers_txt_lengthens_and_forbids_transfers(tmp_path):
+    lengthened = transit.load_gtfs(_write_feed(tmp_path / 'lengthened.zip', transfers='C,E,2,300\n'), DATE)
+    arrivals = _arrivals(lengthened, _seconds(7, 59))
+    assert arrivals['E'] == _seconds(8, 16)
+    assert arrivals['F'] == np.inf
+    forbidden = transit.load_gtfs(_write_feed(tmp_path / 'forbidden.zip', transfers='C,E,3,\n'), DATE)
+    assert _arrivals(forbidden, _seconds(7, 59))['E'] == np.inf
+
+
+def test_max_transfers_cuts_off_later_vehicles(timetable):
+    arrivals = _arrivals(timetable, _seconds(7, 59), max_transfers=0)
+    # the walk after the first vehicle is still made
+    assert arrivals['D'] == _seconds(8, 14)
+    assert np.isfinite(arrivals['E'])
+    assert arrivals['F'] == np.inf
+    assert _arrivals(timetable, _seconds(7, 59), max_transfers=1)['F'] == _seconds(8, 35)
+
+
+def test_max_seconds_drops_later_arrivals(timetable):
+    arrivals = _arrivals(timetable, _seconds(7, 59), max_seconds=20*60)
+    assert arrivals['D'] == _seconds(8, 14)
+    assert arrivals['F'] == np.inf
+
+
+def test_retrieve_travel_times(timetable):
+    departure = (dt.datetime.combine(DATE, dt.time(7, 59)) - dt.datetime(1970, 1, 1)).total_seconds()
+    lats, lngs, travel_times = transit.retrieve_travel_times(
+        [STOPS['D'][0], 52.0], [STOPS['D'][1], 0.0], timetable, *STOPS['A'], str(int(departure)))
+    # the second destination is too far to walk to or from any stop
+    np.testing.assert_array_equal(lats, [STOPS['D'][0]])
+    # by the express, sooner than the half hour walk
+    assert travel_times[0] == 15*60
+
+
+@pytest.mark.parametrize('departure_seconds', [_seconds(7, 50), _seconds(7, 59), _seconds(8, 1), _seconds(8, 14)])
+def test_raptor_matches_connection_scan(timetable, departure_seconds):
+    access_stops = np.array([timetable.stop_ids.index('A'), timetable.stop_ids.index('E')])
+    access_seconds = np.array([0.0, 60.0])
+    np.testing.assert_array_equal(
+        transit.raptor(timetable, access_stops, access_seconds, departure_seconds, max_transfers=10),
+        _connection_scan(timetable, access_stops, access_seconds, departure_seconds))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_raptor_matches_connection_scan_on_random_feed(tmp_path, seed):
+    timetable = transit.load_gtfs(_random_feed(tmp_path / 'random.zip', seed=seed), DATE)
+    origin = to_metres(51.5, -0.1, 51.5)
+    distances = np.hypot(*(to_metres(timetable.stop_lats, timetable.stop_lngs, 51.5) - origin).T)
+    access_stops = np.flatnonzero(distances < 1000)
+    access_seconds = distances[access_stops]/1.4
+    expected = _connection_scan(timetable, access_stops, access_seconds, _seconds(8, 0))
+    assert np.isfinite(expected).sum() > timetable.num_stops//2
+    np.testing.assert_array_equal(
+        transit.raptor(timetable, access_stops, access_seconds, _seconds(8, 0), max_transfers=50), expected)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from geomath.projection import to_metres
+from mapping import walking
+
+# a street running east from A through B to C, and a side street north from B to D
+NODES = {'A': (51.5, -0.10), 'B': (51.5, -0.09), 'C': (51.5, -0.08), 'D': (51.51, -0.09)}
+EDGES = [('A', 'B'), ('B', 'C'), ('B', 'D')]
+
+
+def _metres(first, second):
+    """Straight-line distance between two nodes"""
+    points = to_metres(*zip(NODES[first], NODES[second]), np.mean([lat for lat, _ in NODES.values()]))
+    return np.hypot(*(points[0] - points[1]))
+
+
+def _write_edges(path, lengths=None):
+    columns = 'from_lat,from_lng,to_lat,to_lng' + (',length' if lengths else '')
+    rows = ['{},{},{},{}'.format(*NODES[first], *NODES[second]) + (',{}'.format(lengths[index]) if lengths else '')
+            for index, (first, second) in enumerate(EDGES)]
+    path.write_text('\n'.join([columns] + rows) + '\n')
+    return str(path)
+
+
+def _node(graph, name):
+    return int(graph.snap([NODES[name][0]], [NODES[name][1]])[0][0])
+
+
+def test_edge_list_merges_shared_ends(tmp_path):
+    graph = walking.read_edge_list(_write_edges(tmp_path / 'streets.csv'))
+    assert graph.num_nodes == 4
+    assert graph.num_edges == 3
+    distances = graph.distances_from(_node(graph, 'A'))
+    # lengths default to straight lines
+    np.testing.assert_allclose(distances[_node(graph, 'C')], _metres('A', 'B') + _metres('B', 'C'))
+    np.testing.assert_allclose(distances[_node(graph, 'D')], _metres('A', 'B') + _metres('B', 'D'))
+
+
+def test_edge_list_lengths_replace_straight_lines(tmp_path):
+    graph = walking.read_edge_list(_write_edges(tmp_path / 'streets.csv', lengths=[1000, 250, 2000]))
+    distances = graph.distances_from(_node(graph, 'A'))
+    np.testing.assert_allclose(distances[[_node(graph, name) for name in 'ABCD']], [0, 1000, 1250, 3000])
+
+
+def test_adjacency_keeps_the_shortest_duplicate_edge():
+    adjacency = walking._adjacency(np.array([0, 0, 1, 0]), np.array([1, 1, 2, 1]),
+                                   np.array([50.0, 20.0, 30.0, 40.0]), 3)
+    assert adjacency.nnz == 2
+    assert adjacency[0, 1] == 20
+    assert adjacency[1, 2] == 30
+
+    # the same street twice, as the shorter of the two
+    lats, lngs = zip(NODES['A'], NODES['B'])
+    graph = walking.StreetGraph(lats, lngs, [0, 1], [1, 0], lengths=[900, 700])
+    assert graph.num_edges == 1
+    np.testing.assert_allclose(graph.distances_from(0), [0, 700])
+
+
+@pytest.fixture
+def graph(tmp_path):
+    return walking.read_edge_list(_write_edges(tmp_path / 'streets.csv', lengths=[700, 700, 1400]))
+
+
+def test_destinations_beyond_max_seconds_are_unreachable(graph):
+    lats, lngs = zip(*(NODES[name] for name in 'ABCD'))
+    # 700m in 500s, 1400m in 1000s and 2100m in 1500s
+    reached_lats, reached_lngs, travel_times = walking.retrieve_travel_times(
+        lats, lngs, graph, *NODES['A'], walking_speed=1.4, max_seconds=1200)
+    np.testing.assert_array_equal(reached_lngs, [NODES[name][1] for name in 'ABC'])
+    np.testing.assert_array_equal(travel_times, [0, 500, 1000])
+
+
+def test_destinations_beyond_max_snap_are_unreachable(graph):
+    # 100m and 500m south of B, along a line of longitude
+    lats = [NODES['B'][0] - 100/111195, NODES['B'][0] - 500/111195]
+    lngs = [NODES['B'][1]]*2
+    reached_lats, _, travel_times = walking.retrieve_travel_times(lats, lngs, graph, *NODES['A'], max_snap=200)
+    np.testing.assert_allclose(reached_lats, lats[:1])
+    np.testing.assert_allclose(travel_times, [round((700 + 100)/1.4)], atol=1)
+
+    reached_lats, _, _ = walking.retrieve_travel_times(lats, lngs, graph, *NODES['A'], max_snap=1000)
+    np.testing.assert_allclose(reached_lats, lats)